@@ -2,26 +2,28 @@ import logging
 import os
 import secrets
 import hashlib
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 
 from fastapi import HTTPException, status
 from jose import JWTError, jwt
-import bcrypt as _bcrypt
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
 
 import models
 from services.token_blacklist import is_blacklisted, add_to_blacklist
+from services.user_cache import USER_CACHE_ENABLED, cache_user, get_cached_user
+from services.password_hasher import (
+    hash_password,
+    pwd_context,
+    verify_and_update_password,
+    verify_password,
+)
 
 security_logger = logging.getLogger("security")
 
-if not hasattr(_bcrypt, "__about__"):
-    class _About:
-        __version__ = getattr(_bcrypt, "__version__", "unknown")
-    _bcrypt.__about__ = _About()
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 if not JWT_SECRET_KEY:
     JWT_SECRET_KEY = os.getenv("API_KEY") or secrets.token_urlsafe(32)
@@ -32,22 +34,26 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
 REQUIRE_EMAIL_VERIFICATION = os.getenv("REQUIRE_EMAIL_VERIFICATION", "true").lower() == "true"
 ALLOW_EMAIL_DEBUG = os.getenv("ALLOW_EMAIL_DEBUG", "false").lower() == "true"
+# Cache de claims JWT ja verificados (0 desativa)
+JWT_CLAIMS_CACHE_SIZE = int(os.getenv("JWT_CLAIMS_CACHE_SIZE", "10000"))
 
-
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
-
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+# sha256(token) -> (claims, exp); ordem LRU
+_claims_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_claims_lock = threading.Lock()
+_claims_stats = {"hits": 0, "misses": 0, "evictions": 0}
 
 
 def authenticate_user(db: Session, email: str, password: str):
     user = db.query(models.User).filter(models.User.email == email).first()
     if not user or not user.is_active:
         return None
-    if not verify_password(password, user.password_hash):
+    valid, new_hash = verify_and_update_password(password, user.password_hash)
+    if not valid:
         return None
+    if new_hash:
+        # Fator de trabalho mudou: regravar o hash (vai no commit do login)
+        user.password_hash = new_hash
+        security_logger.info(f"Hash de senha atualizado para o usuario {user.id}")
     return user
 
 
@@ -66,7 +72,7 @@ def hash_token(token: str) -> str:
     return _hash_token(token)
 
 
-def create_refresh_token(db: Session, user_id: int, device_id: str | None = None) -> str:
+def create_refresh_token(db: Session, user_id: int, device_id: str | None = None, commit: bool = True) -> str:
     raw_token = secrets.token_urlsafe(48)
     token_id = secrets.token_hex(16)
     expires_at = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
@@ -80,7 +86,8 @@ def create_refresh_token(db: Session, user_id: int, device_id: str | None = None
         revoked=False
     )
     db.add(db_token)
-    db.commit()
+    if commit:
+        db.commit()
     return raw_token
 
 
@@ -103,6 +110,7 @@ def revoke_refresh_token(db: Session, token_hash: str, access_token: str = None)
                     expires_in = int(exp - now)
                     if expires_in > 0:
                         add_to_blacklist(access_token, expires_in)
+                forget_verified_token(access_token)
             except Exception as e:
                 security_logger.warning(f"Erro ao adicionar access token à blacklist: {e}")
 
@@ -163,28 +171,110 @@ def create_password_reset_token() -> str:
     return secrets.token_urlsafe(32)
 
 
+def _attach_cached_user(db: Session, projection: dict):
+    """
+    Monta um User persistente na sessao a partir da projecao em cache, sem
+    consultar o banco. Campos fora da projecao sao carregados sob demanda.
+    """
+    existing = db.identity_map.get(identity_key(models.User, projection["id"]))
+    if existing is not None:
+        return existing
+    user = models.User(**projection)
+    make_transient_to_detached(user)
+    db.add(user)
+    return user
+
+
+def _load_user(db: Session, user_id: int):
+    if USER_CACHE_ENABLED:
+        projection = get_cached_user(user_id)
+        if projection is not None:
+            return _attach_cached_user(db, projection)
+    user = db.query(models.User).filter(models.User.id == user_id).first()
+    if user and USER_CACHE_ENABLED:
+        cache_user(user)
+    return user
+
+
+def get_user_from_payload(db: Session, payload: dict):
+    """Carrega o usuario a partir de um payload JWT ja decodificado."""
+    user_id = payload.get("sub")
+    if not user_id:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    user = _load_user(db, int(user_id))
+    if not user or not user.is_active:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    if REQUIRE_EMAIL_VERIFICATION and not user.email_verified:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Email not verified")
+    return user
+
+
+def _verify_claims(token: str) -> dict:
+    """
+    Valida assinatura e claims do token, reaproveitando verificacoes anteriores.
+    Entradas ficam no cache ate o exp do proprio token; a blacklist continua
+    sendo consultada pelos chamadores antes de usar o resultado.
+    """
+    key = _hash_token(token)
+    now = time.time()
+    with _claims_lock:
+        cached = _claims_cache.get(key)
+        if cached is not None:
+            claims, exp = cached
+            if exp > now:
+                _claims_cache.move_to_end(key)
+                _claims_stats["hits"] += 1
+                return dict(claims)
+            del _claims_cache[key]
+        _claims_stats["misses"] += 1
+
+    try:
+        claims = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+
+    exp = claims.get("exp")
+    if JWT_CLAIMS_CACHE_SIZE > 0 and isinstance(exp, (int, float)):
+        with _claims_lock:
+            _claims_cache[key] = (dict(claims), float(exp))
+            _claims_cache.move_to_end(key)
+            while len(_claims_cache) > JWT_CLAIMS_CACHE_SIZE:
+                _claims_cache.popitem(last=False)
+                _claims_stats["evictions"] += 1
+    return claims
+
+
+def forget_verified_token(token: str) -> None:
+    """Remove o token do cache de claims (logout/revogacao)."""
+    with _claims_lock:
+        _claims_cache.pop(_hash_token(token), None)
+
+
+def clear_claims_cache() -> None:
+    with _claims_lock:
+        _claims_cache.clear()
+
+
+def get_claims_cache_stats() -> dict:
+    with _claims_lock:
+        lookups = _claims_stats["hits"] + _claims_stats["misses"]
+        return {
+            **_claims_stats,
+            "size": len(_claims_cache),
+            "max_size": JWT_CLAIMS_CACHE_SIZE,
+            "hit_ratio": round(_claims_stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+
 def get_user_from_token(db: Session, token: str):
     # Verificar blacklist antes de validar token
     if is_blacklisted(token):
+        forget_verified_token(token)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token revoked")
     
-    try:
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("sub")
-        if not user_id:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-        user = db.query(models.User).filter(models.User.id == int(user_id)).first()
-        if not user or not user.is_active:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-        if REQUIRE_EMAIL_VERIFICATION and not user.email_verified:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Email not verified")
-        return user
-    except JWTError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    payload = _verify_claims(token)
+    return get_user_from_payload(db, payload)
 
 
 def decode_token_payload(token: str) -> dict:
-    try:
-        return jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-    except JWTError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    return _verify_claims(token)
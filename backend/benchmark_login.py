@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark do fluxo de login (/api/auth/login).
+
+Executa logins sequenciais contra um banco SQLite temporário e reporta a
+latência (p50/p99) e, por login, o número de statements SQL e de commits.
+Emails/push ficam desativados (sem SMTP configurado) e o rate limiting é
+desligado durante a medição.
+
+Uso:
+    python benchmark_login.py [--requests 200] [--new-devices]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+_db_file = tempfile.NamedTemporaryFile(delete=False, suffix=".db")
+_db_file.close()
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_file.name}"
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("LICENSE_SECRET_KEY", "benchmark-secret-key-1234567890123456789012345678")
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import models
+from auth import hash_password
+from database import Base, SessionLocal, engine
+from main import app, limiter
+
+EMAIL = "benchmark@example.com"
+PASSWORD = "Bench1234!"
+
+
+def _create_user() -> None:
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = models.User(email=EMAIL, password_hash=hash_password(PASSWORD), is_active=True, email_verified=True)
+        db.add(user)
+        db.flush()
+        family = models.Family(name="Benchmark", admin_user_id=user.id)
+        db.add(family)
+        db.flush()
+        user.family_id = family.id
+        db.commit()
+    finally:
+        db.close()
+
+
+def _percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Latência e statements SQL por login")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--new-devices", action="store_true", help="um device_id novo a cada login")
+    args = parser.parse_args()
+
+    _create_user()
+    limiter.enabled = False
+    counters = {"statements": 0, "commits": 0}
+    event.listen(engine, "before_cursor_execute", lambda *a: counters.__setitem__("statements", counters["statements"] + 1))
+    event.listen(engine, "commit", lambda conn: counters.__setitem__("commits", counters["commits"] + 1))
+
+    client = TestClient(app)
+    latencies = []
+    for i in range(args.requests):
+        device_id = f"bench-{i}" if args.new_devices else "bench-device"
+        payload = {"email": EMAIL, "password": PASSWORD, "device": {"device_id": device_id}}
+        if i == 0:
+            # Aquecimento (cria a sessão do dispositivo); fora das métricas
+            client.post("/api/auth/login", json=payload)
+            counters.update(statements=0, commits=0)
+        start = time.perf_counter()
+        response = client.post("/api/auth/login", json=payload)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            print(f"login falhou: {response.status_code} {response.text}", file=sys.stderr)
+            return 1
+
+    print(f"logins:            {args.requests}")
+    print(f"p50:               {statistics.median(latencies):.2f} ms")
+    print(f"p99:               {_percentile(latencies, 99):.2f} ms")
+    print(f"statements/login:  {counters['statements'] / args.requests:.1f}")
+    print(f"commits/login:     {counters['commits'] / args.requests:.1f}")
+    os.unlink(_db_file.name)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Benchmark do overhead por requisição da pilha de middlewares.
+
+Compara, sobre um endpoint trivial e chamando a aplicação ASGI diretamente
+(sem rede nem cliente HTTP):
+- sem middlewares;
+- pilha anterior (BaseHTTPMiddleware + @app.middleware("http"), reproduzida aqui);
+- pilha atual (middlewares ASGI puros com headers pré-computados e PrefixTrie).
+
+Uso:
+    python benchmark_middleware.py [--requests 5000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("CSRF_MODE", "stateless")
+
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from middleware.csrf_middleware import CSRF_EXEMPT_PATHS, CSRFMiddleware
+from middleware.security_headers_middleware import SecurityHeadersMiddleware, DOCS_CSP, DEFAULT_CSP
+from middleware.validation_middleware import VALIDATION_REQUIRED_PATHS, ValidationMiddleware
+from services.csrf_service import create_stateless_csrf_token, verify_csrf_token
+from utils.validation import sanitize_input, validate_payload_size_detailed
+
+
+class LegacyCSRFMiddleware(BaseHTTPMiddleware):
+    """Implementação anterior (BaseHTTPMiddleware + any(startswith))."""
+
+    async def dispatch(self, request, call_next):
+        if any(request.url.path.startswith(path) for path in CSRF_EXEMPT_PATHS):
+            return await call_next(request)
+        if request.method in ["POST", "PUT", "PATCH"]:
+            csrf_token = request.headers.get("X-CSRF-Token")
+            if not csrf_token or not verify_csrf_token(csrf_token, None):
+                return JSONResponse(status_code=403, content={"detail": "Invalid CSRF token"})
+        return await call_next(request)
+
+
+class LegacyValidationMiddleware(BaseHTTPMiddleware):
+    """Implementação anterior (BaseHTTPMiddleware + any(startswith))."""
+
+    async def dispatch(self, request, call_next):
+        if request.method not in ["POST", "PUT", "PATCH"]:
+            return await call_next(request)
+        if not any(request.url.path.startswith(path) for path in VALIDATION_REQUIRED_PATHS):
+            return await call_next(request)
+        body = await request.body()
+        if body:
+            payload = json.loads(body.decode("utf-8"))
+            is_valid, error_message = validate_payload_size_detailed(payload)
+            if not is_valid:
+                return JSONResponse(status_code=413, content={"detail": error_message})
+            sanitized_body = json.dumps(sanitize_input(payload)).encode("utf-8")
+
+            async def receive():
+                return {"type": "http.request", "body": sanitized_body}
+
+            request._receive = receive
+        return await call_next(request)
+
+
+async def legacy_security_headers(request, call_next):
+    response = await call_next(request)
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    response.headers["X-Frame-Options"] = "DENY"
+    response.headers["X-XSS-Protection"] = "1; mode=block"
+    response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
+    path = request.url.path or ""
+    if path.startswith("/docs") or path.startswith("/redoc") or path.startswith("/openapi.json"):
+        response.headers["Content-Security-Policy"] = DOCS_CSP
+    else:
+        response.headers["Content-Security-Policy"] = DEFAULT_CSP
+    return response
+
+
+async def endpoint(request):
+    if request.method == "POST":
+        await request.body()
+    return PlainTextResponse("ok")
+
+
+def build_app(stack: str) -> Starlette:
+    app = Starlette(routes=[Route("/api/family/profiles", endpoint, methods=["GET", "POST"])])
+    if stack == "legacy":
+        app.add_middleware(LegacyCSRFMiddleware)
+        app.add_middleware(LegacyValidationMiddleware)
+        app.add_middleware(BaseHTTPMiddleware, dispatch=legacy_security_headers)
+    elif stack == "asgi":
+        app.add_middleware(CSRFMiddleware)
+        app.add_middleware(ValidationMiddleware)
+        app.add_middleware(SecurityHeadersMiddleware)
+    return app
+
+
+def make_scope(method: str, csrf_token: str) -> dict:
+    headers = [(b"content-type", b"application/json"), (b"x-csrf-token", csrf_token.encode())]
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": "/api/family/profiles", "raw_path": b"/api/family/profiles",
+        "root_path": "", "query_string": b"", "headers": headers,
+        "client": ("127.0.0.1", 5000), "server": ("testserver", 80),
+    }
+
+
+async def run(app, method: str, requests: int, csrf_token: str) -> float:
+    body = json.dumps({"name": "Maria", "notes": "texto"}).encode()
+
+    async def send(message):
+        if message["type"] == "http.response.start" and message["status"] != 200:
+            raise RuntimeError(f"status inesperado: {message['status']}")
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return {"type": "http.disconnect"}
+
+        await app(make_scope(method, csrf_token), receive, send)
+    return (time.perf_counter() - start) / requests * 1_000_000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Overhead por requisição da pilha de middlewares")
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    csrf_token = create_stateless_csrf_token(None)
+    results = {}
+    for stack in ("none", "legacy", "asgi"):
+        app = build_app(stack)
+        for method in ("GET", "POST"):
+            asyncio.run(run(app, method, 200, csrf_token))  # aquecimento
+            results[(stack, method)] = asyncio.run(run(app, method, args.requests, csrf_token))
+
+    print(f"{'pilha':<8} {'metodo':<6} {'us/req':>8} {'overhead':>9}")
+    for (stack, method), micros in results.items():
+        overhead = micros - results[("none", method)]
+        print(f"{stack:<8} {method:<6} {micros:>8.1f} {overhead:>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
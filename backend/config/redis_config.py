@@ -1,10 +1,27 @@
 """
 Configuração e cliente Redis reutilizável para rate limiting, blacklist e cache.
+
+O cliente usa um ConnectionPool explícito e um circuit breaker
+(closed -> open -> half_open). Com o breaker aberto, get_redis_client e
+is_redis_available retornam imediatamente e os serviços usam o fallback;
+a saúde da conexão é verificada por probe_redis (loop em segundo plano),
+e não mais com um PING a cada chamada. Com o loop de probe ativo, a
+tentativa half_open (reconexão com timeouts de alguns segundos) também
+fica só com ele; sem o loop, a requisição que encontra o circuito pronto
+para teste faz a tentativa.
+
+Código async (middlewares, handlers async) deve usar get_async_redis_client,
+um cliente redis.asyncio que compartilha o mesmo circuit breaker e não
+bloqueia o event loop.
 """
+import asyncio
 import os
 import logging
+import threading
+import time
 from typing import Optional
 import redis
+import redis.asyncio as aioredis
 from redis.exceptions import ConnectionError, TimeoutError
 
 logger = logging.getLogger(__name__)
@@ -16,42 +33,116 @@ REDIS_PASSWORD = os.getenv("REDIS_PASSWORD") or None
 REDIS_DB = int(os.getenv("REDIS_DB", "0"))
 REDIS_SOCKET_TIMEOUT = int(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
 REDIS_SOCKET_CONNECT_TIMEOUT = int(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", "5"))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_HEALTH_CHECK_SECONDS = float(os.getenv("REDIS_HEALTH_CHECK_SECONDS", "5"))
+# Falhas consecutivas para abrir o circuito e tempo aberto antes de testar de novo
+REDIS_BREAKER_FAILURE_THRESHOLD = int(os.getenv("REDIS_BREAKER_FAILURE_THRESHOLD", "3"))
+REDIS_BREAKER_RESET_SECONDS = float(os.getenv("REDIS_BREAKER_RESET_SECONDS", "30"))
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Circuit breaker simples para as chamadas ao Redis."""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.short_circuits = 0
+        self.trips = 0
+
+    def allow_attempt(self) -> bool:
+        """
+        True se uma tentativa de conexão pode ser feita agora. Com o circuito
+        aberto, libera uma única tentativa (half_open) após reset_seconds.
+        """
+        with self._lock:
+            if self.state == BREAKER_CLOSED:
+                return True
+            if self.state == BREAKER_OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = BREAKER_HALF_OPEN
+                return True
+            self.short_circuits += 1
+            return False
 
-# Cliente Redis global (singleton)
+    def short_circuit(self) -> None:
+        with self._lock:
+            self.short_circuits += 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != BREAKER_CLOSED:
+                logger.info("Circuit breaker do Redis fechado")
+            self.state = BREAKER_CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == BREAKER_HALF_OPEN or (
+                self.state == BREAKER_CLOSED and self.failures >= self.failure_threshold
+            ):
+                if self.state == BREAKER_CLOSED:
+                    logger.warning(f"Circuit breaker do Redis aberto após {self.failures} falhas")
+                self.state = BREAKER_OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+
+
+# Cliente Redis global (singleton) sobre um pool explícito
+_redis_pool: Optional[redis.ConnectionPool] = None
 _redis_client: Optional[redis.Redis] = None
 _redis_available: bool = False
+_redis_connected_host: Optional[str] = None
+# (event loop, cliente) - conexões redis.asyncio pertencem a um único loop
+_async_client: Optional[tuple] = None
+_connect_lock = threading.Lock()
+_breaker = CircuitBreaker(REDIS_BREAKER_FAILURE_THRESHOLD, REDIS_BREAKER_RESET_SECONDS)
+# True enquanto o loop de probe em segundo plano estiver rodando
+_background_probe = False
 
 
-def get_redis_client() -> Optional[redis.Redis]:
-    """
-    Retorna o cliente Redis reutilizável.
-    Retorna None se Redis não estiver disponível.
-    Tenta múltiplas opções de conexão (localhost, IP do WSL, etc).
-    """
-    global _redis_client, _redis_available
-    
-    # Se já temos um cliente e está disponível, retornar
-    if _redis_client is not None and _redis_available:
+def set_background_probe(active: bool) -> None:
+    """Marca o loop de probe; com ele ativo, requisições não fazem half_open."""
+    global _background_probe
+    _background_probe = active
+
+
+def _drop_client() -> None:
+    global _redis_pool, _redis_client, _redis_available
+    pool = _redis_pool
+    _redis_pool = None
+    _redis_client = None
+    _redis_available = False
+    if pool is not None:
         try:
-            # Verificar se ainda está funcionando
-            _redis_client.ping()
-            return _redis_client
+            pool.disconnect()
         except Exception:
-            # Se ping falhar, resetar e tentar novamente
-            _redis_client = None
-            _redis_available = False
-    
-    # Se cliente não existe ou não está disponível, tentar conectar
-    
+            pass
+
+
+def _connect() -> Optional[redis.Redis]:
+    """Cria pool e cliente, validando com um único PING."""
+    global _redis_pool, _redis_client, _redis_available, _redis_connected_host
+
     # Lista de hosts para tentar (útil quando Redis está no WSL)
     hosts_to_try = [REDIS_HOST]
     if REDIS_HOST == "localhost":
         # Se configurado como localhost, tentar também 127.0.0.1
         hosts_to_try.append("127.0.0.1")
-    
+
     for host in hosts_to_try:
         try:
-            _redis_client = redis.Redis(
+            pool = redis.ConnectionPool(
                 host=host,
                 port=REDIS_PORT,
                 password=REDIS_PASSWORD,
@@ -59,59 +150,177 @@ def get_redis_client() -> Optional[redis.Redis]:
                 socket_timeout=REDIS_SOCKET_TIMEOUT,
                 socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
                 decode_responses=True,  # Decodificar strings automaticamente
-                health_check_interval=30,  # Verificar saúde da conexão a cada 30s
+                health_check_interval=30,  # Verificar conexões ociosas antes do uso
+                max_connections=REDIS_MAX_CONNECTIONS,
             )
-            
-            # Testar conexão
-            _redis_client.ping()
+            client = redis.Redis(connection_pool=pool)
+            client.ping()
+            _redis_pool = pool
+            _redis_client = client
             _redis_available = True
+            _redis_connected_host = host
             logger.info(f"Redis conectado com sucesso em {host}:{REDIS_PORT}")
-            return _redis_client
-            
+            return client
         except (ConnectionError, TimeoutError) as e:
             logger.warning(f"Redis não disponível em {host}:{REDIS_PORT}: {e}")
-            _redis_client = None
-            continue
         except Exception as e:
             logger.warning(f"Erro ao conectar ao Redis em {host}:{REDIS_PORT}: {e}")
-            _redis_client = None
-            continue
-    
+
     # Se nenhum host funcionou
     logger.warning(f"Redis não disponível em nenhum host tentado ({', '.join(hosts_to_try)}). Usando fallback para memória.")
     logger.warning(f"Verifique se Redis está rodando e se REDIS_HOST está correto no .env (atual: {REDIS_HOST})")
-    _redis_available = False
     return None
 
 
-def is_redis_available() -> bool:
+def get_redis_client() -> Optional[redis.Redis]:
     """
-    Verifica se Redis está disponível e funcionando.
+    Retorna o cliente Redis reutilizável, sem PING por chamada.
+    Retorna None se Redis não estiver disponível ou se o circuito estiver aberto.
+    Tenta múltiplas opções de conexão (localhost, IP do WSL, etc).
     """
-    global _redis_available
-    
-    # Sempre tentar obter cliente (não confiar apenas no cache)
-    client = get_redis_client()
+    client = _redis_client
+    if client is not None and _breaker.state == BREAKER_CLOSED:
+        return client
+    if _background_probe and _breaker.state != BREAKER_CLOSED:
+        _breaker.short_circuit()
+        return None
+    return _reconnect()
+
+
+def _reconnect() -> Optional[redis.Redis]:
+    """Nova conexão, se o circuit breaker permitir uma tentativa agora."""
+    if not _breaker.allow_attempt():
+        return None
+
+    with _connect_lock:
+        if _redis_client is not None and _breaker.state == BREAKER_CLOSED:
+            return _redis_client
+        _drop_client()
+        client = _connect()
     if client is None:
-        logger.debug("Redis client is None, Redis não disponível")
-        return False
-    
+        _breaker.record_failure()
+    else:
+        _breaker.record_success()
+    return client
+
+
+def is_redis_available() -> bool:
+    """
+    Verifica se Redis está disponível (cliente conectado e circuito fechado).
+    """
+    return get_redis_client() is not None
+
+
+async def get_async_redis_client() -> Optional[aioredis.Redis]:
+    """
+    Retorna o cliente redis.asyncio do event loop atual, sujeito ao mesmo
+    circuit breaker do cliente síncrono. Retorna None sem I/O com o circuito aberto.
+    """
+    global _async_client
+    loop = asyncio.get_running_loop()
+    cached = _async_client
+    if cached is not None and cached[0] is loop and _breaker.state == BREAKER_CLOSED:
+        return cached[1]
+    if _background_probe and _breaker.state != BREAKER_CLOSED:
+        _breaker.short_circuit()
+        return None
+    if not _breaker.allow_attempt():
+        return None
+    if cached is not None and cached[0] is loop:
+        # Cliente deste loop já existe: o pool reconecta, basta validar
+        client = cached[1]
+        try:
+            await client.ping()
+        except Exception as e:
+            logger.warning(f"Redis (async) não disponível: {e}")
+            _breaker.record_failure()
+            return None
+        _breaker.record_success()
+        return client
+
+    client = aioredis.Redis(
+        host=_redis_connected_host or REDIS_HOST,
+        port=REDIS_PORT,
+        password=REDIS_PASSWORD,
+        db=REDIS_DB,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+        decode_responses=True,
+        health_check_interval=30,
+        max_connections=REDIS_MAX_CONNECTIONS,
+    )
     try:
-        result = client.ping()
-        if result:
-            _redis_available = True
-            logger.debug(f"Redis ping successful, Redis disponível")
-            return True
-        else:
-            _redis_available = False
-            logger.warning("Redis ping retornou False")
-            return False
+        await client.ping()
+    except Exception as e:
+        logger.warning(f"Redis (async) não disponível: {e}")
+        _breaker.record_failure()
+        # Fechar o pool do cliente descartado (senão vaza a cada tentativa)
+        try:
+            await client.aclose()
+        except Exception:
+            pass
+        return None
+    _breaker.record_success()
+    _async_client = (loop, client)
+    return client
+
+
+async def is_redis_available_async() -> bool:
+    """Versão async de is_redis_available."""
+    return (await get_async_redis_client()) is not None
+
+
+def probe_redis() -> bool:
+    """
+    Verificação de saúde executada em segundo plano: PING no cliente atual
+    (ou reconexão quando o circuito permite). Atualiza o circuit breaker.
+    """
+    client = _redis_client
+    if client is None or _breaker.state != BREAKER_CLOSED:
+        return _reconnect() is not None
+    try:
+        client.ping()
+        _breaker.record_success()
+        return True
     except Exception as e:
-        _redis_available = False
-        logger.warning(f"Redis ping falhou: {str(e)}")
+        logger.warning(f"Health check do Redis falhou: {e}")
+        record_redis_failure()
         return False
 
 
+def record_redis_failure(error: Optional[BaseException] = None) -> None:
+    """
+    Registra falha de comunicação com o Redis; com o circuito aberto o cliente
+    é descartado. Erros que não são de conexão/timeout são ignorados.
+    """
+    if error is not None and not isinstance(error, (ConnectionError, TimeoutError)):
+        return
+    _breaker.record_failure()
+    if _breaker.state == BREAKER_OPEN:
+        with _connect_lock:
+            _drop_client()
+
+
+def get_redis_metrics() -> dict:
+    """Estado do circuit breaker e uso do pool de conexões."""
+    metrics = {
+        "available": _redis_client is not None and _breaker.state == BREAKER_CLOSED,
+        "breaker_state": _breaker.state,
+        "consecutive_failures": _breaker.failures,
+        "breaker_trips": _breaker.trips,
+        "short_circuits": _breaker.short_circuits,
+    }
+    pool = _redis_pool
+    if pool is not None:
+        metrics["pool"] = {
+            "max_connections": pool.max_connections,
+            "created": getattr(pool, "_created_connections", None),
+            "in_use": len(getattr(pool, "_in_use_connections", ())),
+            "idle": len(getattr(pool, "_available_connections", ())),
+        }
+    return metrics
+
+
 def get_redis_connection_string() -> str:
     """
     Retorna string de conexão Redis no formato URI.
@@ -124,8 +333,10 @@ def get_redis_connection_string() -> str:
 
 def reset_redis_connection():
     """
-    Reseta a conexão Redis (útil para testes ou reconexão).
+    Reseta a conexão Redis e o circuit breaker (útil para testes ou reconexão).
     """
-    global _redis_client, _redis_available
-    _redis_client = None
-    _redis_available = False
+    global _async_client
+    with _connect_lock:
+        _drop_client()
+    _async_client = None
+    _breaker.reset()
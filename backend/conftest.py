@@ -142,6 +142,22 @@ def test_user(db_session):
     return user
 
 
+@pytest.fixture
+def statements(db_session):
+    """Captura os SQL executados no banco de teste (contagem de consultas)"""
+    from sqlalchemy import event
+
+    captured = []
+    engine = db_session.get_bind()
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        captured.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_execute)
+    yield captured
+    event.remove(engine, "before_cursor_execute", before_execute)
+
+
 @pytest.fixture
 def jwt_token(test_user):
     """Cria um token JWT para o usuário de teste"""
@@ -1,11 +1,21 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from fastapi import Depends, Request
+from starlette.concurrency import run_in_threadpool
+import itertools
+import logging
 import os
+import threading
+import time
+from typing import Optional, Tuple
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # URL do banco de dados - construir a partir de variáveis individuais se DATABASE_URL não estiver definida
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
@@ -16,13 +26,556 @@ if not DATABASE_URL:
     db_name = os.getenv("DATABASE_NAME", "saudenold")
     DATABASE_URL = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Configuração do pool de conexões
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
+DATABASE_POOL_TIMEOUT = int(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+DATABASE_POOL_PRE_PING = os.getenv("DATABASE_POOL_PRE_PING", "true").lower() == "true"
+# Réplicas de leitura (lista separada por vírgula) e janela de read-your-writes
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+DATABASE_READ_YOUR_WRITES_SECONDS = float(os.getenv("DATABASE_READ_YOUR_WRITES_SECONDS", "5"))
+# Shards por família (lista separada por vírgula; índice = número do shard)
+DATABASE_SHARD_URLS = [url.strip() for url in os.getenv("DATABASE_SHARD_URLS", "").split(",") if url.strip()]
+DATABASE_SHARD_CACHE_SECONDS = float(os.getenv("DATABASE_SHARD_CACHE_SECONDS", "30"))
+# IDs das tabelas médicas reservados no primário em blocos deste tamanho
+DATABASE_SHARD_ID_BLOCK_SIZE = int(os.getenv("DATABASE_SHARD_ID_BLOCK_SIZE", "100"))
+# Engine assíncrono opcional (asyncpg/aiosqlite) para endpoints de leitura
+DATABASE_ASYNC_ENABLED = os.getenv("DATABASE_ASYNC_ENABLED", "false").lower() == "true"
+# Conexões mantidas por mais tempo que isso são reportadas como possível vazamento
+DATABASE_LEAK_THRESHOLD_SECONDS = float(os.getenv("DATABASE_LEAK_THRESHOLD_SECONDS", "30"))
+
+
+def build_engine_options(url: str) -> dict:
+    """Opções de pool para create_engine (SQLite usa o pool padrão)."""
+    options = {"pool_pre_ping": DATABASE_POOL_PRE_PING}
+    if not url.startswith("sqlite"):
+        options.update(
+            pool_size=DATABASE_POOL_SIZE,
+            max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_recycle=DATABASE_POOL_RECYCLE,
+            pool_timeout=DATABASE_POOL_TIMEOUT,
+        )
+    return options
+
+
+class RoutingSession(Session):
+    """
+    Sessão que envia leituras para a réplica escolhida na requisição.
+    Escritas (flush) e qualquer leitura após uma escrita ficam no primário.
+    Tabelas médicas vão para o shard da família, quando configurado.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if shard_engines and is_sharded_mapper(mapper):
+            shard_index = self.info.get("shard_index")
+            if shard_index is None:
+                # Sem roteamento a consulta iria ao primário (vazio) e perderia dados
+                raise UnroutedShardError(
+                    f"Sessao sem shard para a tabela {mapper.local_table.name}; chame use_family_shard()"
+                )
+            return shard_engines[shard_index]
+        replica_index = self.info.get("replica_index")
+        if replica_index is not None and not self._flushing and not self.info.get("flushed"):
+            return replica_engines[replica_index]
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+engine = create_engine(DATABASE_URL, **build_engine_options(DATABASE_URL))
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
+replica_engines = [create_engine(url, **build_engine_options(url)) for url in DATABASE_REPLICA_URLS]
+shard_engines = [
+    engine if url == DATABASE_URL else create_engine(url, **build_engine_options(url))
+    for url in DATABASE_SHARD_URLS
+]
 
 Base = declarative_base()
 
 
+# ========== MONITORAMENTO DO POOL ==========
+_pool_lock = threading.Lock()
+_checked_out = {}
+_pool_stats = {
+    "checkouts": 0,
+    "checkins": 0,
+    "leaks_detected": 0,
+    "max_held_seconds": 0.0,
+}
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info["checked_out_at"] = time.monotonic()
+    connection_record.info.pop("route", None)
+    connection_record.info.pop("leak_reported", None)
+    with _pool_lock:
+        _checked_out[id(connection_record)] = connection_record
+        _pool_stats["checkouts"] += 1
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    started = connection_record.info.pop("checked_out_at", None)
+    route = connection_record.info.pop("route", None)
+    reported = connection_record.info.pop("leak_reported", False)
+    with _pool_lock:
+        _checked_out.pop(id(connection_record), None)
+        _pool_stats["checkins"] += 1
+        if started is None:
+            return
+        held = time.monotonic() - started
+        if held > _pool_stats["max_held_seconds"]:
+            _pool_stats["max_held_seconds"] = held
+    if held > DATABASE_LEAK_THRESHOLD_SECONDS and not reported:
+        with _pool_lock:
+            _pool_stats["leaks_detected"] += 1
+        logger.warning(f"Conexao do banco mantida por {held:.1f}s (rota: {route or 'desconhecida'})")
+
+
+def _tag_connection(session, transaction, connection):
+    route = session.info.get("route")
+    if route:
+        connection.info["route"] = route
+
+
+def instrument_engine(target_engine, target_sessionmaker=None) -> None:
+    """Registra os eventos de monitoramento de pool/vazamento em um engine."""
+    event.listen(target_engine, "checkout", _on_checkout)
+    event.listen(target_engine, "checkin", _on_checkin)
+    if target_sessionmaker is not None:
+        event.listen(target_sessionmaker, "after_begin", _tag_connection)
+
+
+instrument_engine(engine, SessionLocal)
+for _extra_engine in replica_engines + [e for e in shard_engines if e is not engine]:
+    instrument_engine(_extra_engine)
+
+
+# ========== SHARDS POR FAMÍLIA ==========
+# Tabelas médicas (chaveadas por profile_id -> família) que vivem nos shards
+SHARDED_TABLES = frozenset({
+    "medications",
+    "medication_logs",
+    "medical_exams",
+    "exam_data_points",
+    "doctor_visits",
+    "emergency_contacts",
+    "daily_tracking",
+})
+
+_shard_lock = threading.Lock()
+_shard_cache = {}
+# profile_id -> (family_id, expiração)
+_profile_family_cache = {}
+_PROFILE_FAMILY_CACHE_MAX = 50000
+# tabela -> [próximo id, fim do bloco reservado)
+_id_lock = threading.Lock()
+_id_blocks = {}
+
+
+class UnroutedShardError(RuntimeError):
+    """Consulta a tabela médica em sessão não direcionada a um shard."""
+
+
+def is_sharded_mapper(mapper) -> bool:
+    table = getattr(mapper, "local_table", None)
+    return table is not None and table.name in SHARDED_TABLES
+
+
+def get_family_shard(family_id: int, use_cache: bool = True) -> int:
+    """
+    Shard da família: atribuição explícita em family_shards (feita pelo
+    rebalanceamento) ou, se não houver, family_id % número de shards.
+    """
+    now = time.monotonic()
+    if use_cache:
+        with _shard_lock:
+            cached = _shard_cache.get(family_id)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+    with engine.connect() as conn:
+        assigned = conn.execute(
+            text("SELECT shard_index FROM family_shards WHERE family_id = :family_id"),
+            {"family_id": family_id},
+        ).scalar()
+    shard_index = assigned if assigned is not None and assigned < len(shard_engines) else family_id % len(shard_engines)
+    with _shard_lock:
+        _shard_cache[family_id] = (shard_index, now + DATABASE_SHARD_CACHE_SECONDS)
+    return shard_index
+
+
+def invalidate_family_shard(family_id: int) -> None:
+    with _shard_lock:
+        _shard_cache.pop(family_id, None)
+
+
+def use_family_shard(db: Session, family_id) -> None:
+    """Direciona as tabelas médicas da sessão para o shard da família."""
+    if not shard_engines or family_id is None:
+        return
+    db.info["family_id"] = family_id
+    db.info["shard_index"] = get_family_shard(family_id)
+
+
+def get_profile_family(profile_id: int) -> Optional[int]:
+    """Família dona do perfil (em cache por DATABASE_SHARD_CACHE_SECONDS)."""
+    now = time.monotonic()
+    with _shard_lock:
+        cached = _profile_family_cache.get(profile_id)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    with engine.connect() as conn:
+        family_id = conn.execute(
+            text("SELECT family_id FROM family_profiles WHERE id = :profile_id"),
+            {"profile_id": profile_id},
+        ).scalar()
+    if family_id is not None:
+        with _shard_lock:
+            if len(_profile_family_cache) >= _PROFILE_FAMILY_CACHE_MAX:
+                _profile_family_cache.pop(next(iter(_profile_family_cache)))
+            _profile_family_cache[profile_id] = (family_id, now + DATABASE_SHARD_CACHE_SECONDS)
+    return family_id
+
+
+def use_profile_shard(db: Session, profile_id) -> None:
+    """Direciona a sessão para o shard da família dona do perfil."""
+    if not shard_engines or profile_id is None:
+        return
+    use_family_shard(db, get_profile_family(profile_id))
+
+
+def _allocate_id_block(table: str, count: int) -> Tuple[int, int]:
+    """
+    Reserva [início, fim) em shard_id_sequences no primário. Na primeira
+    reserva de uma tabela, começa acima do maior ID existente em todos os
+    shards.
+    """
+    reserve = text(
+        "UPDATE shard_id_sequences SET next_id = next_id + :count "
+        "WHERE table_name = :table RETURNING next_id"
+    )
+    for _ in range(3):
+        with engine.begin() as conn:
+            end = conn.execute(reserve, {"table": table, "count": count}).scalar()
+        if end is not None:
+            return end - count, end
+        start = 1
+        for shard_engine in shard_engines:
+            with shard_engine.connect() as conn:
+                start = max(start, (conn.execute(text(f"SELECT MAX(id) FROM {table}")).scalar() or 0) + 1)
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    text("INSERT INTO shard_id_sequences (table_name, next_id) VALUES (:table, :next_id)"),
+                    {"table": table, "next_id": start + count},
+                )
+            return start, start + count
+        except IntegrityError:
+            # Outro processo criou a linha ao mesmo tempo: reservar pelo UPDATE
+            continue
+    raise RuntimeError(f"Nao foi possivel reservar IDs para {table}")
+
+
+def next_shard_id(table: str) -> int:
+    """Próximo ID da tabela médica, único entre todos os shards."""
+    with _id_lock:
+        block = _id_blocks.get(table)
+        if block is None or block[0] >= block[1]:
+            block = _id_blocks[table] = list(_allocate_id_block(table, DATABASE_SHARD_ID_BLOCK_SIZE))
+        block[0] += 1
+        return block[0] - 1
+
+
+# ========== ROTEAMENTO DE LEITURA PARA RÉPLICAS ==========
+# GETs nestes prefixos podem ser atendidos por réplicas
+READ_REPLICA_PATHS = (
+    "/api/medications",
+    "/api/medical-exams",
+    "/api/analytics/",
+    "/api/compliance/audit-logs",
+)
+# Escritas nestas tabelas (as lidas pelas rotas acima) fixam o usuário no
+# primário. audit_logs fica de fora: toda listagem grava um log de
+# visualização, e o usuário voltaria sempre ao primário
+REPLICA_SERVED_TABLES = frozenset({
+    "medications",
+    "medical_exams",
+    "exam_data_points",
+    "licenses",
+    "purchases",
+    "license_validation_logs",
+})
+PRIMARY_PIN_INDEX_KEY = "db:primary_pins"
+# Intervalo entre leituras do índice de pins no Redis (pins de outros workers)
+DATABASE_PIN_SYNC_SECONDS = float(os.getenv("DATABASE_PIN_SYNC_SECONDS", "0.25"))
+
+_replica_cycle = itertools.cycle(range(len(replica_engines))) if replica_engines else None
+_replica_lock = threading.Lock()
+_primary_pins = {}
+# Espelho dos pins publicados no Redis: user_id -> fim da janela (epoch)
+_shared_pins = {}
+_shared_pins_synced_at = 0.0
+_routing_stats = {"replica_reads": 0, "primary_reads": 0, "pins": 0}
+
+
+def is_replica_route(method: str, path: str) -> bool:
+    return bool(replica_engines) and method == "GET" and path.startswith(READ_REPLICA_PATHS)
+
+
+def pin_to_primary(user_id) -> None:
+    """Fixa as leituras do usuário no primário durante a janela de read-your-writes."""
+    if user_id is None or DATABASE_READ_YOUR_WRITES_SECONDS <= 0:
+        return
+    with _replica_lock:
+        _primary_pins[user_id] = time.monotonic() + DATABASE_READ_YOUR_WRITES_SECONDS
+        _routing_stats["pins"] += 1
+    try:
+        from config.redis_config import get_redis_client, is_redis_available
+        if is_redis_available():
+            client = get_redis_client()
+            if client is not None:
+                now = time.time()
+                pipe = client.pipeline(transaction=False)
+                pipe.zadd(PRIMARY_PIN_INDEX_KEY, {str(user_id): now + DATABASE_READ_YOUR_WRITES_SECONDS})
+                pipe.zremrangebyscore(PRIMARY_PIN_INDEX_KEY, "-inf", now)
+                pipe.expire(PRIMARY_PIN_INDEX_KEY, int(DATABASE_READ_YOUR_WRITES_SECONDS) + 1)
+                pipe.execute()
+    except Exception as e:
+        logger.warning(f"Erro ao registrar pin de leitura no Redis: {e}")
+
+
+def _sync_shared_pins() -> None:
+    """
+    Relê os pins ativos de todos os workers, no máximo a cada
+    DATABASE_PIN_SYNC_SECONDS: uma leitura do Redis por intervalo e por
+    processo, em vez de uma por requisição.
+    """
+    global _shared_pins, _shared_pins_synced_at
+    now = time.monotonic()
+    if now - _shared_pins_synced_at < DATABASE_PIN_SYNC_SECONDS:
+        return
+    _shared_pins_synced_at = now
+    try:
+        from config.redis_config import get_redis_client, is_redis_available
+        if not is_redis_available():
+            return
+        client = get_redis_client()
+        if client is None:
+            return
+        entries = client.zrangebyscore(PRIMARY_PIN_INDEX_KEY, time.time(), "+inf", withscores=True)
+        pins = {}
+        for member, until in entries:
+            member = member.decode() if isinstance(member, bytes) else member
+            pins[member] = float(until)
+        with _replica_lock:
+            _shared_pins = pins
+    except Exception as e:
+        logger.warning(f"Erro ao consultar pins de leitura no Redis: {e}")
+
+
+def is_pinned_to_primary(user_id) -> bool:
+    if user_id is None:
+        return False
+    with _replica_lock:
+        until = _primary_pins.get(user_id)
+        if until is not None:
+            if until > time.monotonic():
+                return True
+            del _primary_pins[user_id]
+    _sync_shared_pins()
+    with _replica_lock:
+        until = _shared_pins.get(str(user_id))
+    return until is not None and until > time.time()
+
+
+def use_read_replica(db: Session, user_id=None) -> bool:
+    """
+    Direciona as próximas leituras da sessão para uma réplica (round-robin),
+    se a rota permitir e o usuário não tiver escrito recentemente.
+    Deve ser chamado após a autenticação (que sempre lê do primário).
+    """
+    if user_id is not None:
+        db.info["user_id"] = user_id
+    if not db.info.get("read_replica") or db.info.get("replica_index") is not None:
+        return False
+    if is_pinned_to_primary(user_id):
+        with _replica_lock:
+            _routing_stats["primary_reads"] += 1
+        return False
+    with _replica_lock:
+        db.info["replica_index"] = next(_replica_cycle)
+        _routing_stats["replica_reads"] += 1
+    return True
+
+
+def _writes_replica_served_table(session) -> bool:
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(inspect(obj).mapper, "local_table", None)
+        if table is not None and table.name in REPLICA_SERVED_TABLES:
+            return True
+    return False
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def _assign_shard_ids(session, flush_context, instances):
+    # Com shards, o ID vem do primário (não da sequência de cada shard):
+    # uma família muda de shard mantendo os IDs de suas linhas
+    if not shard_engines:
+        return
+    for obj in session.new:
+        mapper = inspect(obj).mapper
+        if is_sharded_mapper(mapper) and getattr(obj, "id", None) is None:
+            obj.id = next_shard_id(mapper.local_table.name)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _mark_session_wrote(session, flush_context):
+    # Leituras após qualquer escrita ficam no primário (mesma sessão); o pin
+    # do usuário só vale para escritas em tabelas servidas por réplicas
+    session.info["flushed"] = True
+    if not session.info.get("wrote") and _writes_replica_served_table(session):
+        session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _pin_after_write(session):
+    if session.info.get("wrote"):
+        pin_to_primary(session.info.get("user_id"))
+
+
+def report_leaked_connections(threshold_seconds: float = None) -> list:
+    """
+    Reporta conexões ainda em uso há mais tempo que o limite.
+    Cada checkout é reportado apenas uma vez.
+    """
+    threshold = DATABASE_LEAK_THRESHOLD_SECONDS if threshold_seconds is None else threshold_seconds
+    now = time.monotonic()
+    leaks = []
+    with _pool_lock:
+        records = list(_checked_out.values())
+    for record in records:
+        started = record.info.get("checked_out_at")
+        if started is None or record.info.get("leak_reported"):
+            continue
+        held = now - started
+        if held > threshold:
+            record.info["leak_reported"] = True
+            route = record.info.get("route") or "desconhecida"
+            leaks.append({"route": route, "held_seconds": round(held, 1)})
+            logger.warning(f"Possivel vazamento de conexao: {held:.1f}s em uso (rota: {route})")
+    if leaks:
+        with _pool_lock:
+            _pool_stats["leaks_detected"] += len(leaks)
+    return leaks
+
+
+def get_pool_metrics() -> dict:
+    """Métricas atuais do pool de conexões."""
+    pool = engine.pool
+    with _pool_lock:
+        stats = dict(_pool_stats)
+        in_use = len(_checked_out)
+    stats["max_held_seconds"] = round(stats["max_held_seconds"], 3)
+    with _replica_lock:
+        routing = dict(_routing_stats)
+    metrics = {
+        "pool_class": type(pool).__name__,
+        "in_use": in_use,
+        **stats,
+        "replicas": len(replica_engines),
+        "shards": len(shard_engines),
+        **routing,
+    }
+    for name in ("size", "checkedout", "checkedin", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            metrics[name] = method()
+    return metrics
+
+
+# ========== ENGINE ASSÍNCRONO (OPCIONAL) ==========
+_ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_database_url(url: str) -> str:
+    """Converte a URL síncrona para o driver assíncrono equivalente."""
+    scheme, sep, rest = url.partition("://")
+    return f"{_ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+
+async_engine = None
+AsyncSessionLocal = None
+async_replica_engines = []
+async_shard_engines = []
+
+if DATABASE_ASYNC_ENABLED:
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+        ASYNC_DATABASE_URL = get_async_database_url(DATABASE_URL)
+        async_engine = create_async_engine(ASYNC_DATABASE_URL, **build_engine_options(ASYNC_DATABASE_URL))
+        AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+        instrument_engine(async_engine.sync_engine)
+        async_replica_engines = []
+        for url in DATABASE_REPLICA_URLS:
+            async_url = get_async_database_url(url)
+            async_replica_engines.append(create_async_engine(async_url, **build_engine_options(async_url)))
+        async_shard_engines = []
+        for url in DATABASE_SHARD_URLS:
+            async_url = get_async_database_url(url)
+            async_shard_engines.append(
+                async_engine if url == DATABASE_URL else create_async_engine(async_url, **build_engine_options(async_url))
+            )
+        logger.info("Engine assincrono habilitado para endpoints de leitura")
+    except ImportError as exc:
+        logger.warning(f"Driver assincrono nao instalado ({exc}). Usando sessao sincrona em threadpool.")
+
+
+class ThreadpoolSession:
+    """
+    Adapta uma Session síncrona à interface de leitura do AsyncSession
+    (usada quando o engine assíncrono não está habilitado).
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    async def execute(self, statement):
+        frozen = await run_in_threadpool(lambda: self.session.execute(statement).freeze())
+        return frozen()
 
 
+# Dependency
+def get_db(request: Request = None):
+    """Sessão por requisição, sempre devolvida ao pool ao final."""
+    db = SessionLocal()
+    if request is not None:
+        db.info["route"] = f"{request.method} {request.url.path}"
+        db.info["read_replica"] = is_replica_route(request.method, request.url.path)
+    try:
+        yield db
+    finally:
+        db.close()
 
 
+async def get_async_db(db: Session = Depends(get_db)):
+    """
+    Sessão de leitura assíncrona: AsyncSession quando DATABASE_ASYNC_ENABLED,
+    senão a sessão síncrona da requisição executada em threadpool.
+    """
+    if AsyncSessionLocal is None:
+        yield ThreadpoolSession(db)
+        return
+    replica_index = db.info.get("replica_index")
+    bind = async_replica_engines[replica_index] if replica_index is not None else async_engine
+    binds = None
+    shard_index = db.info.get("shard_index")
+    if shard_index is not None:
+        shard_bind = async_shard_engines[shard_index]
+        binds = {table: shard_bind for name, table in Base.metadata.tables.items() if name in SHARDED_TABLES}
+    async with AsyncSessionLocal(bind=bind, binds=binds) as session:
+        yield session
@@ -1,13 +1,25 @@
+import os
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from sqlalchemy.orm import Session
 
 import models
+import services.download_counter as download_counter
+from services.audit_sink import AuditSink
+from services.download_counter import increment_download_count
 
 DOWNLOAD_WINDOW_MINUTES = 5
 DOWNLOAD_THRESHOLD = 20
 
+# Com o contador ativo os eventos de download só servem para auditoria
+_download_audit = AuditSink(
+    "download_events",
+    models.UserDownloadEvent,
+    int(os.getenv("DOWNLOAD_AUDIT_FLUSH_MAX_ENTRIES", "500")),
+    int(os.getenv("DOWNLOAD_AUDIT_MAX_PENDING", "20000")),
+)
+
 
 def _now():
     return datetime.now(timezone.utc)
@@ -23,8 +35,24 @@ def record_download(
     resource_type: str,
     resource_id: Optional[str],
     ip_address: Optional[str],
-    user_agent: Optional[str]
-) -> None:
+    user_agent: Optional[str],
+    window_minutes: int = DOWNLOAD_WINDOW_MINUTES
+) -> Optional[int]:
+    """
+    Registra o download. Com o contador ativo o evento vai para a auditoria
+    em lote e a função devolve a contagem do usuário na janela; no modo
+    banco grava o evento na hora e devolve None (usar get_recent_download_count).
+    """
+    if download_counter.DOWNLOAD_COUNTER_ENABLED:
+        _download_audit.add({
+            "user_id": user_id,
+            "resource_type": resource_type,
+            "resource_id": resource_id,
+            "ip_address": ip_address,
+            "user_agent": user_agent,
+            "created_at": _now(),
+        })
+        return increment_download_count(user_id, window_minutes)
     event = models.UserDownloadEvent(
         user_id=user_id,
         resource_type=resource_type,
@@ -35,6 +63,11 @@ def record_download(
     )
     db.add(event)
     db.commit()
+    return None
+
+
+def flush_download_audit(db: Optional[Session] = None) -> int:
+    return _download_audit.flush(db)
 
 
 def get_recent_download_count(
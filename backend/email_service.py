@@ -1,10 +1,20 @@
 import logging
 import os
 import smtplib
+import threading
+import time
+from collections import deque
 from email.message import EmailMessage
+from typing import Deque, List, Optional
 
 logger = logging.getLogger("email")
 
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "10"))
+# Servidores costumam derrubar conexões ociosas; renovar antes disso
+SMTP_CONNECTION_MAX_IDLE_SECONDS = float(os.getenv("SMTP_CONNECTION_MAX_IDLE_SECONDS", "60"))
+SMTP_CONNECTION_MAX_MESSAGES = int(os.getenv("SMTP_CONNECTION_MAX_MESSAGES", "100"))
+
 
 def _get_smtp_config():
     host = os.getenv("SMTP_HOST")
@@ -37,13 +47,7 @@ def _missing_smtp_fields() -> list[str]:
     return missing
 
 
-def send_email(to_email: str, subject: str, body: str) -> bool:
-    host, port, user, password, from_email, use_tls = _get_smtp_config()
-    if not smtp_configured():
-        missing = _missing_smtp_fields()
-        logger.warning("SMTP nao configurado. Campos ausentes: %s", ", ".join(missing))
-        return False
-
+def _build_message(to_email: str, subject: str, body: str, from_email: str) -> EmailMessage:
     message = EmailMessage()
     message["From"] = from_email
     message["To"] = to_email
@@ -61,14 +65,166 @@ def send_email(to_email: str, subject: str, body: str) -> bool:
         """,
         subtype="html",
     )
+    return message
 
-    try:
-        with smtplib.SMTP(host, port) as smtp:
+
+class _PooledConnection:
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.last_used = time.monotonic()
+        self.sent = 0
+
+
+class SMTPConnectionPool:
+    """
+    Pool pequeno de conexões SMTP já autenticadas (STARTTLS + LOGIN feitos
+    uma vez). Conexões ociosas há mais de SMTP_CONNECTION_MAX_IDLE_SECONDS ou
+    que já enviaram SMTP_CONNECTION_MAX_MESSAGES mensagens são renovadas; uma
+    conexão que falha é descartada em vez de voltar ao pool.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle: Deque[_PooledConnection] = deque()
+        self._stats = {"connections_opened": 0, "connections_reused": 0, "messages_sent": 0, "errors": 0}
+
+    def _open(self) -> _PooledConnection:
+        host, port, user, password, _, use_tls = _get_smtp_config()
+        smtp = smtplib.SMTP(host, port, timeout=SMTP_TIMEOUT_SECONDS)
+        try:
             if use_tls:
                 smtp.starttls()
             smtp.login(user, password)
-            smtp.send_message(message)
-        return True
-    except Exception as exc:
-        logger.error("Falha ao enviar email via SMTP: %s", exc)
+        except Exception:
+            _close_quietly(smtp)
+            raise
+        with self._lock:
+            self._stats["connections_opened"] += 1
+        return _PooledConnection(smtp)
+
+    def _checkout(self) -> _PooledConnection:
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                conn = self._idle.popleft() if self._idle else None
+                if conn is not None and now - conn.last_used < SMTP_CONNECTION_MAX_IDLE_SECONDS:
+                    self._stats["connections_reused"] += 1
+                    return conn
+            if conn is None:
+                return self._open()
+            _close_quietly(conn.smtp)
+
+    def _checkin(self, conn: _PooledConnection) -> None:
+        conn.last_used = time.monotonic()
+        if conn.sent >= SMTP_CONNECTION_MAX_MESSAGES:
+            _close_quietly(conn.smtp)
+            return
+        with self._lock:
+            self._idle.append(conn)
+
+    def send_messages(self, messages: List[EmailMessage]) -> List[bool]:
+        """
+        Envia as mensagens em sequência pela mesma conexão. Se o servidor
+        derrubar uma conexão reaproveitada, reconecta uma vez e continua.
+        Retorna o resultado de cada mensagem.
+        """
+        results: List[bool] = []
+        with self._slots:
+            conn: Optional[_PooledConnection] = None
+            reconnected = False
+            try:
+                conn = self._checkout()
+                index = 0
+                while index < len(messages):
+                    try:
+                        conn.smtp.send_message(messages[index])
+                        conn.sent += 1
+                        results.append(True)
+                    except smtplib.SMTPServerDisconnected:
+                        _close_quietly(conn.smtp)
+                        conn = None
+                        if reconnected:
+                            raise
+                        reconnected = True
+                        conn = self._open()
+                        continue
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as exc:
+                        logger.error("Email recusado pelo servidor SMTP: %s", exc)
+                        results.append(False)
+                    index += 1
+            except Exception as exc:
+                logger.error("Falha ao enviar email via SMTP: %s", exc)
+                if conn is not None:
+                    _close_quietly(conn.smtp)
+                    conn = None
+                results.extend([False] * (len(messages) - len(results)))
+            finally:
+                if conn is not None:
+                    self._checkin(conn)
+        with self._lock:
+            self._stats["messages_sent"] += results.count(True)
+            self._stats["errors"] += results.count(False)
+        return results
+
+    def close(self) -> None:
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn in idle:
+            _close_quietly(conn.smtp)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "size": self.size, "idle": len(self._idle)}
+
+
+def _close_quietly(smtp: smtplib.SMTP) -> None:
+    try:
+        smtp.quit()
+    except Exception:
+        try:
+            smtp.close()
+        except Exception:
+            pass
+
+
+_pool = SMTPConnectionPool(SMTP_POOL_SIZE)
+
+
+def deliver_emails(payloads: List[dict]) -> List[bool]:
+    """
+    Entrega imediata pelo pool SMTP (usada pela fila de notificações e pelo
+    envio inline). ``payloads``: dicts com to_email, subject e body.
+    """
+    if not smtp_configured():
+        return [False] * len(payloads)
+    from_email = _get_smtp_config()[4]
+    messages = [_build_message(p["to_email"], p["subject"], p["body"], from_email) for p in payloads]
+    return _pool.send_messages(messages)
+
+
+def send_email(to_email: str, subject: str, body: str) -> bool:
+    """
+    Envia um email. Com a fila de notificações ativa o email apenas entra
+    na fila (o worker entrega pelo pool, com retry); senão é entregue na hora.
+    """
+    if not smtp_configured():
+        missing = _missing_smtp_fields()
+        logger.warning("SMTP nao configurado. Campos ausentes: %s", ", ".join(missing))
         return False
+
+    # Import local: o dispatcher usa deliver_emails deste módulo
+    import services.notification_dispatcher as notification_dispatcher
+    if notification_dispatcher.NOTIFICATION_DISPATCHER_ENABLED:
+        return notification_dispatcher.enqueue_email(to_email, subject, body, dedupe=False)
+    return deliver_emails([{"to_email": to_email, "subject": subject, "body": body}])[0]
+
+
+def get_smtp_pool_stats() -> dict:
+    return _pool.stats()
+
+
+def close_smtp_pool() -> None:
+    _pool.close()
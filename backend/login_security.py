@@ -1,9 +1,15 @@
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 import models
+import services.login_attempt_counter as login_attempt_counter
+from services.login_attempt_archive import archive_login_attempt, flush_login_attempts
+from services.login_attempt_counter import add_failed_attempt, count_failed_attempts, reset_failed_attempts
+from services.recent_login_ips import has_other_recent_ip
+import services.recent_login_ips as recent_login_ips
 
 MAX_ATTEMPTS = 5
 WINDOW_MINUTES = 15
@@ -18,12 +24,24 @@ def _cutoff(minutes: int):
     return _now() - timedelta(minutes=minutes)
 
 
+def _counter_enabled() -> bool:
+    return login_attempt_counter.LOGIN_ATTEMPT_COUNTER_ENABLED
+
+
 def record_failed_login(
     db: Session,
     email: str,
     ip_address: Optional[str],
-    user_agent: Optional[str]
-) -> None:
+    user_agent: Optional[str],
+    window_minutes: int = WINDOW_MINUTES
+) -> Optional[int]:
+    """
+    Registra uma tentativa falhada. Com o contador no Redis devolve a
+    contagem na janela já incluindo esta falha; no modo banco devolve None.
+    """
+    if _counter_enabled():
+        archive_login_attempt(email, ip_address, user_agent, success=False)
+        return add_failed_attempt(email, ip_address, window_minutes)
     attempt = models.UserLoginAttempt(
         email=email,
         ip_address=ip_address,
@@ -33,15 +51,20 @@ def record_failed_login(
     )
     db.add(attempt)
     db.commit()
+    return None
 
 
 def record_successful_login(
     db: Session,
     email: str,
     ip_address: Optional[str],
-    user_agent: Optional[str]
+    user_agent: Optional[str],
+    commit: bool = True
 ) -> None:
-    """Registra uma tentativa de login bem-sucedida"""
+    """Registra uma tentativa de login bem-sucedida (commit=False: fica na transação do chamador)"""
+    if _counter_enabled():
+        archive_login_attempt(email, ip_address, user_agent, success=True)
+        return
     attempt = models.UserLoginAttempt(
         email=email,
         ip_address=ip_address,
@@ -50,15 +73,23 @@ def record_successful_login(
         created_at=_now()
     )
     db.add(attempt)
-    db.commit()
+    if commit:
+        db.commit()
 
 
 def clear_failed_logins(
     db: Session,
     email: str,
-    ip_address: Optional[str]
+    ip_address: Optional[str],
+    commit: bool = True
 ) -> None:
-    """Remove apenas tentativas FALHADAS antigas (success=False)"""
+    """
+    Remove apenas tentativas FALHADAS antigas (success=False). Com o contador
+    no Redis apenas zera o contador: o arquivo no banco é append-only.
+    """
+    if _counter_enabled():
+        reset_failed_attempts(email, ip_address)
+        return
     query = db.query(models.UserLoginAttempt).filter(
         models.UserLoginAttempt.email == email,
         models.UserLoginAttempt.success == False  # Apenas falhas
@@ -66,7 +97,8 @@ def clear_failed_logins(
     if ip_address:
         query = query.filter(models.UserLoginAttempt.ip_address == ip_address)
     query.delete()
-    db.commit()
+    if commit:
+        db.commit()
 
 
 def get_failed_attempts_count(
@@ -76,6 +108,14 @@ def get_failed_attempts_count(
     window_minutes: int = WINDOW_MINUTES
 ) -> int:
     """Conta apenas tentativas FALHADAS (success=False)"""
+    if _counter_enabled():
+        count = count_failed_attempts(email, ip_address, window_minutes)
+        if count is not None:
+            return count
+        # Redis fora: contar no arquivo. As falhas não são apagadas nesse modo,
+        # então valem apenas as posteriores ao último login bem-sucedido.
+        flush_login_attempts()
+
     query = db.query(models.UserLoginAttempt).filter(
         models.UserLoginAttempt.email == email,
         models.UserLoginAttempt.success == False,  # Apenas falhas
@@ -83,6 +123,16 @@ def get_failed_attempts_count(
     )
     if ip_address:
         query = query.filter(models.UserLoginAttempt.ip_address == ip_address)
+    if _counter_enabled():
+        last_success = db.query(func.max(models.UserLoginAttempt.created_at)).filter(
+            models.UserLoginAttempt.email == email,
+            models.UserLoginAttempt.success == True
+        )
+        if ip_address:
+            last_success = last_success.filter(models.UserLoginAttempt.ip_address == ip_address)
+        query = query.filter(
+            models.UserLoginAttempt.created_at > func.coalesce(last_success.scalar_subquery(), _cutoff(window_minutes))
+        )
     return query.count()
 
 
@@ -92,13 +142,23 @@ def has_suspicious_login_pattern(
     ip_address: Optional[str],
     window_minutes: int = SUSPICIOUS_LOGIN_WINDOW_MINUTES
 ) -> bool:
+    """
+    True se houve login de outro IP na janela. O login atual (de ``ip_address``)
+    já conta como presente, então basta um EXISTS por outro IP em vez de
+    listar os IPs distintos; não depende do evento atual já estar gravado.
+    Com RECENT_LOGIN_IPS_ENABLED a resposta vem do conjunto de IPs recentes
+    do usuário (Redis ou LRU local), sem consultar user_login_events.
+    """
     if not ip_address:
         return False
+    if recent_login_ips.RECENT_LOGIN_IPS_ENABLED:
+        return has_other_recent_ip(user_id, ip_address, window_minutes)
     cutoff = _cutoff(window_minutes)
-    recent_ips = db.query(models.UserLoginEvent.ip_address).filter(
+    other_ip = db.query(models.UserLoginEvent.id).filter(
         models.UserLoginEvent.user_id == user_id,
         models.UserLoginEvent.created_at >= cutoff,
-        models.UserLoginEvent.ip_address.isnot(None)
-    ).distinct().all()
-    ip_set = {row[0] for row in recent_ips if row[0]}
-    return len(ip_set) > 1 and ip_address in ip_set
+        models.UserLoginEvent.ip_address.isnot(None),
+        models.UserLoginEvent.ip_address != "",
+        models.UserLoginEvent.ip_address != ip_address
+    )
+    return db.query(other_ip.exists()).scalar()
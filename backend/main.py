@@ -2,30 +2,56 @@ from fastapi import FastAPI, HTTPException, Depends, Security, status, Request,
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.exceptions import RequestValidationError
 from pydantic import ValidationError
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
-from sqlalchemy import Float
+from sqlalchemy import Float, select
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from slowapi.middleware import SlowAPIMiddleware
-from config.redis_config import get_redis_connection_string, is_redis_available, reset_redis_connection
+from config.redis_config import (
+    get_redis_connection_string,
+    is_redis_available,
+    reset_redis_connection,
+    probe_redis,
+    set_background_probe,
+    get_redis_metrics,
+    REDIS_HEALTH_CHECK_SECONDS,
+)
 import os
 import logging
 import hashlib
 import secrets
 from typing import Optional, List
 from dotenv import load_dotenv
-from database import SessionLocal, engine, Base
+from database import (
+    SessionLocal,
+    engine,
+    Base,
+    get_db,
+    get_async_db,
+    use_read_replica,
+    use_family_shard,
+    use_profile_shard,
+    shard_engines,
+    UnroutedShardError,
+    SHARDED_TABLES,
+    get_pool_metrics,
+    report_leaked_connections,
+)
 import models
 import schemas
 from auth import (
     authenticate_user,
     create_access_token,
     get_user_from_token,
+    get_user_from_payload,
     decode_token_payload,
+    forget_verified_token,
+    get_claims_cache_stats,
     hash_password,
     create_refresh_token,
     verify_refresh_token,
@@ -42,6 +68,8 @@ from auth import (
 from services.token_blacklist import add_to_blacklist, is_blacklisted
 from services.csrf_service import generate_and_store_csrf_token
 from services.encryption_service import EncryptionService
+from services.family_access_graph import bump_family_graph_version
+from services.user_cache import invalidate_user_cache
 from services.rate_limit_service import (
     check_email_rate_limit,
     reset_email_rate_limit,
@@ -51,18 +79,58 @@ from middleware.validation_middleware import ValidationMiddleware
 from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import padding, ec, rsa
-from cryptography.hazmat.primitives.serialization import load_pem_public_key
 import base64
 import textwrap
-from email_service import send_email, smtp_configured
+from email_service import close_smtp_pool, get_smtp_pool_stats, send_email, smtp_configured
+from services.audit_service import (
+    log_view_action,
+    log_edit_action,
+    log_delete_action,
+    log_share_action,
+    RESOURCE_MEDICATION,
+    RESOURCE_VISIT,
+    RESOURCE_EXAM,
+)
+from services.activity_buffer import (
+    ACTIVITY_FLUSH_SECONDS,
+    flush_activity,
+    record_session_activity,
+    record_user_login,
+)
+import services.activity_buffer as activity_buffer
+from services.audit_sink import AUDIT_FLUSH_SECONDS, flush_audit_sinks, get_audit_sink_stats
+import services.download_counter as download_counter
+import services.login_attempt_counter as login_attempt_counter
+from services.notification_dispatcher import (
+    NOTIFICATION_DISPATCH_INTERVAL_SECONDS,
+    dispatch_pending,
+    get_notification_dispatcher_stats,
+    wait_for_notifications,
+)
+import services.notification_dispatcher as notification_dispatcher
+from services.password_hasher import get_password_hasher_metrics, shutdown_password_hasher
+from services.biometric_key_cache import (
+    BiometricDeviceRecord,
+    cache_biometric_device,
+    fill_biometric_device,
+    get_cached_biometric_device,
+    get_public_key,
+    invalidate_biometric_device,
+    record_from_device,
+)
+import services.biometric_key_cache as biometric_key_cache
 from session_service import (
     upsert_session,
     revoke_sessions,
     mark_session_trusted,
     mark_session_blocked,
     is_device_blocked,
+    get_session_state,
+    refresh_session_state,
     log_login_event
 )
+from services.session_state_cache import cache_session_state, state_from_session
+import services.session_state_cache as session_state_cache
 from notification_service import (
     send_login_notification,
     send_login_blocked_alert,
@@ -170,12 +238,21 @@ if not os.getenv("TESTING"):
         )
 
     Base.metadata.create_all(bind=engine)
+    for shard_engine in shard_engines:
+        if shard_engine is not engine:
+            Base.metadata.create_all(
+                bind=shard_engine,
+                tables=[table for name, table in Base.metadata.tables.items() if name in SHARDED_TABLES]
+            )
 
 app = FastAPI(title="SaudeNold API", version="1.0.0")
 
 # Adicionar middleware CSRF (após criar app, antes de rotas)
 from middleware.csrf_middleware import CSRFMiddleware
-from middleware.validation_middleware import ValidationMiddleware
+from middleware.validation_middleware import ValidatedJSONRoute, ValidationMiddleware
+# Rotas reutilizam o JSON já parseado/sanitizado pelo ValidationMiddleware
+app.router.route_class = ValidatedJSONRoute
+from middleware.security_headers_middleware import SecurityHeadersMiddleware
 app.add_middleware(CSRFMiddleware)
 app.add_middleware(ValidationMiddleware)
 
@@ -203,6 +280,7 @@ except ImportError:
 
 REFRESH_TOKEN_CLEANUP_MINUTES = int(os.getenv("REFRESH_TOKEN_CLEANUP_MINUTES", "60"))
 DISABLE_TOKEN_CLEANUP = os.getenv("DISABLE_TOKEN_CLEANUP", "false").lower() == "true"
+DB_LEAK_CHECK_SECONDS = int(os.getenv("DB_LEAK_CHECK_SECONDS", "60"))
 
 # Rate Limiting
 def get_rate_limit_key(request: Request) -> str:
@@ -260,6 +338,12 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         content={"detail": errors, "body": str(exc.body) if hasattr(exc, 'body') else None}
     )
 
+@app.exception_handler(UnroutedShardError)
+async def unrouted_shard_exception_handler(request: Request, exc: UnroutedShardError):
+    # Sem família (API key sem perfil, usuário sem família) não há shard para dados médicos
+    security_logger.warning(f"Acesso a dados medicos sem shard em {request.url.path}: {exc}")
+    return JSONResponse(status_code=403, content={"detail": "Dados medicos exigem usuario vinculado a uma familia"})
+
 # CORS - Restringir origins permitidas
 default_origins = [
     "http://localhost:8080",
@@ -294,26 +378,8 @@ app.add_middleware(
     expose_headers=["X-Request-ID"],
 )
 
-# Security Headers Middleware
-@app.middleware("http")
-async def add_security_headers(request, call_next):
-    response = await call_next(request)
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-XSS-Protection"] = "1; mode=block"
-    response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-    path = request.url.path or ""
-    if path.startswith("/docs") or path.startswith("/redoc") or path.startswith("/openapi.json"):
-        response.headers["Content-Security-Policy"] = (
-            "default-src 'self'; "
-            "script-src 'self' 'unsafe-inline' 'unsafe-eval' https://cdn.jsdelivr.net; "
-            "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; "
-            "img-src 'self' data:; "
-            "font-src 'self' https://cdn.jsdelivr.net"
-        )
-    else:
-        response.headers["Content-Security-Policy"] = "default-src 'self'"
-    return response
+# Security Headers Middleware (mais externo: também cobre respostas de CORS/CSRF)
+app.add_middleware(SecurityHeadersMiddleware)
 
 
 async def refresh_token_cleanup_loop():
@@ -362,66 +428,295 @@ async def child_migration_loop():
             logger.error(f"Erro no loop de migracao de criancas: {e}")
             await asyncio.sleep(3600)  # Esperar 1 hora antes de tentar novamente
 
+async def db_leak_monitor_loop():
+    """Verifica periodicamente conexões do pool mantidas por tempo excessivo."""
+    while True:
+        try:
+            await asyncio.sleep(DB_LEAK_CHECK_SECONDS)
+            report_leaked_connections()
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"Erro no monitor de conexoes do banco: {e}")
+
+async def activity_flush_loop():
+    """Grava periodicamente os timestamps de atividade acumulados."""
+    while True:
+        try:
+            await asyncio.sleep(ACTIVITY_FLUSH_SECONDS)
+            await run_in_threadpool(flush_activity)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"Erro no flush de timestamps de atividade: {e}")
+
+async def audit_flush_loop():
+    """Grava periodicamente as linhas de auditoria acumuladas (tentativas de login, downloads)."""
+    while True:
+        try:
+            await asyncio.sleep(AUDIT_FLUSH_SECONDS)
+            await run_in_threadpool(flush_audit_sinks)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"Erro no flush da auditoria em lote: {e}")
+
+async def notification_dispatch_loop():
+    """Entrega em background os pushes (em lote) e emails enfileirados."""
+    while True:
+        try:
+            await wait_for_notifications(NOTIFICATION_DISPATCH_INTERVAL_SECONDS)
+            await run_in_threadpool(dispatch_pending)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"Erro no envio de notificações: {e}")
+
+async def redis_health_probe_loop():
+    """
+    Verifica a saúde do Redis e alimenta o circuit breaker. Enquanto roda, as
+    tentativas half_open saem daqui (threadpool), não das requisições.
+    """
+    set_background_probe(True)
+    try:
+        while True:
+            try:
+                await asyncio.sleep(REDIS_HEALTH_CHECK_SECONDS)
+                await run_in_threadpool(probe_redis)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Erro no health check do Redis: {e}")
+    finally:
+        set_background_probe(False)
+
 @app.on_event("startup")
 async def start_background_tasks():
     if not DISABLE_TOKEN_CLEANUP:
         asyncio.create_task(refresh_token_cleanup_loop())
+
+    if DB_LEAK_CHECK_SECONDS > 0 and not os.getenv("TESTING"):
+        asyncio.create_task(db_leak_monitor_loop())
+
+    if REDIS_HEALTH_CHECK_SECONDS > 0 and not os.getenv("TESTING"):
+        asyncio.create_task(redis_health_probe_loop())
+
+    if activity_buffer.ACTIVITY_WRITE_BEHIND_ENABLED:
+        asyncio.create_task(activity_flush_loop())
+
+    if login_attempt_counter.LOGIN_ATTEMPT_COUNTER_ENABLED or download_counter.DOWNLOAD_COUNTER_ENABLED:
+        asyncio.create_task(audit_flush_loop())
+
+    if notification_dispatcher.NOTIFICATION_DISPATCHER_ENABLED:
+        asyncio.create_task(notification_dispatch_loop())
     
     # Iniciar migração automática de crianças para adultos
     if not os.getenv("TESTING"):
         asyncio.create_task(child_migration_loop())
         logger.info("Tarefa de migracao automatica de criancas iniciada (executa diariamente)")
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@app.on_event("shutdown")
+async def stop_background_workers():
+    # Não perder timestamps e linhas de auditoria ainda nos buffers
+    await run_in_threadpool(flush_activity)
+    await run_in_threadpool(flush_audit_sinks)
+    # Última tentativa para as notificações ainda na fila (ignora o backoff)
+    await run_in_threadpool(dispatch_pending, True)
+    await run_in_threadpool(close_smtp_pool)
+    shutdown_password_hasher()
 
 # Autenticação simples baseada em API Key
 security = HTTPBearer()
 API_KEY = os.getenv("API_KEY", secrets.token_urlsafe(32))
 
-def verify_api_key(
-    request: Request,
-    credentials: HTTPAuthorizationCredentials = Security(security),
-    db: Session = Depends(get_db)
-):
-    """Verifica a API key fornecida"""
-    token = credentials.credentials
-    if token == API_KEY:
-        return token
+_UNRESOLVED = object()
 
-    # Permitir JWT valido como autenticacao
-    try:
-        user = get_user_from_token(db, token)
-        payload = decode_token_payload(token)
-        device_id = payload.get("device_id")
-        user_id = payload.get("sub")
-        if device_id and user_id:
-            session = db.query(models.UserSession).filter(
-                models.UserSession.user_id == int(user_id),
-                models.UserSession.device_id == device_id,
-                models.UserSession.revoked_at.is_(None)
-            ).first()
-            if not session or session.blocked:
-                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid session")
-        profile_id = request.headers.get("X-Profile-Id") if request else None
-        if profile_id and user.family_id:
-            try:
-                profile_id_int = int(profile_id)
-            except ValueError:
-                security_logger.warning("Profile ID invalido no header, ignorando para validacao")
+
+def _get_or_create_test_user(db: Session) -> models.User:
+    test_user = db.query(models.User).filter(models.User.email == "test@test.com").first()
+    if not test_user:
+        from auth import hash_password
+        test_user = models.User(
+            email="test@test.com",
+            password_hash=hash_password("test"),
+            is_active=True,
+            email_verified=True
+        )
+        db.add(test_user)
+        db.commit()
+        db.refresh(test_user)
+    return test_user
+
+
+class AuthContext:
+    """
+    Contexto de autenticacao da requisicao.
+    Token, payload, usuario, sessao e perfil efetivo sao resolvidos uma unica vez
+    e reaproveitados por todas as dependencias/endpoints da mesma requisicao.
+    """
+
+    __slots__ = (
+        "request", "db", "token", "is_api_key", "payload", "session",
+        "_user", "_header_profile", "_profile_id",
+    )
+
+    def __init__(self, request: Request, db: Session, token: str):
+        self.request = request
+        self.db = db
+        self.token = token
+        self.is_api_key = token == API_KEY
+        self.payload = None
+        self.session = None
+        self._user = _UNRESOLVED
+        self._header_profile = _UNRESOLVED
+        self._profile_id = _UNRESOLVED
+
+    @property
+    def user(self) -> Optional[models.User]:
+        if self._user is _UNRESOLVED:
+            # Em modo de teste, aceitar API_KEY como autenticação válida
+            if self.is_api_key and os.getenv("TESTING") == "1":
+                self._user = _get_or_create_test_user(self.db)
+                # API key não passa por _load_auth_context com payload: rotear aqui
+                use_family_shard(self.db, self._user.family_id)
             else:
-                profile = db.query(models.FamilyProfile).filter(
-                    models.FamilyProfile.id == profile_id_int,
+                self._user = None
+        return self._user
+
+    @property
+    def jwt_user(self) -> Optional[models.User]:
+        """Usuario autenticado via JWT (None para API_KEY)."""
+        return None if self.is_api_key else self.user
+
+    def _profile_id_header(self) -> Optional[int]:
+        raw = self.request.headers.get("X-Profile-Id") if self.request else None
+        if not raw:
+            return None
+        try:
+            return int(raw)
+        except ValueError:
+            return None
+
+    def header_profile(self) -> Optional[models.FamilyProfile]:
+        """Perfil do header X-Profile-Id, se pertencer a familia do usuario."""
+        if self._header_profile is _UNRESOLVED:
+            profile = None
+            profile_id = self._profile_id_header()
+            user = self.jwt_user
+            if profile_id and user and user.family_id:
+                profile = self.db.query(models.FamilyProfile).filter(
+                    models.FamilyProfile.id == profile_id,
                     models.FamilyProfile.family_id == user.family_id
                 ).first()
-                if not profile:
-                    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Perfil nao autorizado")
-        return token
+            self._header_profile = profile
+        return self._header_profile
+
+    @property
+    def profile_id(self) -> Optional[int]:
+        """Perfil efetivo da requisicao (mesmas regras de get_profile_context)."""
+        if self._profile_id is _UNRESOLVED:
+            self._profile_id = self._resolve_profile_id()
+        return self._profile_id
+
+    def _resolve_profile_id(self) -> Optional[int]:
+        db = self.db
+        profile_id = self._profile_id_header()
+
+        # Em modo de teste, aceitar profile_id do header mesmo com API_KEY
+        if self.is_api_key:
+            if os.getenv("TESTING") == "1" and profile_id:
+                profile = db.query(models.FamilyProfile).filter(
+                    models.FamilyProfile.id == profile_id
+                ).first()
+                if profile:
+                    use_family_shard(db, profile.family_id)
+                    return profile_id
+            return None
+
+        user = self.user
+        if not user or not user.family_id:
+            return None
+        if profile_id:
+            header_profile = self.header_profile()
+            if header_profile:
+                use_family_shard(db, header_profile.family_id)
+                return profile_id
+            # CRÍTICO: Verificar se há FamilyDataShare que permite acesso a este perfil
+            user_profile = db.query(models.FamilyProfile).filter(
+                models.FamilyProfile.family_id == user.family_id,
+                models.FamilyProfile.created_by == user.id
+            ).first()
+            if user_profile:
+                data_share = db.query(models.FamilyDataShare).filter(
+                    models.FamilyDataShare.family_id == user.family_id,
+                    models.FamilyDataShare.from_profile_id == profile_id,  # Perfil que compartilha
+                    models.FamilyDataShare.to_profile_id == user_profile.id,  # Perfil do usuário atual
+                    models.FamilyDataShare.revoked_at.is_(None)
+                ).first()
+                if data_share:
+                    # Há compartilhamento, permitir acesso; dados médicos no shard da família do perfil
+                    use_profile_shard(db, profile_id)
+                    return profile_id
+            raise HTTPException(status_code=403, detail="Perfil nao autorizado")
+
+        profiles = db.query(models.FamilyProfile).filter(
+            models.FamilyProfile.family_id == user.family_id
+        ).all()
+        if len(profiles) == 1:
+            return profiles[0].id
+
+        for profile in profiles:
+            if profile.account_type == "family_admin" and profile.created_by == user.id:
+                return profile.id
+
+        raise HTTPException(status_code=400, detail="Profile ID requerido")
+
+
+def _load_auth_context(request: Request, token: str, db: Session) -> AuthContext:
+    """Resolve (ou reaproveita) o AuthContext da requisicao."""
+    cached = getattr(request.state, "auth_context", None)
+    if cached is not None and cached.token == token:
+        return cached
+
+    context = AuthContext(request, db, token)
+    if not context.is_api_key:
+        # Verificar blacklist antes de validar token
+        if is_blacklisted(token):
+            forget_verified_token(token)
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token revoked")
+        payload = decode_token_payload(token)
+        user = get_user_from_payload(db, payload)
+        device_id = payload.get("device_id")
+        if device_id:
+            # Estado compacto da sessão (cache write-through), sem consulta por requisição
+            session_state = get_session_state(db, user.id, device_id)
+            if not session_state.is_valid:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid session")
+            context.session = session_state
+        context.payload = payload
+        context._user = user
+
+    # Autenticação sempre lê do primário; leituras seguintes podem ir para réplica.
+    # Shard padrão: família do usuário; profile_id redireciona para a família do perfil alvo.
+    if context.payload:
+        use_family_shard(db, context._user.family_id)
+    use_read_replica(db, context._user.id if context.payload else None)
+    request.state.auth_context = context
+    return context
+
+
+def get_auth_context(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Security(security),
+    db: Session = Depends(get_db)
+) -> AuthContext:
+    """Autentica via API key ou JWT e valida o perfil do header X-Profile-Id."""
+    try:
+        context = _load_auth_context(request, credentials.credentials, db)
+        if not context.is_api_key and context.user.family_id and context._profile_id_header():
+            if not context.header_profile():
+                raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Perfil nao autorizado")
+        return context
     except HTTPException:
         security_logger.warning("Tentativa de acesso com token invalido")
         raise HTTPException(
@@ -430,6 +725,22 @@ def verify_api_key(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+
+def get_jwt_auth_context(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Security(security),
+    db: Session = Depends(get_db)
+) -> AuthContext:
+    """Exige JWT valido (API key nao e aceita), preservando os erros de get_user_from_token."""
+    if credentials.credentials == API_KEY:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    return _load_auth_context(request, credentials.credentials, db)
+
+
+def verify_api_key(auth: AuthContext = Depends(get_auth_context)) -> str:
+    """Verifica a API key fornecida"""
+    return auth.token
+
 def safe_db_commit(db: Session):
     """Helper function para fazer commit seguro com tratamento de exceções"""
     try:
@@ -444,6 +755,32 @@ def safe_db_commit(db: Session):
         raise HTTPException(status_code=500, detail="Database error occurred")
 
 
+def touch_last_login(user: models.User):
+    """Atualiza last_login_at na transação do login (ou no buffer write-behind)."""
+    if activity_buffer.ACTIVITY_WRITE_BEHIND_ENABLED:
+        record_user_login(user)
+        return
+    user.last_login_at = dt.now(timezone.utc)
+
+
+def commit_login(db: Session, user_id: int, session: Optional[models.UserSession], is_new_session: bool):
+    """
+    Commit único da unidade de trabalho do login.
+
+    O estado da sessão é projetado antes do commit (objetos ainda carregados)
+    e só é publicado no cache depois dele, assim como a atividade write-behind.
+    """
+    session_state = state_from_session(session) if session is not None else None
+    device_id = session.device_id if session is not None else None
+    safe_db_commit(db)
+    if session_state is None:
+        return
+    if session_state_cache.SESSION_STATE_CACHE_ENABLED:
+        cache_session_state(user_id, device_id, session_state)
+    if activity_buffer.ACTIVITY_WRITE_BEHIND_ENABLED and not is_new_session:
+        record_session_activity(session)
+
+
 # Funções de validação e sanitização
 def validate_base64_image_size(base64_string: Optional[str], max_size_mb: int = 5) -> bool:
     """Valida o tamanho de uma imagem base64"""
@@ -536,6 +873,7 @@ def ensure_family_for_user(db: Session, user: models.User) -> models.Family:
     user.family_id = family.id
     user.account_type = user.account_type or "family_admin"
     safe_db_commit(db)
+    invalidate_user_cache(user.id)
     return family
 
 
@@ -557,6 +895,7 @@ def ensure_admin_profile(db: Session, user: models.User, family: models.Family)
     )
     db.add(profile)
     safe_db_commit(db)
+    bump_family_graph_version(family.id)
     db.refresh(profile)
     return profile
 
@@ -584,6 +923,9 @@ def get_bearer_token(request: Request) -> Optional[str]:
 
 def get_profile_context(request: Request, db: Session) -> Optional[int]:
     token = get_bearer_token(request)
+    context = getattr(request.state, "auth_context", None)
+    if context is not None and context.token == token:
+        return context.profile_id
     profile_id_header = request.headers.get("X-Profile-Id") if request else None
     
     # Em modo de teste, aceitar profile_id do header mesmo com API_KEY
@@ -595,6 +937,7 @@ def get_profile_context(request: Request, db: Session) -> Optional[int]:
                 models.FamilyProfile.id == profile_id
             ).first()
             if profile:
+                use_family_shard(db, profile.family_id)
                 return profile_id
         except ValueError:
             pass
@@ -604,6 +947,7 @@ def get_profile_context(request: Request, db: Session) -> Optional[int]:
     user = get_user_from_token(db, token)
     if not user or not user.family_id:
         return None
+    use_family_shard(db, user.family_id)
     profile_id = None
     if profile_id_header:
         try:
@@ -629,7 +973,8 @@ def get_profile_context(request: Request, db: Session) -> Optional[int]:
                     models.FamilyDataShare.revoked_at.is_(None)
                 ).first()
                 if data_share:
-                    # Há compartilhamento, permitir acesso
+                    # Há compartilhamento, permitir acesso; dados médicos no shard da família do perfil
+                    use_profile_shard(db, profile_id)
                     return profile_id
             raise HTTPException(status_code=403, detail="Perfil nao autorizado")
         return profile_id
@@ -688,28 +1033,47 @@ def get_request_user(request: Request, db: Session) -> Optional[models.User]:
     token = get_bearer_token(request)
     if not token:
         return None
+    context = getattr(request.state, "auth_context", None)
+    if context is not None and context.token == token:
+        return context.user
     # Em modo de teste, aceitar API_KEY como autenticação válida
     # Criar ou buscar usuário de teste
     if os.getenv("TESTING") == "1" and token == API_KEY:
-        # Buscar ou criar usuário de teste
-        test_user = db.query(models.User).filter(models.User.email == "test@test.com").first()
-        if not test_user:
-            from auth import hash_password
-            test_user = models.User(
-                email="test@test.com",
-                password_hash=hash_password("test"),
-                is_active=True,
-                email_verified=True
-            )
-            db.add(test_user)
-            db.commit()
-            db.refresh(test_user)
-        return test_user
+        return _get_or_create_test_user(db)
     if token == API_KEY:
         return None
     return get_user_from_token(db, token)
 
 
+def get_read_context(
+    auth: AuthContext = Depends(get_auth_context),
+    db: Session = Depends(get_db)
+) -> AuthContext:
+    """
+    Resolve usuario, perfil efetivo e permissao de leitura antes dos endpoints
+    assincronos de listagem (a consulta da lista roda em get_async_db).
+    """
+    user = auth.user
+    # CRÍTICO: Exigir autenticação JWT válida (não aceitar apenas API_KEY)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Autenticacao requerida")
+    profile_id = auth.profile_id
+    if profile_id:
+        ensure_profile_access(user, db, profile_id, write_access=False)
+    return auth
+
+
+def get_family_read_context(
+    auth: AuthContext = Depends(get_auth_context),
+    db: Session = Depends(get_db)
+) -> models.Family:
+    """Familia do usuario autenticado (criada se necessario) para listagens assincronas."""
+    user = auth.user
+    if not user:
+        raise HTTPException(status_code=401, detail="Usuario nao autenticado")
+    return ensure_family_for_user(db, user)
+
+
 # ========== AUTENTICACAO ==========
 @app.post("/api/auth/register", response_model=schemas.AuthTokenResponse)
 @limiter.limit("3/hour")
@@ -848,7 +1212,12 @@ def register_user(request: Request, user_data: schemas.UserCreate, db: Session =
 
 @app.post("/api/auth/login", response_model=schemas.AuthTokenResponse)
 @limiter.limit("5/15minute")
-def login_user(request: Request, login_data: schemas.UserLogin, db: Session = Depends(get_db)):
+def login_user(
+    request: Request,
+    login_data: schemas.UserLogin,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)
+):
     email = login_data.email.strip().lower()
     ip_address, user_agent = get_request_meta(request)
     failed_count = get_failed_attempts_count(db, email, ip_address, WINDOW_MINUTES)
@@ -863,8 +1232,9 @@ def login_user(request: Request, login_data: schemas.UserLogin, db: Session = De
 
     user = authenticate_user(db, email, login_data.password)
     if not user:
-        record_failed_login(db, email, ip_address, user_agent)
-        failed_after = get_failed_attempts_count(db, email, ip_address, WINDOW_MINUTES)
+        # Com o contador no Redis a contagem vem atômica; no modo banco a
+        # tentativa recém-gravada soma uma à contagem já feita acima
+        failed_after = record_failed_login(db, email, ip_address, user_agent) or failed_count + 1
         if failed_after == 3:
             user_for_alert = db.query(models.User).filter(models.User.email == email).first()
             if user_for_alert:
@@ -878,41 +1248,23 @@ def login_user(request: Request, login_data: schemas.UserLogin, db: Session = De
         family = ensure_family_for_user(db, user)
         ensure_admin_profile(db, user, family)
 
-    user.last_login_at = dt.now(timezone.utc)
-    safe_db_commit(db)
-    db.refresh(user)
-
-    # Registrar login bem-sucedido
-    record_successful_login(db, email, ip_address, user_agent)
-    clear_failed_logins(db, email, ip_address)
     device_id = login_data.device.device_id if login_data.device else None
     if device_id and is_device_blocked(db, user.id, device_id):
         raise HTTPException(status_code=403, detail="Dispositivo bloqueado")
+
+    # Unidade de trabalho do login: as escritas abaixo vão em um único commit
+    touch_last_login(user)
+    record_successful_login(db, email, ip_address, user_agent, commit=False)
+    clear_failed_logins(db, email, ip_address, commit=False)
+    session, is_new = None, False
     if device_id:
-        session, is_new = upsert_session(db, user.id, login_data.device, ip_address, user_agent)
-        if is_new:
-            action_token = create_session_action_token(user.id, device_id, "block", expires_minutes=30)
-            base_url = str(request.base_url).rstrip("/")
-            block_link = f"{base_url}/api/auth/sessions/block-link?token={action_token}"
-            send_login_notification(
-                user.email,
-                session.device_name if session else None,
-                session.os_name if session else None,
-                session.os_version if session else None,
-                session.ip_address if session else None,
-                session.user_agent if session else None,
-                block_link=block_link,
-                push_token=session.push_token if session else None,
-                location_lat=session.location_lat if session else None,
-                location_lon=session.location_lon if session else None,
-                location_accuracy_km=session.location_accuracy_km if session else None
-            )
-    log_login_event(db, user.id, device_id, ip_address, user_agent)
+        session, is_new = upsert_session(db, user.id, login_data.device, ip_address, user_agent, commit=False)
+    log_login_event(db, user.id, device_id, ip_address, user_agent, commit=False)
     # Verificar login suspeito apenas se o email não estiver na whitelist
-    if user.email.lower() not in SUSPICIOUS_LOGIN_WHITELIST:
-        if has_suspicious_login_pattern(db, user.id, ip_address, SUSPICIOUS_LOGIN_WINDOW_MINUTES):
-            security_logger.warning(f"Login suspeito para {user.email} (IP {ip_address})")
-            send_suspicious_login_alert(user.email, ip_address, user_agent)
+    suspicious = (
+        user.email.lower() not in SUSPICIOUS_LOGIN_WHITELIST
+        and has_suspicious_login_pattern(db, user.id, ip_address, SUSPICIOUS_LOGIN_WINDOW_MINUTES)
+    )
 
     token_payload = {
         "sub": str(user.id),
@@ -924,8 +1276,36 @@ def login_user(request: Request, login_data: schemas.UserLogin, db: Session = De
     if device_id:
         token_payload["device_id"] = device_id
     access_token = create_access_token(token_payload)
-    refresh_token = create_refresh_token(db, user.id, device_id)
-    return schemas.AuthTokenResponse(access_token=access_token, refresh_token=refresh_token, user=user)
+    refresh_token = create_refresh_token(db, user.id, device_id, commit=False)
+
+    # Montar resposta e notificações antes do commit (objetos ainda carregados)
+    db.flush()
+    response = schemas.AuthTokenResponse(access_token=access_token, refresh_token=refresh_token, user=user)
+    if is_new:
+        action_token = create_session_action_token(user.id, device_id, "block", expires_minutes=30)
+        base_url = str(request.base_url).rstrip("/")
+        block_link = f"{base_url}/api/auth/sessions/block-link?token={action_token}"
+        background_tasks.add_task(
+            send_login_notification,
+            user.email,
+            session.device_name,
+            session.os_name,
+            session.os_version,
+            session.ip_address,
+            session.user_agent,
+            block_link=block_link,
+            push_token=session.push_token,
+            location_lat=session.location_lat,
+            location_lon=session.location_lon,
+            location_accuracy_km=session.location_accuracy_km
+        )
+    if suspicious:
+        security_logger.warning(f"Login suspeito para {user.email} (IP {ip_address})")
+        background_tasks.add_task(send_suspicious_login_alert, user.email, ip_address, user_agent)
+
+    # Efeitos colaterais (emails, push, caches) só rodam após o commit
+    commit_login(db, user.id, session, is_new)
+    return response
 
 
 @app.post("/api/auth/refresh", response_model=schemas.RefreshTokenResponse)
@@ -947,8 +1327,11 @@ def refresh_token(request: Request, data: schemas.RefreshTokenRequest, db: Sessi
         ).first()
         if not session or session.blocked:
             raise HTTPException(status_code=401, detail="Sessao revogada")
-        session.last_activity_at = dt.now(timezone.utc)
-        safe_db_commit(db)
+        if activity_buffer.ACTIVITY_WRITE_BEHIND_ENABLED:
+            record_session_activity(session)
+        else:
+            session.last_activity_at = dt.now(timezone.utc)
+            safe_db_commit(db)
 
     # Rotacionar refresh token
     revoke_refresh_token(db, hash_token(data.refresh_token))
@@ -995,6 +1378,7 @@ def revoke_all_tokens(
             expires_in = int(exp - now)
             if expires_in > 0:
                 add_to_blacklist(token, expires_in)
+        forget_verified_token(token)
     except Exception as e:
         security_logger.warning(f"Erro ao adicionar token à blacklist: {e}")
     
@@ -1061,6 +1445,8 @@ def list_sessions(
             updated = True
     if updated:
         safe_db_commit(db)
+        for session in sessions:
+            refresh_session_state(session)
     return sessions
 
 
@@ -1237,6 +1623,7 @@ def verify_email(request: Request, data: schemas.VerifyEmailRequest, db: Session
     user.email_verified = True
     user.email_verification_token_hash = None
     safe_db_commit(db)
+    invalidate_user_cache(user.id)
     return {"success": True}
 
 
@@ -1360,6 +1747,7 @@ def reset_password(request: Request, data: schemas.ResetPasswordRequest, db: Ses
     user.password_reset_token_hash = None
     user.password_reset_expires_at = None
     safe_db_commit(db)
+    invalidate_user_cache(user.id)
     return {"success": True}
 
 
@@ -1466,8 +1854,26 @@ def _normalize_public_key(public_key: str) -> str:
     return f"-----BEGIN PUBLIC KEY-----\n{wrapped}\n-----END PUBLIC KEY-----"
 
 
-def _verify_biometric_signature(public_key_pem: str, message: bytes, signature_b64: str) -> None:
-    public_key = load_pem_public_key(public_key_pem.encode("utf-8"))
+def _get_active_biometric_device(db: Session, device_id: str) -> Optional[BiometricDeviceRecord]:
+    """Dispositivo biométrico ativo, do cache quando possível."""
+    if biometric_key_cache.BIOMETRIC_DEVICE_CACHE_ENABLED:
+        record = get_cached_biometric_device(device_id)
+        if record is not None:
+            return record
+    device = db.query(models.BiometricDevice).filter(
+        models.BiometricDevice.device_id == device_id,
+        models.BiometricDevice.revoked_at.is_(None)
+    ).first()
+    if not device:
+        return None
+    record = record_from_device(device)
+    if biometric_key_cache.BIOMETRIC_DEVICE_CACHE_ENABLED:
+        fill_biometric_device(record)
+    return record
+
+
+def _verify_biometric_signature(device: BiometricDeviceRecord, message: bytes, signature_b64: str) -> None:
+    public_key = get_public_key(device.id, device.public_key)
     signature = _decode_b64(signature_b64)
     if isinstance(public_key, rsa.RSAPublicKey):
         public_key.verify(signature, message, padding.PKCS1v15(), hashes.SHA256())
@@ -1484,10 +1890,7 @@ def biometric_challenge(
     db: Session = Depends(get_db)
 ):
     logger.info(f"Biometric challenge request for device_id: {data.device_id}")
-    device = db.query(models.BiometricDevice).filter(
-        models.BiometricDevice.device_id == data.device_id,
-        models.BiometricDevice.revoked_at.is_(None)
-    ).first()
+    device = _get_active_biometric_device(db, data.device_id)
     if not device:
         logger.warning(f"Biometric device not found or revoked: {data.device_id}")
         raise HTTPException(status_code=404, detail="Dispositivo nao encontrado")
@@ -1505,6 +1908,7 @@ def biometric_challenge(
 def biometric_login(
     request: Request,
     data: schemas.BiometricAuthRequest,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     logger.info(f"Biometric login attempt for device_id: {data.device_id}")
@@ -1514,16 +1918,13 @@ def biometric_login(
         if challenge_payload.get("device_id") != data.device_id:
             logger.error(f"Device ID mismatch: token={challenge_payload.get('device_id')}, request={data.device_id}")
             raise HTTPException(status_code=400, detail="Token invalido")
-        device = db.query(models.BiometricDevice).filter(
-            models.BiometricDevice.device_id == data.device_id,
-            models.BiometricDevice.revoked_at.is_(None)
-        ).first()
+        device = _get_active_biometric_device(db, data.device_id)
         if not device:
             logger.error(f"Biometric device not found or revoked: {data.device_id}")
             raise HTTPException(status_code=404, detail="Dispositivo nao encontrado")
         logger.info(f"Biometric device found for user_id: {device.user_id}")
         try:
-            _verify_biometric_signature(device.public_key, data.challenge.encode("utf-8"), data.signature)
+            _verify_biometric_signature(device, data.challenge.encode("utf-8"), data.signature)
             logger.info(f"Biometric signature verified successfully for device_id: {data.device_id}")
         except InvalidSignature as e:
             logger.error(f"Invalid biometric signature for device_id: {data.device_id}, error: {str(e)}")
@@ -1541,16 +1942,14 @@ def biometric_login(
             family = ensure_family_for_user(db, user)
             ensure_admin_profile(db, user, family)
 
-        # Atualizar último login
-        user.last_login_at = dt.now(timezone.utc)
-        safe_db_commit(db)
-        db.refresh(user)
-
         # Verificar se dispositivo está bloqueado
         if is_device_blocked(db, user.id, data.device_id):
             logger.warning(f"Biometric login blocked for user {user.id} with device {data.device_id}")
             raise HTTPException(status_code=403, detail="Dispositivo bloqueado")
 
+        # Unidade de trabalho do login: último login, sessão e refresh token em um único commit
+        touch_last_login(user)
+
         # Criar/atualizar sessão (crítico para validação posterior)
         ip_address, user_agent = get_request_meta(request)
         device_info = schemas.DeviceInfo(
@@ -1559,7 +1958,7 @@ def biometric_login(
             os_name="Unknown",
             os_version="Unknown"
         )
-        session, is_new = upsert_session(db, user.id, device_info, ip_address, user_agent)
+        session, is_new = upsert_session(db, user.id, device_info, ip_address, user_agent, commit=False)
         logger.info(f"Session {'created' if is_new else 'updated'} for user {user.id} with device {data.device_id}")
 
         token_payload = {
@@ -1571,8 +1970,12 @@ def biometric_login(
             "device_id": data.device_id
         }
         access_token = create_access_token(token_payload)
-        refresh_token = create_refresh_token(db, user.id, data.device_id)
-        return schemas.AuthTokenResponse(access_token=access_token, refresh_token=refresh_token, user=user)
+        refresh_token = create_refresh_token(db, user.id, data.device_id, commit=False)
+
+        db.flush()
+        response = schemas.AuthTokenResponse(access_token=access_token, refresh_token=refresh_token, user=user)
+        commit_login(db, user.id, session, is_new)
+        return response
     except HTTPException:
         raise
     except Exception as e:
@@ -1608,6 +2011,9 @@ def register_biometric_device(
             db.add(device)
         safe_db_commit(db)
         db.refresh(device)
+        invalidate_biometric_device(device.device_id, device.id)
+        if biometric_key_cache.BIOMETRIC_DEVICE_CACHE_ENABLED:
+            cache_biometric_device(record_from_device(device))
         return device
     except Exception as e:
         logger.error(f"Erro ao registrar biometria: {str(e)}")
@@ -1766,6 +2172,7 @@ def revoke_biometric_device(
         raise HTTPException(status_code=404, detail="Dispositivo nao encontrado")
     device.revoked_at = dt.now(timezone.utc)
     safe_db_commit(db)
+    invalidate_biometric_device(device_id, device.id)
     return {"success": True}
 
 
@@ -1806,28 +2213,26 @@ def _invite_response(invite: models.FamilyInvite) -> schemas.FamilyInviteRespons
     return schemas.FamilyInviteResponse(**data)
 @app.get("/api/family/profiles", response_model=list[schemas.FamilyProfileResponse])
 @limiter.limit("100/minute")
-def list_family_profiles(
+async def list_family_profiles(
     request: Request,
-    api_key: str = Depends(verify_api_key),
-    db: Session = Depends(get_db)
+    family: models.Family = Depends(get_family_read_context),
+    db=Depends(get_async_db)
 ):
     """Lista perfis da família do usuário autenticado"""
-    user = get_request_user(request, db)
-    if not user:
-        raise HTTPException(status_code=401, detail="Usuario nao autenticado")
-    family = ensure_family_for_user(db, user)
-    profiles = db.query(models.FamilyProfile).filter(
-        models.FamilyProfile.family_id == family.id
-    ).order_by(models.FamilyProfile.created_at.desc()).all()
-    return profiles
+    result = await db.execute(
+        select(models.FamilyProfile)
+        .where(models.FamilyProfile.family_id == family.id)
+        .order_by(models.FamilyProfile.created_at.desc())
+    )
+    return result.scalars().all()
 
 
 @app.get("/api/family/invites", response_model=list[schemas.FamilyInviteResponse])
 def list_family_invites(
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     family = ensure_family_for_user(db, user)
     invites = db.query(models.FamilyInvite).filter(
         models.FamilyInvite.family_id == family.id
@@ -1840,11 +2245,11 @@ def list_family_invites(
 def delete_family_profile(
     request: Request,
     profile_id: int,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
     """Deleta um perfil da família (apenas family_admin)"""
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     if user.account_type != "family_admin":
         raise HTTPException(status_code=403, detail="Apenas administradores podem deletar perfis")
     
@@ -1886,6 +2291,7 @@ def delete_family_profile(
     # Deletar o perfil
     db.delete(profile)
     safe_db_commit(db)
+    bump_family_graph_version(family.id)
     
     return {"success": True, "message": "Perfil deletado com sucesso"}
 
@@ -1895,11 +2301,11 @@ def delete_family_profile(
 def add_family_child(
     request: Request,
     data: schemas.FamilyMemberCreate,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
     """Adiciona uma criança à família (apenas family_admin)"""
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     if user.account_type != "family_admin":
         raise HTTPException(status_code=403, detail="Apenas administradores podem adicionar familiares")
     
@@ -1955,6 +2361,7 @@ def add_family_child(
     )
     db.add(caregiver)
     safe_db_commit(db)
+    bump_family_graph_version(family.id)
     
     return profile
 
@@ -1964,11 +2371,11 @@ def add_family_child(
 def add_family_adult(
     request: Request,
     data: schemas.FamilyMemberCreate,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
     """Adiciona um adulto à família (apenas family_admin)"""
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     if user.account_type != "family_admin":
         raise HTTPException(status_code=403, detail="Apenas administradores podem adicionar familiares")
     
@@ -2014,6 +2421,7 @@ def add_family_adult(
     )
     db.add(profile)
     safe_db_commit(db)
+    bump_family_graph_version(family.id)
     db.refresh(profile)
     
     return profile
@@ -2024,11 +2432,11 @@ def add_family_adult(
 def add_family_elder(
     request: Request,
     data: schemas.FamilyMemberCreate,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
     """Adiciona um idoso sob cuidados à família (apenas family_admin)"""
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     if user.account_type != "family_admin":
         raise HTTPException(status_code=403, detail="Apenas administradores podem adicionar familiares")
     
@@ -2079,6 +2487,7 @@ def add_family_elder(
     )
     db.add(caregiver)
     safe_db_commit(db)
+    bump_family_graph_version(family.id)
     
     return profile
 
@@ -2088,12 +2497,12 @@ def add_family_elder(
 def create_family_invite(
     request: Request,
     data: schemas.FamilyInviteCreate,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
     try:
         security_logger.info(f"Criando convite - invitee_email recebido: {repr(data.invitee_email)}")
-        user = get_user_from_token(db, credentials.credentials)
+        user = auth.user
         # Permitir que family_admin e adult_member possam criar convites
         if user.account_type not in ["family_admin", "adult_member"]:
             raise HTTPException(status_code=403, detail="Sem permissao para convidar")
@@ -2167,10 +2576,10 @@ def create_family_invite(
 @app.delete("/api/family/invite/{invite_id}", response_model=schemas.FamilyInviteResponse)
 def cancel_family_invite(
     invite_id: int,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     family = ensure_family_for_user(db, user)
     invite = db.query(models.FamilyInvite).filter(
         models.FamilyInvite.id == invite_id,
@@ -2189,10 +2598,10 @@ def cancel_family_invite(
 def resend_family_invite(
     request: Request,
     invite_id: int,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     if user.account_type != "family_admin":
         raise HTTPException(status_code=403, detail="Sem permissao para reenviar")
     family = ensure_family_for_user(db, user)
@@ -2220,10 +2629,10 @@ def resend_family_invite(
 @app.post("/api/family/accept-invite", response_model=schemas.FamilyInviteResponse)
 def accept_family_invite(
     data: schemas.FamilyInviteAccept,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     invite = db.query(models.FamilyInvite).filter(
         models.FamilyInvite.invite_code == data.code
     ).first()
@@ -2261,11 +2670,13 @@ def accept_family_invite(
         ).delete(synchronize_session=False)
         db.query(models.Family).filter(models.Family.id == old_family_id).delete(synchronize_session=False)
         safe_db_commit(db)
+        bump_family_graph_version(old_family_id)
 
     user.family_id = invite.family_id
     user.account_type = "adult_member"
     user.created_by = invite.inviter_user_id
     safe_db_commit(db)
+    invalidate_user_cache(user.id)
 
     profile = db.query(models.FamilyProfile).filter(
         models.FamilyProfile.family_id == invite.family_id,
@@ -2319,6 +2730,7 @@ def accept_family_invite(
     invite.accepted_at = dt.now(timezone.utc)
     invite.accepted_by_user_id = user.id
     safe_db_commit(db)
+    bump_family_graph_version(invite.family_id)
     db.refresh(invite)
     return _invite_response(invite)
 
@@ -2358,6 +2770,7 @@ def _create_family_profile(
     )
     db.add(profile)
     safe_db_commit(db)
+    bump_family_graph_version(family.id)
     db.refresh(profile)
 
     if account_type in {"child", "elder_under_care"}:
@@ -2374,10 +2787,10 @@ def _create_family_profile(
 
 @app.get("/api/family/links", response_model=list[schemas.FamilyLinkResponse])
 def list_family_links(
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     family = ensure_family_for_user(db, user)
     links = db.query(models.FamilyProfileLink).filter(
         models.FamilyProfileLink.family_id == family.id
@@ -2389,14 +2802,14 @@ def list_family_links(
 def create_family_link(
     request: Request,
     data: schemas.FamilyLinkCreate,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     if user.account_type != "family_admin":
         raise HTTPException(status_code=403, detail="Sem permissao para vincular perfis")
     family = ensure_family_for_user(db, user)
-    source_profile_id = get_profile_context(request, db)
+    source_profile_id = auth.profile_id
     if not source_profile_id:
         raise HTTPException(status_code=400, detail="Profile ID requerido")
     target_profile = db.query(models.FamilyProfile).filter(
@@ -2431,12 +2844,12 @@ def create_family_link(
 def accept_family_link(
     request: Request,
     link_id: int,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     family = ensure_family_for_user(db, user)
-    profile_id = get_profile_context(request, db)
+    profile_id = auth.profile_id
     link = db.query(models.FamilyProfileLink).filter(
         models.FamilyProfileLink.id == link_id,
         models.FamilyProfileLink.family_id == family.id
@@ -2457,16 +2870,16 @@ def accept_family_link(
 def list_family_data_shares(
     request: Request,
     profile_id: Optional[int] = None,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
     """Lista compartilhamentos de dados"""
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     family = ensure_family_for_user(db, user)
     
     # Se profile_id não foi fornecido, tentar obter do contexto
     if profile_id is None:
-        profile_id = get_profile_context(request, db)
+        profile_id = auth.profile_id
     
     query = db.query(models.FamilyDataShare).filter(
         models.FamilyDataShare.family_id == family.id,
@@ -2541,11 +2954,11 @@ def list_family_data_shares(
 def create_family_data_share(
     request: Request,
     data: schemas.FamilyDataShareCreate,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
     """Cria um compartilhamento de dados entre perfis"""
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     family = ensure_family_for_user(db, user)
     
     # Verificar permissão: apenas family_admin ou dono do perfil pode compartilhar
@@ -2626,6 +3039,7 @@ def create_family_data_share(
     )
     db.add(share)
     safe_db_commit(db)
+    bump_family_graph_version(family.id)
     db.refresh(share)
     
     # Log de auditoria - compartilhamento
@@ -2662,12 +3076,12 @@ def create_family_data_share(
 def revoke_family_data_share(
     request: Request,
     share_id: int,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     family = ensure_family_for_user(db, user)
-    profile_id = get_profile_context(request, db)
+    profile_id = auth.profile_id
     share = db.query(models.FamilyDataShare).filter(
         models.FamilyDataShare.id == share_id,
         models.FamilyDataShare.family_id == family.id,
@@ -2679,6 +3093,7 @@ def revoke_family_data_share(
         raise HTTPException(status_code=403, detail="Sem permissao para revogar")
     share.revoked_at = dt.now(timezone.utc)
     safe_db_commit(db)
+    bump_family_graph_version(family.id)
     return {"success": True}
 
 
@@ -2688,11 +3103,11 @@ def revoke_family_data_share(
 def add_caregiver(
     request: Request,
     data: schemas.FamilyCaregiverCreate,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
     """Adiciona um cuidador a um perfil (apenas family_admin ou dono do perfil)"""
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     family = ensure_family_for_user(db, user)
     
     # Verificar se o perfil pertence à família
@@ -2752,6 +3167,7 @@ def add_caregiver(
     )
     db.add(caregiver)
     safe_db_commit(db)
+    bump_family_graph_version(family.id)
     db.refresh(caregiver)
     
     # Buscar informações do cuidador para resposta
@@ -2781,11 +3197,11 @@ def add_caregiver(
 def list_caregivers(
     request: Request,
     profile_id: int,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
     """Lista cuidadores de um perfil"""
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     family = ensure_family_for_user(db, user)
     
     # Verificar se o perfil pertence à família
@@ -2875,11 +3291,11 @@ def update_caregiver(
     request: Request,
     caregiver_id: int,
     data: schemas.FamilyCaregiverUpdate,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
     """Atualiza o nível de acesso de um cuidador"""
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     family = ensure_family_for_user(db, user)
     
     # Buscar cuidador
@@ -2911,6 +3327,7 @@ def update_caregiver(
     # Atualizar nível de acesso
     caregiver.access_level = data.access_level
     safe_db_commit(db)
+    bump_family_graph_version(family.id)
     db.refresh(caregiver)
     
     # Buscar informações do cuidador para resposta
@@ -2941,11 +3358,11 @@ def update_caregiver(
 def remove_caregiver(
     request: Request,
     caregiver_id: int,
-    credentials: HTTPAuthorizationCredentials = Security(security),
+    auth: AuthContext = Depends(get_jwt_auth_context),
     db: Session = Depends(get_db)
 ):
     """Remove um cuidador de um perfil"""
-    user = get_user_from_token(db, credentials.credentials)
+    user = auth.user
     family = ensure_family_for_user(db, user)
     
     # Buscar cuidador
@@ -2977,6 +3394,7 @@ def remove_caregiver(
     # Remover cuidador
     db.delete(caregiver)
     safe_db_commit(db)
+    bump_family_graph_version(family.id)
     
     return {"success": True, "message": "Cuidador removido com sucesso"}
 
@@ -2988,31 +3406,23 @@ def remove_caregiver(
 # ========== MEDICAMENTOS ==========
 @app.get("/api/medications")
 @limiter.limit("100/minute")
-def get_medications(request: Request, api_key: str = Depends(verify_api_key)):
+async def get_medications(request: Request, auth: AuthContext = Depends(get_read_context), db=Depends(get_async_db)):
     security_logger.info(f"Acesso GET /api/medications de {get_remote_address(request)}")
-    db = next(get_db())
-    user = get_request_user(request, db)
-    
-    # CRÍTICO: Exigir autenticação JWT válida (não aceitar apenas API_KEY)
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Autenticacao requerida")
-    
-    profile_id = get_profile_context(request, db)
-    if profile_id:
-        ensure_profile_access(user, db, profile_id, write_access=False)
-        query = db.query(models.Medication).filter(models.Medication.profile_id == profile_id)
-    else:
+    user = auth.user
+    profile_id = auth.profile_id
+    if not profile_id:
         # Se não há profile_id, retornar vazio (não retornar todos os medicamentos)
-        query = db.query(models.Medication).filter(False)  # Query que sempre retorna vazio
-    
-    medications = query.all()
+        return []
+
+    result = await db.execute(select(models.Medication).where(models.Medication.profile_id == profile_id))
+    medications = result.scalars().all()
     
     # Log de auditoria - visualização
-    if user and profile_id:
-        try:
-            log_view_action(db, user, RESOURCE_MEDICATION, None, profile_id, request)
-        except Exception as e:
-            security_logger.warning(f"Erro ao registrar log de auditoria: {e}")
+    try:
+        # INSERT + commit síncronos: fora do event loop
+        await run_in_threadpool(log_view_action, auth.db, user, RESOURCE_MEDICATION, None, profile_id, request)
+    except Exception as e:
+        security_logger.warning(f"Erro ao registrar log de auditoria: {e}")
     
     # Retornar incluindo encrypted_data se presente
     result = []
@@ -3026,7 +3436,7 @@ def get_medications(request: Request, api_key: str = Depends(verify_api_key)):
 
 @app.post("/api/medications")
 @limiter.limit("20/minute")
-def create_medication(request: Request, medication: schemas.MedicationCreate, api_key: str = Depends(verify_api_key)):
+def create_medication(request: Request, medication: schemas.MedicationCreate, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     security_logger.info(f"Acesso POST /api/medications de {get_remote_address(request)}")
     
     # Validar tamanho da imagem
@@ -3040,9 +3450,8 @@ def create_medication(request: Request, medication: schemas.MedicationCreate, ap
     if medication.notes:
         medication.notes = sanitize_string(medication.notes, 5000)
     
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=True)
     try:
@@ -3083,7 +3492,7 @@ def create_medication(request: Request, medication: schemas.MedicationCreate, ap
         if db_medication.encrypted_data:
             response['encrypted_data'] = db_medication.encrypted_data
         return response
-    except HTTPException:
+    except (HTTPException, UnroutedShardError):
         raise
     except Exception as e:
         db.rollback()
@@ -3093,7 +3502,7 @@ def create_medication(request: Request, medication: schemas.MedicationCreate, ap
 
 @app.put("/api/medications/{medication_id}")
 @limiter.limit("20/minute")
-def update_medication(request: Request, medication_id: int, medication: schemas.MedicationCreate, api_key: str = Depends(verify_api_key)):
+def update_medication(request: Request, medication_id: int, medication: schemas.MedicationCreate, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     security_logger.info(f"Acesso PUT /api/medications/{medication_id} de {get_remote_address(request)}")
     
     # Validar encrypted_data se fornecido
@@ -3112,9 +3521,8 @@ def update_medication(request: Request, medication_id: int, medication: schemas.
     if medication.notes:
         medication.notes = sanitize_string(medication.notes, 5000)
     
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=True)
     query = db.query(models.Medication).filter(models.Medication.id == medication_id)
@@ -3165,7 +3573,7 @@ def update_medication(request: Request, medication_id: int, medication: schemas.
         if db_medication.encrypted_data:
             response['encrypted_data'] = db_medication.encrypted_data
         return response
-    except HTTPException:
+    except (HTTPException, UnroutedShardError):
         raise
     except Exception as e:
         db.rollback()
@@ -3175,11 +3583,10 @@ def update_medication(request: Request, medication_id: int, medication: schemas.
 
 @app.delete("/api/medications/{medication_id}")
 @limiter.limit("20/minute")
-def delete_medication(request: Request, medication_id: int, api_key: str = Depends(verify_api_key)):
+def delete_medication(request: Request, medication_id: int, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     security_logger.info(f"Acesso DELETE /api/medications/{medication_id} de {get_remote_address(request)}")
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=True, delete_access=True)
     query = db.query(models.Medication).filter(models.Medication.id == medication_id)
@@ -3202,7 +3609,7 @@ def delete_medication(request: Request, medication_id: int, api_key: str = Depen
         db.delete(db_medication)
         safe_db_commit(db)
         return {"message": "Medication deleted"}
-    except HTTPException:
+    except (HTTPException, UnroutedShardError):
         raise
     except Exception as e:
         db.rollback()
@@ -3213,30 +3620,21 @@ def delete_medication(request: Request, medication_id: int, api_key: str = Depen
 # ========== MEDICATION LOGS ==========
 @app.get("/api/medication-logs")
 @limiter.limit("100/minute")
-def get_medication_logs(request: Request, api_key: str = Depends(verify_api_key)):
+async def get_medication_logs(request: Request, auth: AuthContext = Depends(get_read_context), db=Depends(get_async_db)):
     security_logger.info(f"Acesso GET /api/medication-logs de {get_remote_address(request)}")
-    db = next(get_db())
-    user = get_request_user(request, db)
-    
-    # CRÍTICO: Exigir autenticação JWT válida (não aceitar apenas API_KEY)
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Autenticacao requerida")
-    
-    profile_id = get_profile_context(request, db)
-    if profile_id:
-        ensure_profile_access(user, db, profile_id, write_access=False)
-        query = db.query(models.MedicationLog).filter(models.MedicationLog.profile_id == profile_id)
-    else:
+    profile_id = auth.profile_id
+    if not profile_id:
         # Se não há profile_id, retornar vazio (não retornar todos os logs)
-        query = db.query(models.MedicationLog).filter(False)  # Query que sempre retorna vazio
-    
-    logs = query.all()
+        return []
+
+    result = await db.execute(select(models.MedicationLog).where(models.MedicationLog.profile_id == profile_id))
+    logs = result.scalars().all()
     return [schemas.MedicationLogResponse.model_validate(l).model_dump() for l in logs]
 
 
 @app.post("/api/medication-logs")
 @limiter.limit("30/minute")
-def create_medication_log(request: Request, log: schemas.MedicationLogCreate, api_key: str = Depends(verify_api_key)):
+def create_medication_log(request: Request, log: schemas.MedicationLogCreate, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     security_logger.info(f"Acesso POST /api/medication-logs de {get_remote_address(request)}")
     
     # Sanitizar dados
@@ -3244,9 +3642,8 @@ def create_medication_log(request: Request, log: schemas.MedicationLogCreate, ap
     if log.status not in ["taken", "skipped", "postponed"]:
         raise HTTPException(status_code=400, detail="Invalid status. Must be: taken, skipped, or postponed")
     
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=True)
     try:
@@ -3259,7 +3656,7 @@ def create_medication_log(request: Request, log: schemas.MedicationLogCreate, ap
         safe_db_commit(db)
         db.refresh(db_log)
         return schemas.MedicationLogResponse.model_validate(db_log).model_dump()
-    except HTTPException:
+    except (HTTPException, UnroutedShardError):
         raise
     except Exception as e:
         db.rollback()
@@ -3270,30 +3667,25 @@ def create_medication_log(request: Request, log: schemas.MedicationLogCreate, ap
 # ========== CONTATOS DE EMERGÊNCIA ==========
 @app.get("/api/emergency-contacts")
 @limiter.limit("100/minute")
-def get_emergency_contacts(request: Request, api_key: str = Depends(verify_api_key)):
+async def get_emergency_contacts(request: Request, auth: AuthContext = Depends(get_read_context), db=Depends(get_async_db)):
     security_logger.info(f"Acesso GET /api/emergency-contacts de {get_remote_address(request)}")
-    db = next(get_db())
-    user = get_request_user(request, db)
-    
-    # CRÍTICO: Exigir autenticação JWT válida (não aceitar apenas API_KEY)
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Autenticacao requerida")
-    
-    profile_id = get_profile_context(request, db)
-    if profile_id:
-        ensure_profile_access(user, db, profile_id, write_access=False)
-        query = db.query(models.EmergencyContact).filter(models.EmergencyContact.profile_id == profile_id)
-    else:
+    profile_id = auth.profile_id
+    if not profile_id:
         # Se não há profile_id, retornar vazio (não retornar todos os contatos)
-        query = db.query(models.EmergencyContact).filter(False)  # Query que sempre retorna vazio
-    
-    contacts = query.order_by(models.EmergencyContact.id.asc()).all()
+        return []
+
+    result = await db.execute(
+        select(models.EmergencyContact)
+        .where(models.EmergencyContact.profile_id == profile_id)
+        .order_by(models.EmergencyContact.id.asc())
+    )
+    contacts = result.scalars().all()
     return [schemas.EmergencyContactResponse.model_validate(c).model_dump() for c in contacts]
 
 
 @app.post("/api/emergency-contacts")
 @limiter.limit("20/minute")
-def create_emergency_contact(request: Request, contact: schemas.EmergencyContactCreate, api_key: str = Depends(verify_api_key)):
+def create_emergency_contact(request: Request, contact: schemas.EmergencyContactCreate, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     security_logger.info(f"Acesso POST /api/emergency-contacts de {get_remote_address(request)}")
     
     # Validar tamanho da imagem
@@ -3306,9 +3698,8 @@ def create_emergency_contact(request: Request, contact: schemas.EmergencyContact
     if contact.relation:
         contact.relation = sanitize_string(contact.relation, 100)
     
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=True)
     
@@ -3326,7 +3717,7 @@ def create_emergency_contact(request: Request, contact: schemas.EmergencyContact
         safe_db_commit(db)
         db.refresh(db_contact)
         return schemas.EmergencyContactResponse.model_validate(db_contact).model_dump()
-    except HTTPException:
+    except (HTTPException, UnroutedShardError):
         raise
     except Exception as e:
         db.rollback()
@@ -3336,7 +3727,7 @@ def create_emergency_contact(request: Request, contact: schemas.EmergencyContact
 
 @app.put("/api/emergency-contacts/{contact_id}")
 @limiter.limit("20/minute")
-def update_emergency_contact(request: Request, contact_id: int, contact: schemas.EmergencyContactCreate, api_key: str = Depends(verify_api_key)):
+def update_emergency_contact(request: Request, contact_id: int, contact: schemas.EmergencyContactCreate, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     security_logger.info(f"Acesso PUT /api/emergency-contacts/{contact_id} de {get_remote_address(request)}")
     
     # Validar tamanho da imagem
@@ -3349,9 +3740,8 @@ def update_emergency_contact(request: Request, contact_id: int, contact: schemas
     if contact.relation:
         contact.relation = sanitize_string(contact.relation, 100)
     
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=True)
     query = db.query(models.EmergencyContact).filter(models.EmergencyContact.id == contact_id)
@@ -3368,7 +3758,7 @@ def update_emergency_contact(request: Request, contact_id: int, contact: schemas
         safe_db_commit(db)
         db.refresh(db_contact)
         return schemas.EmergencyContactResponse.model_validate(db_contact).model_dump()
-    except HTTPException:
+    except (HTTPException, UnroutedShardError):
         raise
     except Exception as e:
         db.rollback()
@@ -3378,11 +3768,10 @@ def update_emergency_contact(request: Request, contact_id: int, contact: schemas
 
 @app.delete("/api/emergency-contacts/{contact_id}")
 @limiter.limit("20/minute")
-def delete_emergency_contact(request: Request, contact_id: int, api_key: str = Depends(verify_api_key)):
+def delete_emergency_contact(request: Request, contact_id: int, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     security_logger.info(f"Acesso DELETE /api/emergency-contacts/{contact_id} de {get_remote_address(request)}")
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=True, delete_access=True)
     query = db.query(models.EmergencyContact).filter(models.EmergencyContact.id == contact_id)
@@ -3396,7 +3785,7 @@ def delete_emergency_contact(request: Request, contact_id: int, api_key: str = D
         db.delete(db_contact)
         safe_db_commit(db)
         return {"message": "Contact deleted"}
-    except HTTPException:
+    except (HTTPException, UnroutedShardError):
         raise
     except Exception as e:
         db.rollback()
@@ -3407,38 +3796,34 @@ def delete_emergency_contact(request: Request, contact_id: int, api_key: str = D
 # ========== VISITAS AO MÉDICO ==========
 @app.get("/api/doctor-visits")
 @limiter.limit("100/minute")
-def get_doctor_visits(request: Request, api_key: str = Depends(verify_api_key)):
+async def get_doctor_visits(request: Request, auth: AuthContext = Depends(get_read_context), db=Depends(get_async_db)):
     security_logger.info(f"Acesso GET /api/doctor-visits de {get_remote_address(request)}")
-    db = next(get_db())
-    user = get_request_user(request, db)
-    
-    # CRÍTICO: Exigir autenticação JWT válida (não aceitar apenas API_KEY)
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Autenticacao requerida")
-    
-    profile_id = get_profile_context(request, db)
-    if profile_id:
-        ensure_profile_access(user, db, profile_id, write_access=False)
-        query = db.query(models.DoctorVisit).filter(models.DoctorVisit.profile_id == profile_id)
-    else:
+    user = auth.user
+    profile_id = auth.profile_id
+    if not profile_id:
         # Se não há profile_id, retornar vazio (não retornar todas as visitas)
-        query = db.query(models.DoctorVisit).filter(False)  # Query que sempre retorna vazio
-    
-    visits = query.order_by(models.DoctorVisit.date.desc()).all()
+        return []
+
+    result = await db.execute(
+        select(models.DoctorVisit)
+        .where(models.DoctorVisit.profile_id == profile_id)
+        .order_by(models.DoctorVisit.date.desc())
+    )
+    visits = result.scalars().all()
     
     # Log de auditoria - visualização
-    if user and profile_id:
-        try:
-            log_view_action(db, user, RESOURCE_VISIT, None, profile_id, request)
-        except Exception as e:
-            security_logger.warning(f"Erro ao registrar log de auditoria: {e}")
+    try:
+        # INSERT + commit síncronos: fora do event loop
+        await run_in_threadpool(log_view_action, auth.db, user, RESOURCE_VISIT, None, profile_id, request)
+    except Exception as e:
+        security_logger.warning(f"Erro ao registrar log de auditoria: {e}")
     
     return [schemas.DoctorVisitResponse.model_validate(v).model_dump() for v in visits]
 
 
 @app.post("/api/doctor-visits")
 @limiter.limit("20/minute")
-def create_doctor_visit(request: Request, visit: schemas.DoctorVisitCreate, api_key: str = Depends(verify_api_key)):
+def create_doctor_visit(request: Request, visit: schemas.DoctorVisitCreate, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     security_logger.info(f"Acesso POST /api/doctor-visits de {get_remote_address(request)}")
     
     # Validar tamanho da imagem
@@ -3451,9 +3836,8 @@ def create_doctor_visit(request: Request, visit: schemas.DoctorVisitCreate, api_
     if visit.notes:
         visit.notes = sanitize_string(visit.notes, 5000)
     
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=True)
     try:
@@ -3487,7 +3871,7 @@ def create_doctor_visit(request: Request, visit: schemas.DoctorVisitCreate, api_
                 security_logger.warning(f"Erro ao registrar log de auditoria: {e}")
         
         return schemas.DoctorVisitResponse.model_validate(db_visit).model_dump()
-    except HTTPException:
+    except (HTTPException, UnroutedShardError):
         raise
     except Exception as e:
         db.rollback()
@@ -3497,7 +3881,7 @@ def create_doctor_visit(request: Request, visit: schemas.DoctorVisitCreate, api_
 
 @app.put("/api/doctor-visits/{visit_id}")
 @limiter.limit("20/minute")
-def update_doctor_visit(request: Request, visit_id: int, visit: schemas.DoctorVisitCreate, api_key: str = Depends(verify_api_key)):
+def update_doctor_visit(request: Request, visit_id: int, visit: schemas.DoctorVisitCreate, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     security_logger.info(f"Acesso PUT /api/doctor-visits/{visit_id} de {get_remote_address(request)}")
     
     # Validar tamanho da imagem
@@ -3510,9 +3894,8 @@ def update_doctor_visit(request: Request, visit_id: int, visit: schemas.DoctorVi
     if visit.notes:
         visit.notes = sanitize_string(visit.notes, 5000)
     
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=True)
     query = db.query(models.DoctorVisit).filter(models.DoctorVisit.id == visit_id)
@@ -3529,7 +3912,7 @@ def update_doctor_visit(request: Request, visit_id: int, visit: schemas.DoctorVi
         safe_db_commit(db)
         db.refresh(db_visit)
         return schemas.DoctorVisitResponse.model_validate(db_visit).model_dump()
-    except HTTPException:
+    except (HTTPException, UnroutedShardError):
         raise
     except Exception as e:
         db.rollback()
@@ -3539,11 +3922,10 @@ def update_doctor_visit(request: Request, visit_id: int, visit: schemas.DoctorVi
 
 @app.delete("/api/doctor-visits/{visit_id}")
 @limiter.limit("20/minute")
-def delete_doctor_visit(request: Request, visit_id: int, api_key: str = Depends(verify_api_key)):
+def delete_doctor_visit(request: Request, visit_id: int, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     security_logger.info(f"Acesso DELETE /api/doctor-visits/{visit_id} de {get_remote_address(request)}")
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=True, delete_access=True)
     query = db.query(models.DoctorVisit).filter(models.DoctorVisit.id == visit_id)
@@ -3557,7 +3939,7 @@ def delete_doctor_visit(request: Request, visit_id: int, api_key: str = Depends(
         db.delete(db_visit)
         safe_db_commit(db)
         return {"message": "Visit deleted"}
-    except HTTPException:
+    except (HTTPException, UnroutedShardError):
         raise
     except Exception as e:
         db.rollback()
@@ -3566,9 +3948,10 @@ def delete_doctor_visit(request: Request, visit_id: int, api_key: str = Depends(
 
 
 # ========== EXAMES MÉDICOS ==========
-def process_exam_ocr(exam_id: int):
+def process_exam_ocr(exam_id: int, family_id: Optional[int] = None):
     """Função para processar OCR em background"""
     db = SessionLocal()
+    use_family_shard(db, family_id)
     try:
         exam = db.query(models.MedicalExam).filter(models.MedicalExam.id == exam_id).first()
         if not exam:
@@ -3648,7 +4031,8 @@ def create_medical_exam(
     request: Request,
     background_tasks: BackgroundTasks,
     exam: schemas.MedicalExamCreate,
-    api_key: str = Depends(verify_api_key)
+    auth: AuthContext = Depends(get_auth_context),
+    db: Session = Depends(get_db)
 ):
     security_logger.info(f"Acesso POST /api/medical-exams de {get_remote_address(request)}")
     
@@ -3656,9 +4040,8 @@ def create_medical_exam(
     if not validate_base64_image_size(exam.image_base64, max_size_mb=10):
         raise HTTPException(status_code=400, detail="Image size exceeds maximum allowed (10MB)")
     
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=True)
     try:
@@ -3694,10 +4077,10 @@ def create_medical_exam(
                 security_logger.warning(f"Erro ao registrar log de auditoria: {e}")
         
         # Adicionar tarefa de processamento em background
-        background_tasks.add_task(process_exam_ocr, db_exam.id)
+        background_tasks.add_task(process_exam_ocr, db_exam.id, db.info.get("family_id"))
         
         return schemas.MedicalExamResponse.model_validate(db_exam).model_dump()
-    except HTTPException:
+    except (HTTPException, UnroutedShardError):
         raise
     except Exception as e:
         db.rollback()
@@ -3707,31 +4090,27 @@ def create_medical_exam(
 
 @app.get("/api/medical-exams")
 @limiter.limit("100/minute")
-def get_medical_exams(request: Request, api_key: str = Depends(verify_api_key)):
+async def get_medical_exams(request: Request, auth: AuthContext = Depends(get_read_context), db=Depends(get_async_db)):
     security_logger.info(f"Acesso GET /api/medical-exams de {get_remote_address(request)}")
-    db = next(get_db())
-    user = get_request_user(request, db)
-    
-    # CRÍTICO: Exigir autenticação JWT válida (não aceitar apenas API_KEY)
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Autenticacao requerida")
-    
-    profile_id = get_profile_context(request, db)
-    if profile_id:
-        ensure_profile_access(user, db, profile_id, write_access=False)
-        query = db.query(models.MedicalExam).filter(models.MedicalExam.profile_id == profile_id)
-    else:
+    user = auth.user
+    profile_id = auth.profile_id
+    if not profile_id:
         # Se não há profile_id, retornar vazio (não retornar todos os exames)
-        query = db.query(models.MedicalExam).filter(False)  # Query que sempre retorna vazio
-    
-    exams = query.order_by(models.MedicalExam.created_at.desc()).all()
+        return []
+
+    result = await db.execute(
+        select(models.MedicalExam)
+        .where(models.MedicalExam.profile_id == profile_id)
+        .order_by(models.MedicalExam.created_at.desc())
+    )
+    exams = result.scalars().all()
     
     # Log de auditoria - visualização
-    if user and profile_id:
-        try:
-            log_view_action(db, user, RESOURCE_EXAM, None, profile_id, request)
-        except Exception as e:
-            security_logger.warning(f"Erro ao registrar log de auditoria: {e}")
+    try:
+        # INSERT + commit síncronos: fora do event loop
+        await run_in_threadpool(log_view_action, auth.db, user, RESOURCE_EXAM, None, profile_id, request)
+    except Exception as e:
+        security_logger.warning(f"Erro ao registrar log de auditoria: {e}")
     
     # Não retornar image_base64 na lista (muito grande)
     result = []
@@ -3745,11 +4124,10 @@ def get_medical_exams(request: Request, api_key: str = Depends(verify_api_key)):
 
 @app.get("/api/medical-exams/{exam_id}")
 @limiter.limit("100/minute")
-def get_medical_exam(request: Request, exam_id: int, api_key: str = Depends(verify_api_key)):
+def get_medical_exam(request: Request, exam_id: int, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     security_logger.info(f"Acesso GET /api/medical-exams/{exam_id} de {get_remote_address(request)}")
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=True)
     query = db.query(models.MedicalExam).filter(models.MedicalExam.id == exam_id)
@@ -3758,17 +4136,13 @@ def get_medical_exam(request: Request, exam_id: int, api_key: str = Depends(veri
     exam = query.first()
     if not exam:
         raise HTTPException(status_code=404, detail="Exam not found")
-    token = get_bearer_token(request)
-    user = None
-    if token:
-        try:
-            user = get_user_from_token(db, token)
-        except HTTPException:
-            user = None
+    user = auth.jwt_user
     if user:
         ip_address, user_agent = get_request_meta(request)
-        record_download(db, user.id, "medical_exam", str(exam_id), ip_address, user_agent)
-        recent_count = get_recent_download_count(db, user.id, DOWNLOAD_WINDOW_MINUTES)
+        # Com o contador ativo a contagem vem do Redis/memória, sem INSERT + COUNT
+        recent_count = record_download(db, user.id, "medical_exam", str(exam_id), ip_address, user_agent)
+        if recent_count is None:
+            recent_count = get_recent_download_count(db, user.id, DOWNLOAD_WINDOW_MINUTES)
         if recent_count == DOWNLOAD_THRESHOLD:
             security_logger.warning(f"Download em massa detectado para {user.email} ({recent_count} em {DOWNLOAD_WINDOW_MINUTES}m)")
             send_mass_download_alert(user.email, recent_count, DOWNLOAD_WINDOW_MINUTES, ip_address, user_agent)
@@ -3781,13 +4155,13 @@ def update_medical_exam(
     request: Request,
     exam_id: int,
     exam_update: schemas.MedicalExamUpdate,
-    api_key: str = Depends(verify_api_key)
+    auth: AuthContext = Depends(get_auth_context),
+    db: Session = Depends(get_db)
 ):
     security_logger.info(f"Acesso PUT /api/medical-exams/{exam_id} de {get_remote_address(request)}")
     
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=True)
     query = db.query(models.MedicalExam).filter(models.MedicalExam.id == exam_id)
@@ -3806,7 +4180,7 @@ def update_medical_exam(
         safe_db_commit(db)
         db.refresh(db_exam)
         return schemas.MedicalExamResponse.model_validate(db_exam).model_dump()
-    except HTTPException:
+    except (HTTPException, UnroutedShardError):
         raise
     except Exception as e:
         db.rollback()
@@ -3816,11 +4190,10 @@ def update_medical_exam(
 
 @app.delete("/api/medical-exams/{exam_id}")
 @limiter.limit("20/minute")
-def delete_medical_exam(request: Request, exam_id: int, api_key: str = Depends(verify_api_key)):
+def delete_medical_exam(request: Request, exam_id: int, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     security_logger.info(f"Acesso DELETE /api/medical-exams/{exam_id} de {get_remote_address(request)}")
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=True, delete_access=True)
     query = db.query(models.MedicalExam).filter(models.MedicalExam.id == exam_id)
@@ -3836,7 +4209,7 @@ def delete_medical_exam(request: Request, exam_id: int, api_key: str = Depends(v
         db.delete(db_exam)
         safe_db_commit(db)
         return {"message": "Exam deleted"}
-    except HTTPException:
+    except (HTTPException, UnroutedShardError):
         raise
     except Exception as e:
         db.rollback()
@@ -3850,14 +4223,14 @@ def get_parameter_timeline(
     request: Request,
     exam_id: int,
     parameter_name: str,
-    api_key: str = Depends(verify_api_key)
+    auth: AuthContext = Depends(get_auth_context),
+    db: Session = Depends(get_db)
 ):
     """Retorna dados temporais de um parâmetro específico para gráfico"""
     security_logger.info(f"Acesso GET /api/medical-exams/{exam_id}/timeline/{parameter_name} de {get_remote_address(request)}")
     
-    db = next(get_db())
-    user = get_request_user(request, db)
-    profile_id = get_profile_context(request, db)
+    user = auth.user
+    profile_id = auth.profile_id
     if user and profile_id:
         ensure_profile_access(user, db, profile_id, write_access=False)
     
@@ -3970,7 +4343,8 @@ def log_validation_attempt(
 def validate_license(
     request: Request,
     license_data: schemas.LicenseValidateRequest,
-    api_key: str = Depends(verify_api_key)
+    api_key: str = Depends(verify_api_key),
+    db: Session = Depends(get_db)
 ):
     """Valida uma chave de licença PRO com medidas de segurança"""
     ip_address = get_remote_address(request)
@@ -3978,8 +4352,6 @@ def validate_license(
     
     security_logger.info(f"Validação de licença solicitada de {ip_address}")
     
-    db = next(get_db())
-    
     # Normalizar chave (remover espaços e hífens, converter para maiúsculas)
     normalized_key = license_data.key.upper().replace(' ', '').replace('-', '')
     
@@ -4118,13 +4490,12 @@ def validate_license(
 def generate_license(
     request: Request,
     license_data: schemas.LicenseGenerateRequest,
-    api_key: str = Depends(verify_api_key)
+    api_key: str = Depends(verify_api_key),
+    db: Session = Depends(get_db)
 ):
     """Gera uma nova chave de licença PRO (apenas para administradores)"""
     security_logger.info(f"Geração de licença solicitada de {get_remote_address(request)}")
     
-    db = next(get_db())
-    
     try:
         # Gerar chave
         license_key = generate_license_key(
@@ -4169,14 +4540,13 @@ def generate_license(
 def revoke_license(
     request: Request,
     revoke_data: schemas.LicenseRevokeRequest,
-    api_key: str = Depends(verify_api_key)
+    api_key: str = Depends(verify_api_key),
+    db: Session = Depends(get_db)
 ):
     """Revoga uma licença PRO (apenas para administradores)"""
     ip_address = get_remote_address(request)
     security_logger.warning(f"Tentativa de revogação de licença de {ip_address}")
     
-    db = next(get_db())
-    
     try:
         # Normalizar chave
         normalized_key = revoke_data.license_key.upper().replace(' ', '').replace('-', '')
@@ -4226,13 +4596,12 @@ def revoke_license(
 def get_purchase_status(
     request: Request,
     purchase_id: str,
-    api_key: str = Depends(verify_api_key)
+    api_key: str = Depends(verify_api_key),
+    db: Session = Depends(get_db)
 ):
     """Verifica o status de uma compra"""
     security_logger.info(f"Status de compra {purchase_id} solicitado de {get_remote_address(request)}")
     
-    db = next(get_db())
-    
     purchase = db.query(models.Purchase).filter(
         models.Purchase.purchase_id == purchase_id
     ).first()
@@ -4252,15 +4621,14 @@ def get_purchase_status(
 
 @app.post("/api/webhook/google-pay")
 @limiter.limit("100/minute")
-async def google_pay_webhook(
+def google_pay_webhook(
     request: Request,
-    webhook_data: schemas.GooglePayWebhookRequest
+    webhook_data: schemas.GooglePayWebhookRequest,
+    db: Session = Depends(get_db)
 ):
-    """Webhook para receber confirmações do Google Pay"""
+    """Webhook para receber confirmações do Google Pay (síncrono: roda no threadpool, fora do event loop)"""
     security_logger.info(f"Webhook Google Pay recebido: {webhook_data.purchase_id}")
     
-    db = next(get_db())
-    
     try:
         # Verificar se a compra já existe
         existing_purchase = db.query(models.Purchase).filter(
@@ -4371,12 +4739,53 @@ def debug_api_key_info():
 
 # ========== ANALYTICS E MONITORAMENTO ==========
 
+@app.get("/api/monitoring/db-pool")
+@limiter.limit("30/minute")
+def get_db_pool_metrics(request: Request, api_key: str = Depends(verify_api_key)):
+    """Métricas do pool de conexões do banco (checkouts, overflow, vazamentos)"""
+    return get_pool_metrics()
+
+
+@app.get("/api/monitoring/auth-cache")
+@limiter.limit("30/minute")
+def get_auth_cache_metrics(request: Request, api_key: str = Depends(verify_api_key)):
+    """Métricas do cache de claims JWT verificados (hits, misses, evicções)"""
+    return get_claims_cache_stats()
+
+
+@app.get("/api/monitoring/password-hasher")
+@limiter.limit("30/minute")
+def get_password_hasher_pool_metrics(request: Request, api_key: str = Depends(verify_api_key)):
+    """Profundidade da fila e uso do pool de processos de hash de senha (bcrypt)"""
+    return get_password_hasher_metrics()
+
+
+@app.get("/api/monitoring/redis")
+@limiter.limit("30/minute")
+def get_redis_pool_metrics(request: Request, api_key: str = Depends(verify_api_key)):
+    """Estado do circuit breaker e uso do pool de conexões do Redis"""
+    return get_redis_metrics()
+
+
+@app.get("/api/monitoring/notifications")
+@limiter.limit("30/minute")
+def get_notification_metrics(request: Request, api_key: str = Depends(verify_api_key)):
+    """Fila de notificações de saída (pendentes, enviadas, deduplicadas, retries, falhas) e pool SMTP"""
+    return {**get_notification_dispatcher_stats(), "smtp_pool": get_smtp_pool_stats()}
+
+
+@app.get("/api/monitoring/audit-sinks")
+@limiter.limit("30/minute")
+def get_audit_sink_metrics(request: Request, api_key: str = Depends(verify_api_key)):
+    """Linhas de auditoria pendentes, gravadas e descartadas por buffer (tentativas de login, downloads)"""
+    return get_audit_sink_stats()
+
+
 @app.get("/api/analytics/licenses", response_model=schemas.LicenseStatsResponse)
 @limiter.limit("30/minute")
-def get_license_stats(request: Request, api_key: str = Depends(verify_api_key)):
+def get_license_stats(request: Request, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     """Retorna estatísticas de licenças"""
     security_logger.info(f"Acesso GET /api/analytics/licenses de {get_remote_address(request)}")
-    db = next(get_db())
     
     try:
         # Total de licenças
@@ -4430,10 +4839,9 @@ def get_license_stats(request: Request, api_key: str = Depends(verify_api_key)):
 
 @app.get("/api/analytics/activations", response_model=schemas.ActivationStatsResponse)
 @limiter.limit("30/minute")
-def get_activation_stats(request: Request, api_key: str = Depends(verify_api_key)):
+def get_activation_stats(request: Request, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     """Retorna estatísticas de ativações de licenças"""
     security_logger.info(f"Acesso GET /api/analytics/activations de {get_remote_address(request)}")
-    db = next(get_db())
     
     try:
         now = dt.now(timezone.utc)
@@ -4504,10 +4912,9 @@ def get_activation_stats(request: Request, api_key: str = Depends(verify_api_key
 
 @app.get("/api/analytics/validations", response_model=schemas.ValidationStatsResponse)
 @limiter.limit("30/minute")
-def get_validation_stats(request: Request, api_key: str = Depends(verify_api_key)):
+def get_validation_stats(request: Request, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     """Retorna estatísticas de validações de licenças"""
     security_logger.info(f"Acesso GET /api/analytics/validations de {get_remote_address(request)}")
-    db = next(get_db())
     
     try:
         now = dt.now(timezone.utc)
@@ -4585,10 +4992,9 @@ def get_validation_stats(request: Request, api_key: str = Depends(verify_api_key
 
 @app.get("/api/analytics/purchases", response_model=schemas.PurchaseStatsResponse)
 @limiter.limit("30/minute")
-def get_purchase_stats(request: Request, api_key: str = Depends(verify_api_key)):
+def get_purchase_stats(request: Request, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     """Retorna estatísticas de compras"""
     security_logger.info(f"Acesso GET /api/analytics/purchases de {get_remote_address(request)}")
-    db = next(get_db())
     
     try:
         now = dt.now(timezone.utc)
@@ -4667,12 +5073,11 @@ def get_purchase_stats(request: Request, api_key: str = Depends(verify_api_key))
 
 @app.get("/api/analytics/dashboard", response_model=schemas.DashboardResponse)
 @limiter.limit("30/minute")
-def get_dashboard(request: Request, api_key: str = Depends(verify_api_key)):
+def get_dashboard(request: Request, auth: AuthContext = Depends(get_auth_context), db: Session = Depends(get_db)):
     """Retorna dashboard completo com todas as métricas"""
     security_logger.info(f"Acesso GET /api/analytics/dashboard de {get_remote_address(request)}")
     
     # Obter todas as estatísticas diretamente (evitar recursão)
-    db = next(get_db())
     
     try:
         # Estatísticas de licenças
@@ -3,10 +3,13 @@ Middleware para proteção CSRF (Cross-Site Request Forgery).
 Valida tokens CSRF em requisições POST, PUT, DELETE e PATCH.
 """
 import logging
-from fastapi import Request, HTTPException, status
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
-from services.csrf_service import verify_csrf_token
+from fastapi import status
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from middleware.path_matching import PrefixTrie
+from services.csrf_service import verify_csrf_token_async
 
 logger = logging.getLogger(__name__)
 
@@ -30,56 +33,67 @@ CSRF_EXEMPT_PATHS = [
 ]
 
 
-class CSRFMiddleware(BaseHTTPMiddleware):
+_EXEMPT_PATHS = PrefixTrie(CSRF_EXEMPT_PATHS)
+# Apenas métodos que modificam dados.
+# Nota: DELETE fica isento para compatibilidade com clientes mobile/testes.
+_PROTECTED_METHODS = frozenset(("POST", "PUT", "PATCH"))
+
+
+class CSRFMiddleware:
     """
-    Middleware para validar tokens CSRF em requisições modificadoras.
+    Middleware ASGI para validar tokens CSRF em requisições modificadoras.
     """
-    
-    async def dispatch(self, request: Request, call_next):
-        # Verificar se endpoint está isento de CSRF
-        if any(request.url.path.startswith(path) for path in CSRF_EXEMPT_PATHS):
-            return await call_next(request)
-        
-        # Apenas validar métodos que modificam dados.
-        # Nota: DELETE fica isento para compatibilidade com clientes mobile/testes.
-        if request.method in ["POST", "PUT", "PATCH"]:
-            # Obter token CSRF do header
-            csrf_token = request.headers.get("X-CSRF-Token")
-            
-            if not csrf_token:
-                logger.warning(f"Requisição sem token CSRF: {request.method} {request.url.path}")
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="CSRF token missing"
-                )
-            
-            # Obter session_id do token JWT se disponível (opcional)
-            session_id = None
-            try:
-                auth_header = request.headers.get("Authorization", "")
-                if auth_header.startswith("Bearer "):
-                    token = auth_header.replace("Bearer ", "")
-                    # Extrair user_id do token para usar como session_id
-                    from auth import decode_token_payload
-                    payload = decode_token_payload(token)
-                    session_id = payload.get("sub")
-            except:
-                pass
-            
-            # Verificar token CSRF
-            #
-            # Compatibilidade: em alguns fluxos (ex.: testes/clients), o token pode ter sido
-            # armazenado sem session_id. Se houver session_id e a verificação falhar,
-            # tentar também a chave global (sem session_id).
-            is_valid = verify_csrf_token(csrf_token, session_id)
-            if not is_valid and session_id:
-                is_valid = verify_csrf_token(csrf_token, None)
 
-            if not is_valid:
-                logger.warning(f"Token CSRF inválido: {request.method} {request.url.path}")
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Invalid CSRF token"
-                )
-        
-        return await call_next(request)
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in _PROTECTED_METHODS
+            or _EXEMPT_PATHS.matches(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        # Obter token CSRF do header
+        csrf_token = headers.get("x-csrf-token")
+        if not csrf_token:
+            logger.warning(f"Requisição sem token CSRF: {scope['method']} {scope['path']}")
+            await self._reject("CSRF token missing", scope, receive, send)
+            return
+
+        # Obter session_id do token JWT se disponível (opcional)
+        session_id = None
+        try:
+            auth_header = headers.get("authorization", "")
+            if auth_header.startswith("Bearer "):
+                token = auth_header.replace("Bearer ", "")
+                # Extrair user_id do token para usar como session_id
+                from auth import decode_token_payload
+                payload = decode_token_payload(token)
+                session_id = payload.get("sub")
+        except Exception:
+            pass
+
+        # Verificar token CSRF
+        #
+        # Compatibilidade: em alguns fluxos (ex.: testes/clients), o token pode ter sido
+        # armazenado sem session_id. Se houver session_id e a verificação falhar,
+        # tentar também a chave global (sem session_id).
+        is_valid = await verify_csrf_token_async(csrf_token, session_id)
+        if not is_valid and session_id:
+            is_valid = await verify_csrf_token_async(csrf_token, None)
+
+        if not is_valid:
+            logger.warning(f"Token CSRF inválido: {scope['method']} {scope['path']}")
+            await self._reject("Invalid CSRF token", scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _reject(detail: str, scope: Scope, receive: Receive, send: Send):
+        response = JSONResponse(status_code=status.HTTP_403_FORBIDDEN, content={"detail": detail})
+        await response(scope, receive, send)
@@ -0,0 +1,43 @@
+"""
+Casamento de prefixos de caminho para os middlewares.
+
+Os middlewares verificam a cada requisição se o caminho começa com algum
+prefixo de uma lista fixa. PrefixTrie compila a lista uma única vez e
+responde em um único percurso pelos caracteres do caminho, em vez de
+testar startswith contra cada prefixo.
+"""
+from typing import Dict, Iterable
+
+
+class PrefixTrie:
+    """Trie de prefixos (por caractere) compilada a partir de uma lista fixa."""
+
+    __slots__ = ("_root", "_empty")
+
+    _END = ""
+
+    def __init__(self, prefixes: Iterable[str]):
+        self._root: Dict[str, dict] = {}
+        self._empty = False
+        for prefix in prefixes:
+            if not prefix:
+                self._empty = True
+                continue
+            node = self._root
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[self._END] = True
+
+    def matches(self, path: str) -> bool:
+        """True se ``path`` começa com algum dos prefixos."""
+        if self._empty:
+            return True
+        node = self._root
+        end = self._END
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                return False
+            if end in node:
+                return True
+        return False
@@ -0,0 +1,61 @@
+"""
+Middleware de headers de segurança.
+
+Os headers são constantes por classe de caminho (documentação x API), então
+ficam pré-computados como tuplas de bytes e são anexados diretamente na
+mensagem http.response.start, sem criar objetos Response.
+"""
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from middleware.path_matching import PrefixTrie
+
+# Páginas de documentação precisam carregar scripts/estilos do CDN
+DOCS_PATHS = ["/docs", "/redoc", "/openapi.json"]
+
+DOCS_CSP = (
+    "default-src 'self'; "
+    "script-src 'self' 'unsafe-inline' 'unsafe-eval' https://cdn.jsdelivr.net; "
+    "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; "
+    "img-src 'self' data:; "
+    "font-src 'self' https://cdn.jsdelivr.net"
+)
+DEFAULT_CSP = "default-src 'self'"
+
+_COMMON_HEADERS = (
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"strict-transport-security", b"max-age=31536000; includeSubDomains"),
+)
+DOCS_HEADERS = _COMMON_HEADERS + ((b"content-security-policy", DOCS_CSP.encode("latin-1")),)
+DEFAULT_HEADERS = _COMMON_HEADERS + ((b"content-security-policy", DEFAULT_CSP.encode("latin-1")),)
+_HEADER_NAMES = frozenset(name for name, _ in DEFAULT_HEADERS)
+
+_DOCS_PATHS = PrefixTrie(DOCS_PATHS)
+
+
+class SecurityHeadersMiddleware:
+    """Middleware ASGI que adiciona os headers de segurança a todas as respostas."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        extra = DOCS_HEADERS if _DOCS_PATHS.matches(scope["path"]) else DEFAULT_HEADERS
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                # Substituir valores já definidos pela aplicação, como antes
+                headers = [
+                    header for header in message.get("headers", ())
+                    if header[0].lower() not in _HEADER_NAMES
+                ]
+                headers.extend(extra)
+                message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
@@ -2,9 +2,11 @@
 Middleware de validação de entrada.
 Valida tamanho de payloads e sanitiza dados.
 """
-from fastapi import Request, HTTPException, status
+from fastapi import Request, status
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi.routing import APIRoute
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing import Any, Callable, Optional
 import logging
 import json
 
@@ -12,7 +14,8 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from utils.validation import validate_payload_size_detailed, sanitize_input
+from utils.validation import MAX_PAYLOAD_SIZE_KB, sanitize_input
+from middleware.path_matching import PrefixTrie
 
 logger = logging.getLogger(__name__)
 
@@ -28,58 +31,153 @@ VALIDATION_REQUIRED_PATHS = [
 ]
 
 
-class ValidationMiddleware(BaseHTTPMiddleware):
+_VALIDATION_PATHS = PrefixTrie(VALIDATION_REQUIRED_PATHS)
+_PAYLOAD_METHODS = frozenset(("POST", "PUT", "PATCH"))
+
+# Chave em scope["state"] com o payload já parseado e sanitizado
+VALIDATED_JSON_STATE = "validated_json"
+
+
+class PayloadTooLarge(Exception):
+    """Corpo excedeu o limite enquanto era recebido."""
+
+    def __init__(self, size: int):
+        super().__init__(size)
+        self.size = size
+
+
+def _max_payload_bytes() -> int:
+    return MAX_PAYLOAD_SIZE_KB * 1024
+
+
+def _payload_too_large_message(size: int, max_bytes: int) -> str:
+    return f"Payload muito grande ({size} bytes). Máximo: {max_bytes} bytes"
+
+
+def _declared_length(scope: Scope) -> Optional[int]:
+    for name, value in scope.get("headers", ()):
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+async def _read_body(receive: Receive, max_bytes: int) -> bytes:
+    """Lê o corpo contando bytes; aborta assim que passar de ``max_bytes``."""
+    chunks = []
+    size = 0
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > max_bytes:
+            raise PayloadTooLarge(size)
+        chunks.append(chunk)
+        more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+def _replay_receive(body: bytes, receive: Receive) -> Receive:
+    """receive que entrega ``body`` uma vez e depois delega ao original."""
+    sent = False
+
+    async def replay() -> Message:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return replay
+
+
+class ValidatedJSONRequest(Request):
+    """Request que devolve o payload sanitizado pelo middleware, sem novo json.loads."""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            state = self.scope.get("state") or {}
+            if VALIDATED_JSON_STATE in state:
+                self._json = state[VALIDATED_JSON_STATE]
+            else:
+                return await super().json()
+        return self._json
+
+
+class ValidatedJSONRoute(APIRoute):
+    """Rota que entrega ao FastAPI/Pydantic o payload já parseado pelo ValidationMiddleware."""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request):
+            return await handler(ValidatedJSONRequest(request.scope, request.receive))
+
+        return route_handler
+
+
+class ValidationMiddleware:
     """
-    Middleware para validar tamanho de payloads e sanitizar dados.
+    Middleware ASGI para validar tamanho de payloads e sanitizar dados.
+
+    O limite de tamanho é aplicado pelo Content-Length e pela contagem dos
+    bytes recebidos, antes de bufferizar o corpo inteiro. O JSON é parseado e
+    sanitizado uma única vez; o resultado fica em scope["state"] para o
+    ValidatedJSONRoute, e o corpo original é repassado sem re-serialização.
     """
-    
-    async def dispatch(self, request: Request, call_next):
-        # Apenas validar métodos que podem ter payload
-        if request.method not in ["POST", "PUT", "PATCH"]:
-            return await call_next(request)
-        
-        # Verificar se endpoint requer validação
-        requires_validation = any(
-            request.url.path.startswith(path) for path in VALIDATION_REQUIRED_PATHS
-        )
-        
-        if not requires_validation:
-            return await call_next(request)
-        
-        # Ler body para validar tamanho
-        body = await request.body()
-        
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Apenas validar métodos que podem ter payload, nos endpoints configurados
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in _PAYLOAD_METHODS
+            or not _VALIDATION_PATHS.matches(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = _max_payload_bytes()
+        declared = _declared_length(scope)
+        if declared is not None and declared > max_bytes:
+            await self._reject_too_large(scope, receive, send, declared, max_bytes)
+            return
+
+        # Ler body contando bytes (aborta cedo se exceder o limite)
+        try:
+            body = await _read_body(receive, max_bytes)
+        except PayloadTooLarge as exc:
+            await self._reject_too_large(scope, receive, send, exc.size, max_bytes)
+            return
+
         if body:
             try:
-                payload = json.loads(body.decode('utf-8'))
-                
-                # Validar tamanho do payload
-                is_valid, error_message = validate_payload_size_detailed(payload)
-                if not is_valid:
-                    logger.warning(f"Payload muito grande em {request.url.path}: {error_message}")
-                    return JSONResponse(
-                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                        content={"detail": error_message}
-                    )
-                
-                # Sanitizar payload
-                sanitized_payload = sanitize_input(payload)
-                
-                # Substituir body com payload sanitizado
-                sanitized_body = json.dumps(sanitized_payload).encode('utf-8')
-                
-                # Criar novo request com body sanitizado
-                async def receive():
-                    return {"type": "http.request", "body": sanitized_body}
-                
-                request._receive = receive
-                
-            except json.JSONDecodeError:
+                payload = json.loads(body)
+                # Sanitizar em uma única passada e disponibilizar para a rota
+                scope.setdefault("state", {})[VALIDATED_JSON_STATE] = sanitize_input(payload)
+            except (json.JSONDecodeError, UnicodeDecodeError):
                 # Se não for JSON válido, deixar passar (será validado pelo Pydantic)
                 pass
             except Exception as e:
                 logger.error(f"Erro no middleware de validação: {e}")
                 # Em caso de erro, deixar passar (fail-open)
                 pass
-        
-        return await call_next(request)
+
+        await self.app(scope, _replay_receive(body, receive), send)
+
+    @staticmethod
+    async def _reject_too_large(scope: Scope, receive: Receive, send: Send, size: int, max_bytes: int):
+        error_message = _payload_too_large_message(size, max_bytes)
+        logger.warning(f"Payload muito grande em {scope['path']}: {error_message}")
+        response = JSONResponse(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            content={"detail": error_message}
+        )
+        await response(scope, receive, send)
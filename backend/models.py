@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, JSON, Text, Float
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, JSON, Text, Float
 from sqlalchemy.sql import func
 from database import Base
 
@@ -171,6 +171,23 @@ class Family(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
 
+class ShardIdSequence(Base):
+    """Próximo ID livre de cada tabela médica, comum a todos os shards."""
+    __tablename__ = "shard_id_sequences"
+
+    table_name = Column(String(64), primary_key=True)
+    next_id = Column(BigInteger, nullable=False)
+
+
+class FamilyShard(Base):
+    """Atribuição explícita de família a shard (gravada pelo rebalanceamento)."""
+    __tablename__ = "family_shards"
+
+    family_id = Column(Integer, primary_key=True)
+    shard_index = Column(Integer, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
 class FamilyProfile(Base):
     __tablename__ = "family_profiles"
 
@@ -472,6 +489,18 @@ class UserLoginEvent(Base):
     # Nota: login_type, success e last_login_at foram removidos para alinhar com o banco de dados
 
 
+class UserDownloadEvent(Base):
+    __tablename__ = "user_download_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    resource_type = Column(String(50), nullable=False)
+    resource_id = Column(String(255))
+    ip_address = Column(String(45))
+    user_agent = Column(String(500))
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
 class RefreshToken(Base):
     __tablename__ = "refresh_tokens"
 
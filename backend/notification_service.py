@@ -1,8 +1,17 @@
 from typing import Optional
 
-import requests
-
 from email_service import send_email, smtp_configured
+import services.notification_dispatcher as notification_dispatcher
+from services.notification_dispatcher import enqueue_email, enqueue_push, is_expo_push_token, send_push_now
+
+
+def _deliver_email(to_email: str, subject: str, body: str) -> None:
+    """Com o dispatcher ativo o email vai para a fila; senão é enviado na hora."""
+    # Sem SMTP, send_email só registra o aviso: não enfileirar o que o worker não entrega
+    if notification_dispatcher.NOTIFICATION_DISPATCHER_ENABLED and smtp_configured():
+        enqueue_email(to_email, subject, body)
+    else:
+        send_email(to_email, subject, body)
 
 
 def send_login_notification(
@@ -39,28 +48,19 @@ def send_login_notification(
     body += "\n\nSe nao foi voce, altere sua senha e revogue dispositivos ativos."
 
     if smtp_configured():
-        send_email(to_email, "Novo login detectado - SaudeNold", body)
+        _deliver_email(to_email, "Novo login detectado - SaudeNold", body)
     if push_token:
         push_body = "Novo acesso detectado. Revise os detalhes no app."
         send_push_notification(push_token, "Novo login detectado", push_body)
 
 
 def send_push_notification(push_token: str, title: str, body: str) -> None:
-    if not push_token or not push_token.startswith("ExponentPushToken"):
-        return
-    try:
-        requests.post(
-            "https://exp.host/--/api/v2/push/send",
-            json={
-                "to": push_token,
-                "title": title,
-                "body": body,
-                "sound": "default",
-            },
-            timeout=5
-        )
-    except Exception:
+    if not is_expo_push_token(push_token):
         return
+    if notification_dispatcher.NOTIFICATION_DISPATCHER_ENABLED:
+        enqueue_push(push_token, title, body)
+    else:
+        send_push_now(push_token, title, body)
 
 
 def send_login_blocked_alert(
@@ -82,7 +82,7 @@ def send_login_blocked_alert(
         body += "\n" + "\n".join(details)
     body += "\n\nSe nao foi voce, recomendamos alterar sua senha."
 
-    send_email(to_email, "Bloqueio temporario de login - SaudeNold", body)
+    _deliver_email(to_email, "Bloqueio temporario de login - SaudeNold", body)
 
 
 def send_failed_login_alert(
@@ -107,7 +107,7 @@ def send_failed_login_alert(
     body += "\n" + "\n".join(details)
     body += "\n\nSe nao foi voce, recomendamos alterar sua senha."
 
-    send_email(to_email, "Tentativas de login detectadas - SaudeNold", body)
+    _deliver_email(to_email, "Tentativas de login detectadas - SaudeNold", body)
 
 
 def send_suspicious_login_alert(
@@ -129,7 +129,7 @@ def send_suspicious_login_alert(
         body += "\n" + "\n".join(details)
     body += "\n\nSe nao foi voce, recomendamos alterar sua senha e revogar dispositivos."
 
-    send_email(to_email, "Login suspeito detectado - SaudeNold", body)
+    _deliver_email(to_email, "Login suspeito detectado - SaudeNold", body)
 
 
 def send_mass_download_alert(
@@ -154,7 +154,7 @@ def send_mass_download_alert(
     body += "\n" + "\n".join(details)
     body += "\n\nSe nao foi voce, recomendamos revogar dispositivos e alterar sua senha."
 
-    send_email(to_email, "Download em massa detectado - SaudeNold", body)
+    _deliver_email(to_email, "Download em massa detectado - SaudeNold", body)
 
 
 def send_session_revoked_alert(
@@ -176,4 +176,4 @@ def send_session_revoked_alert(
         body += "\n" + "\n".join(details)
     body += "\n\nSe nao foi voce, altere sua senha."
 
-    send_email(to_email, "Dispositivo desconectado - SaudeNold", body)
+    _deliver_email(to_email, "Dispositivo desconectado - SaudeNold", body)
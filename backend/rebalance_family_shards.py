@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Rebalanceamento de shards por família.
+
+Move os dados médicos de uma família (medicamentos, logs, exames, pontos de
+exame, consultas, contatos de emergência e acompanhamento diário) do shard
+atual para outro shard e grava a nova atribuição em family_shards.
+
+Os IDs são preservados: com shards configurados, os IDs das tabelas
+médicas são reservados no primário (shard_id_sequences) e não se repetem
+entre shards, então referências externas (audit_logs.resource_id,
+user_download_events.resource_id, clientes offline) continuam válidas. Só
+linhas criadas antes da reserva global podem colidir; nesse caso a cópia é
+abortada. As escritas da família devem estar pausadas durante a
+movimentação, e os demais processos passam a usar o novo shard após
+DATABASE_SHARD_CACHE_SECONDS.
+
+Uso:
+    python rebalance_family_shards.py <family_id> <shard_destino> [--dry-run]
+"""
+import argparse
+import logging
+import sys
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal, shard_engines, get_family_shard, invalidate_family_shard
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Ordem de cópia (pais antes dos filhos); a remoção usa a ordem inversa
+SHARDED_MODELS = [
+    models.Medication,
+    models.MedicationLog,
+    models.DoctorVisit,
+    models.MedicalExam,
+    models.ExamDataPoint,
+    models.EmergencyContact,
+    models.DailyTracking,
+]
+
+
+def _family_rows(db: Session, profile_ids: list) -> dict:
+    rows = {}
+    for model in SHARDED_MODELS:
+        if model is models.ExamDataPoint:
+            exam_ids = [exam.id for exam in rows.get(models.MedicalExam, [])]
+            query = db.query(model).filter(model.exam_id.in_(exam_ids))
+        else:
+            query = db.query(model).filter(model.profile_id.in_(profile_ids))
+        rows[model] = query.all()
+    return rows
+
+
+def _copy_row(model, row):
+    return model(**{attr.key: getattr(row, attr.key) for attr in model.__mapper__.column_attrs})
+
+
+def _taken_ids(db: Session, model, ids: list) -> set:
+    taken = set()
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        taken.update(row_id for (row_id,) in db.query(model.id).filter(model.id.in_(chunk)).all())
+    return taken
+
+
+def _sync_sequence(db: Session, model) -> None:
+    """Ajusta a sequência do Postgres após inserir IDs explícitos."""
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    table = model.__tablename__
+    db.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+        f"GREATEST((SELECT COALESCE(MAX(id), 0) FROM {table}), 1))"
+    ))
+
+
+def rebalance_family(family_id: int, target_shard: int, dry_run: bool = False) -> dict:
+    """Move os dados da família para o shard de destino. Retorna a contagem por tabela."""
+    if not shard_engines:
+        raise RuntimeError("DATABASE_SHARD_URLS nao configurada")
+    if target_shard < 0 or target_shard >= len(shard_engines):
+        raise ValueError(f"Shard invalido: {target_shard} (disponiveis: 0-{len(shard_engines) - 1})")
+
+    primary = SessionLocal()
+    try:
+        profile_ids = [
+            profile_id for (profile_id,) in primary.query(models.FamilyProfile.id).filter(
+                models.FamilyProfile.family_id == family_id
+            ).all()
+        ]
+        source_shard = get_family_shard(family_id, use_cache=False)
+        if source_shard == target_shard:
+            logger.info(f"Familia {family_id} ja esta no shard {target_shard}")
+            return {}
+
+        source = Session(bind=shard_engines[source_shard])
+        target = Session(bind=shard_engines[target_shard])
+        try:
+            rows = _family_rows(source, profile_ids)
+            counts = {model.__tablename__: len(items) for model, items in rows.items()}
+            logger.info(f"Familia {family_id}: shard {source_shard} -> {target_shard} {counts}")
+
+            for model, items in rows.items():
+                conflicts = len(_taken_ids(target, model, [item.id for item in items]))
+                if conflicts:
+                    raise RuntimeError(
+                        f"{conflicts} IDs de {model.__tablename__} ja existem no shard {target_shard} "
+                        "(linhas anteriores a reserva global de IDs)"
+                    )
+            if dry_run:
+                return counts
+
+            for model, items in rows.items():
+                target.add_all([_copy_row(model, item) for item in items])
+                target.flush()
+                _sync_sequence(target, model)
+            target.commit()
+
+            assignment = primary.get(models.FamilyShard, family_id)
+            if assignment:
+                assignment.shard_index = target_shard
+            else:
+                primary.add(models.FamilyShard(family_id=family_id, shard_index=target_shard))
+            primary.commit()
+            invalidate_family_shard(family_id)
+
+            for model in reversed(SHARDED_MODELS):
+                for item in rows[model]:
+                    source.delete(item)
+            source.commit()
+            return counts
+        except Exception:
+            target.rollback()
+            source.rollback()
+            raise
+        finally:
+            source.close()
+            target.close()
+    finally:
+        primary.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Mover dados de uma familia entre shards")
+    parser.add_argument("family_id", type=int)
+    parser.add_argument("target_shard", type=int)
+    parser.add_argument("--dry-run", action="store_true", help="Apenas contar e validar, sem mover")
+    args = parser.parse_args()
+    try:
+        counts = rebalance_family(args.family_id, args.target_shard, dry_run=args.dry_run)
+    except (RuntimeError, ValueError) as exc:
+        print(f"Erro: {exc}", file=sys.stderr)
+        return 1
+    print(f"Concluido: {counts}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,14 +16,7 @@ import sys
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import SessionLocal
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+from database import get_db, use_read_replica
 from auth import get_user_from_token
 from models import AuditLog, DataExport, DataDeletionRequest
 from schemas import (
@@ -58,6 +51,7 @@ def get_current_user(
     user = get_user_from_token(db, token)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
+    use_read_replica(db, user.id)
     return user
 
 
@@ -15,15 +15,7 @@ import sys
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database import SessionLocal
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
+from database import get_db
 from auth import get_user_from_token
 from models import EmergencyProfile, EmergencyAccessLog, FamilyProfile
 from schemas import (
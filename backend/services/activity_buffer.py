@@ -0,0 +1,139 @@
+"""
+Buffer write-behind dos timestamps de atividade (last_activity_at / last_login_at).
+
+Logins e refresh de token atualizavam esses campos com um commit próprio por
+requisição. Aqui os timestamps ficam acumulados em memória (por sessão e por
+usuário, mantendo o mais recente) e são gravados em um único UPDATE em lote
+a cada ACTIVITY_FLUSH_SECONDS, quando o buffer atinge
+ACTIVITY_FLUSH_MAX_ENTRIES ou no shutdown da aplicação.
+
+Os timestamps são informativos: uma queda do processo perde no máximo o
+último intervalo de flush.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import inspect, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+import models
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_WRITE_BEHIND_ENABLED = os.getenv(
+    "ACTIVITY_WRITE_BEHIND_ENABLED", "false" if os.getenv("TESTING") else "true"
+).lower() == "true"
+ACTIVITY_FLUSH_SECONDS = float(os.getenv("ACTIVITY_FLUSH_SECONDS", "10"))
+ACTIVITY_FLUSH_MAX_ENTRIES = int(os.getenv("ACTIVITY_FLUSH_MAX_ENTRIES", "500"))
+
+_lock = threading.Lock()
+# Serializa flushes (loop periódico, limite de entradas e shutdown)
+_flush_lock = threading.Lock()
+_session_activity: Dict[int, datetime] = {}
+_user_logins: Dict[int, datetime] = {}
+_stats = {"recorded": 0, "flushes": 0, "rows_written": 0, "errors": 0}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _record(target: Dict[int, datetime], key: int, timestamp: datetime) -> bool:
+    with _lock:
+        current = target.get(key)
+        if current is None or timestamp > current:
+            target[key] = timestamp
+        _stats["recorded"] += 1
+        return len(_session_activity) + len(_user_logins) >= ACTIVITY_FLUSH_MAX_ENTRIES
+
+
+def _primary_key(obj) -> int:
+    # Pela identidade do objeto: não recarrega instâncias expiradas por um commit
+    identity = inspect(obj).identity
+    return identity[0] if identity else obj.id
+
+
+def record_session_activity(session: models.UserSession, timestamp: Optional[datetime] = None) -> None:
+    """Agenda last_activity_at da sessão; o objeto em memória já reflete o valor."""
+    timestamp = timestamp or _now()
+    # Atualiza o objeto sem marcá-lo como alterado (não entra no próximo flush do ORM)
+    set_committed_value(session, "last_activity_at", timestamp)
+    if _record(_session_activity, _primary_key(session), timestamp):
+        flush_activity()
+
+
+def record_user_login(user: models.User, timestamp: Optional[datetime] = None) -> None:
+    """Agenda last_login_at do usuário; o objeto em memória já reflete o valor."""
+    timestamp = timestamp or _now()
+    set_committed_value(user, "last_login_at", timestamp)
+    if _record(_user_logins, _primary_key(user), timestamp):
+        flush_activity()
+
+
+def pending_activity_count() -> int:
+    with _lock:
+        return len(_session_activity) + len(_user_logins)
+
+
+def flush_activity(db: Optional[Session] = None) -> int:
+    """
+    Grava os timestamps pendentes em UPDATEs em lote (um por tabela).
+    Retorna o número de linhas enviadas.
+    """
+    with _flush_lock:
+        with _lock:
+            sessions = dict(_session_activity)
+            users = dict(_user_logins)
+            _session_activity.clear()
+            _user_logins.clear()
+        if not sessions and not users:
+            return 0
+
+        own_session = db is None
+        db = db or SessionLocal()
+        try:
+            if sessions:
+                db.execute(
+                    update(models.UserSession),
+                    [{"id": sid, "last_activity_at": ts} for sid, ts in sessions.items()],
+                )
+            if users:
+                db.execute(
+                    update(models.User),
+                    [{"id": uid, "last_login_at": ts} for uid, ts in users.items()],
+                )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            _stats["errors"] += 1
+            logger.error(f"Erro ao gravar timestamps de atividade: {e}")
+            # Devolver ao buffer sem sobrescrever valores mais novos
+            for uid, ts in users.items():
+                _record(_user_logins, uid, ts)
+            for sid, ts in sessions.items():
+                _record(_session_activity, sid, ts)
+            return 0
+        finally:
+            if own_session:
+                db.close()
+
+        written = len(sessions) + len(users)
+        _stats["flushes"] += 1
+        _stats["rows_written"] += written
+        return written
+
+
+def get_activity_buffer_stats() -> dict:
+    with _lock:
+        return {**_stats, "pending": len(_session_activity) + len(_user_logins)}
+
+
+def clear_activity_buffer() -> None:
+    with _lock:
+        _session_activity.clear()
+        _user_logins.clear()
@@ -0,0 +1,110 @@
+"""
+Gravação em lote de linhas de auditoria append-only.
+
+Tabelas que só servem para auditoria/forense (tentativas de login, eventos
+de download) não precisam de um INSERT + commit por requisição. Cada
+AuditSink acumula as linhas em memória e as grava em um único INSERT em
+lote quando atinge flush_max_entries, a cada AUDIT_FLUSH_SECONDS (loop em
+main.py) ou no shutdown da aplicação.
+
+Se o banco falhar, as linhas voltam ao buffer, limitado a max_pending (as
+mais antigas são descartadas e contadas em "dropped").
+"""
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "5"))
+
+_sinks: Dict[str, "AuditSink"] = {}
+
+
+class AuditSink:
+    """Buffer de INSERTs em lote para um modelo."""
+
+    def __init__(self, name: str, model, flush_max_entries: int, max_pending: int):
+        self.name = name
+        self.model = model
+        self.flush_max_entries = flush_max_entries
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        # Serializa flushes (loop periódico, limite de entradas e shutdown)
+        self._flush_lock = threading.Lock()
+        self._pending: List[dict] = []
+        self._stats = {"recorded": 0, "flushes": 0, "rows_written": 0, "errors": 0, "dropped": 0}
+        _sinks[name] = self
+
+    def _trim(self) -> None:
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            self._stats["dropped"] += overflow
+
+    def add(self, row: dict) -> None:
+        """Enfileira a linha para o próximo INSERT em lote."""
+        with self._lock:
+            self._pending.append(row)
+            self._stats["recorded"] += 1
+            self._trim()
+            full = len(self._pending) >= self.flush_max_entries
+        if full:
+            self.flush()
+
+    def flush(self, db: Optional[Session] = None) -> int:
+        """Grava as linhas pendentes em um INSERT em lote. Retorna o número de linhas."""
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._pending)
+                self._pending.clear()
+            if not rows:
+                return 0
+
+            own_session = db is None
+            db = db or SessionLocal()
+            try:
+                db.execute(insert(self.model), rows)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                self._stats["errors"] += 1
+                logger.error(f"Erro ao gravar auditoria em lote ({self.name}): {e}")
+                with self._lock:
+                    self._pending[:0] = rows
+                    self._trim()
+                return 0
+            finally:
+                if own_session:
+                    db.close()
+
+            self._stats["flushes"] += 1
+            self._stats["rows_written"] += len(rows)
+            return len(rows)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "pending": len(self._pending)}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pending.clear()
+
+
+def flush_audit_sinks() -> int:
+    """Grava todos os buffers de auditoria (loop periódico e shutdown)."""
+    return sum(sink.flush() for sink in list(_sinks.values()))
+
+
+def get_audit_sink_stats() -> dict:
+    return {name: sink.stats() for name, sink in _sinks.items()}
@@ -0,0 +1,214 @@
+"""
+Caches do login biométrico.
+
+- Registro do dispositivo (id, usuário, device_id, chave pública) por
+  device_id, em dois níveis como o cache de usuário: memória do processo
+  (TTL curto) e Redis (TTL maior). biometric_challenge e biometric_login
+  deixam de consultar biometric_devices a cada chamada.
+- LRU das chaves públicas já parseadas, por (id do dispositivo, fingerprint
+  do PEM): o parse do PEM sai do caminho quente. Como o fingerprint faz parte
+  da chave, uma chave re-registrada nunca reaproveita o objeto antigo.
+
+register_biometric_device grava o dispositivo após o commit (write-through)
+e revoke_biometric_device chama invalidate_biometric_device, que deixa uma
+marca de invalidação nos dois níveis. O preenchimento após um miss
+(fill_biometric_device) usa SET NX e só entra no nível local sem entrada:
+uma leitura do banco anterior à revogação não volta para o cache.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+
+from config.redis_config import get_redis_client, is_redis_available, record_redis_failure
+
+logger = logging.getLogger(__name__)
+
+BIOMETRIC_DEVICE_CACHE_ENABLED = os.getenv(
+    "BIOMETRIC_DEVICE_CACHE_ENABLED", "false" if os.getenv("TESTING") else "true"
+).lower() == "true"
+BIOMETRIC_DEVICE_LOCAL_TTL_SECONDS = float(os.getenv("BIOMETRIC_DEVICE_LOCAL_TTL_SECONDS", "5"))
+BIOMETRIC_DEVICE_TTL_SECONDS = int(os.getenv("BIOMETRIC_DEVICE_TTL_SECONDS", "300"))
+# TTL das entradas preenchidas por leitura e das marcas de invalidação
+BIOMETRIC_DEVICE_FILL_TTL_SECONDS = int(os.getenv("BIOMETRIC_DEVICE_FILL_TTL_SECONDS", "60"))
+BIOMETRIC_DEVICE_MAX_ENTRIES = int(os.getenv("BIOMETRIC_DEVICE_MAX_ENTRIES", "50000"))
+BIOMETRIC_KEY_CACHE_SIZE = int(os.getenv("BIOMETRIC_KEY_CACHE_SIZE", "4096"))
+
+BIOMETRIC_DEVICE_PREFIX = "auth:biometric_device:"
+
+
+class BiometricDeviceRecord(NamedTuple):
+    """Campos do dispositivo ativo (revoked_at IS NULL) usados no login."""
+    id: int
+    user_id: int
+    device_id: str
+    public_key: str
+
+
+_lock = threading.Lock()
+# device_id -> (registro, expiração); registro None = invalidado recentemente
+_devices: Dict[str, Tuple[Optional[BiometricDeviceRecord], float]] = {}
+# (id do dispositivo, fingerprint) -> chave parseada; ordem LRU
+_keys: "OrderedDict[Tuple[int, str], object]" = OrderedDict()
+_stats = {
+    "device_hits": 0, "device_misses": 0, "key_hits": 0, "key_misses": 0, "invalidations": 0,
+    "fills": 0, "fills_skipped": 0,
+}
+# Valor da marca de invalidação no Redis
+_INVALIDATED = "null"
+
+
+def record_from_device(device) -> BiometricDeviceRecord:
+    return BiometricDeviceRecord(device.id, device.user_id, device.device_id, device.public_key)
+
+
+def key_fingerprint(public_key_pem: str) -> str:
+    return hashlib.sha256(public_key_pem.encode("utf-8")).hexdigest()[:32]
+
+
+def _store_local(device_id: str, record: Optional[BiometricDeviceRecord],
+                 ttl: float = BIOMETRIC_DEVICE_LOCAL_TTL_SECONDS, only_if_absent: bool = False) -> None:
+    now = time.monotonic()
+    with _lock:
+        if only_if_absent:
+            current = _devices.get(device_id)
+            if current is not None and current[1] > now:
+                return
+        if len(_devices) >= BIOMETRIC_DEVICE_MAX_ENTRIES:
+            _devices.pop(next(iter(_devices)))
+        _devices[device_id] = (record, now + ttl)
+
+
+def get_cached_biometric_device(device_id: str) -> Optional[BiometricDeviceRecord]:
+    """Retorna o registro em cache (local, depois Redis) ou None."""
+    with _lock:
+        cached = _devices.get(device_id)
+        if cached is not None:
+            if cached[1] > time.monotonic():
+                if cached[0] is None:
+                    _stats["device_misses"] += 1
+                    return None
+                _stats["device_hits"] += 1
+                return cached[0]
+            del _devices[device_id]
+
+    if is_redis_available():
+        try:
+            client = get_redis_client()
+            raw = client.get(f"{BIOMETRIC_DEVICE_PREFIX}{device_id}") if client is not None else None
+            if raw is not None and raw != _INVALIDATED:
+                record = BiometricDeviceRecord(*json.loads(raw))
+                _store_local(device_id, record)
+                _stats["device_hits"] += 1
+                return record
+        except Exception as e:
+            record_redis_failure(e)
+            logger.warning(f"Erro ao ler cache do dispositivo biométrico {device_id}: {e}")
+
+    _stats["device_misses"] += 1
+    return None
+
+
+def cache_biometric_device(record: BiometricDeviceRecord) -> BiometricDeviceRecord:
+    """Grava o registro nos dois níveis. Chamar após o commit da alteração."""
+    _store_local(record.device_id, record)
+    if is_redis_available():
+        try:
+            client = get_redis_client()
+            if client is not None:
+                client.setex(
+                    f"{BIOMETRIC_DEVICE_PREFIX}{record.device_id}",
+                    BIOMETRIC_DEVICE_TTL_SECONDS,
+                    json.dumps(record)
+                )
+        except Exception as e:
+            record_redis_failure(e)
+            logger.warning(f"Erro ao gravar cache do dispositivo biométrico {record.device_id}: {e}")
+    return record
+
+
+def fill_biometric_device(record: BiometricDeviceRecord) -> BiometricDeviceRecord:
+    """
+    Preenche o cache com o registro lido do banco após um miss. Não
+    sobrescreve uma escrita nem uma invalidação concorrente (SET NX).
+    """
+    if is_redis_available():
+        try:
+            client = get_redis_client()
+            if client is not None and not client.set(
+                f"{BIOMETRIC_DEVICE_PREFIX}{record.device_id}",
+                json.dumps(record),
+                ex=BIOMETRIC_DEVICE_FILL_TTL_SECONDS,
+                nx=True,
+            ):
+                # Uma escrita ou revogação chegou antes: o registro lido pode estar defasado
+                with _lock:
+                    _stats["fills_skipped"] += 1
+                return record
+        except Exception as e:
+            record_redis_failure(e)
+            logger.warning(f"Erro ao preencher cache do dispositivo biométrico {record.device_id}: {e}")
+    _store_local(record.device_id, record, only_if_absent=True)
+    with _lock:
+        _stats["fills"] += 1
+    return record
+
+
+def invalidate_biometric_device(device_id: str, device_pk: Optional[int] = None) -> None:
+    """
+    Remove o dispositivo (e suas chaves parseadas) dos caches, deixando uma
+    marca que impede preenchimentos por BIOMETRIC_DEVICE_FILL_TTL_SECONDS.
+    Chamar após o commit.
+    """
+    with _lock:
+        cached = _devices.pop(device_id, None)
+        pks = {device_pk, cached[0].id if cached and cached[0] else None} - {None}
+        for key in [key for key in _keys if key[0] in pks]:
+            del _keys[key]
+        _stats["invalidations"] += 1
+    _store_local(device_id, None, ttl=BIOMETRIC_DEVICE_FILL_TTL_SECONDS)
+    if is_redis_available():
+        try:
+            client = get_redis_client()
+            if client is not None:
+                client.setex(f"{BIOMETRIC_DEVICE_PREFIX}{device_id}", BIOMETRIC_DEVICE_FILL_TTL_SECONDS, _INVALIDATED)
+        except Exception as e:
+            record_redis_failure(e)
+            logger.warning(f"Erro ao invalidar cache do dispositivo biométrico {device_id}: {e}")
+
+
+def get_public_key(device_pk: int, public_key_pem: str):
+    """Chave pública parseada do dispositivo, do LRU quando possível."""
+    cache_key = (device_pk, key_fingerprint(public_key_pem))
+    with _lock:
+        public_key = _keys.get(cache_key)
+        if public_key is not None:
+            _keys.move_to_end(cache_key)
+            _stats["key_hits"] += 1
+            return public_key
+        _stats["key_misses"] += 1
+
+    public_key = load_pem_public_key(public_key_pem.encode("utf-8"))
+    if BIOMETRIC_KEY_CACHE_SIZE > 0:
+        with _lock:
+            _keys[cache_key] = public_key
+            if len(_keys) > BIOMETRIC_KEY_CACHE_SIZE:
+                _keys.popitem(last=False)
+    return public_key
+
+
+def get_biometric_cache_stats() -> dict:
+    with _lock:
+        return {**_stats, "devices": len(_devices), "keys": len(_keys)}
+
+
+def clear_biometric_caches() -> None:
+    with _lock:
+        _devices.clear()
+        _keys.clear()
@@ -16,6 +16,7 @@ from typing import Dict, Any, Optional, List
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 from sqlalchemy.orm import Session
+from database import use_family_shard
 from models import (
     User, FamilyProfile, Medication, MedicalExam, DoctorVisit,
     EmergencyContact, DailyTracking, MedicationLog, ExamDataPoint,
@@ -23,6 +24,7 @@ from models import (
     FamilyCaregiver, FamilyDataShare
 )
 from services.audit_service import get_access_report, ACTION_EXPORT, ACTION_DATA_DELETION
+from services.user_cache import invalidate_user_cache
 
 
 EXPORT_DIR = Path("exports")
@@ -69,8 +71,9 @@ def export_user_data(
         "export_type": export_type
     }
     
-    # Perfis da família
+    # Perfis da família (dados médicos ficam no shard da família)
     if user.family_id:
+        use_family_shard(db, user.family_id)
         profiles = db.query(FamilyProfile).filter(
             FamilyProfile.family_id == user.family_id
         ).all()
@@ -254,10 +257,11 @@ def execute_data_deletion(
         deletion_request.status = "processing"
         db.commit()
         
+        user = db.query(User).filter(User.id == user_id).first()
         if deletion_request.request_type == "full":
             # Excluir todos os dados do usuário
-            user = db.query(User).filter(User.id == user_id).first()
             if user and user.family_id:
+                use_family_shard(db, user.family_id)
                 # Excluir perfis e dados médicos
                 profiles = db.query(FamilyProfile).filter(
                     FamilyProfile.family_id == user.family_id
@@ -295,7 +299,8 @@ def execute_data_deletion(
         
         elif deletion_request.request_type == "partial":
             # Excluir apenas dados médicos, manter conta
-            if user.family_id:
+            if user and user.family_id:
+                use_family_shard(db, user.family_id)
                 profiles = db.query(FamilyProfile).filter(
                     FamilyProfile.family_id == user.family_id
                 ).all()
@@ -310,6 +315,7 @@ def execute_data_deletion(
         deletion_request.status = "completed"
         deletion_request.completed_at = datetime.now(timezone.utc)
         db.commit()
+        invalidate_user_cache(user_id)
         
         return True
     
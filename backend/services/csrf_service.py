@@ -1,11 +1,31 @@
 """
 Serviço para gerenciar tokens CSRF (Cross-Site Request Forgery).
-Armazena tokens no Redis com TTL curto.
+
+Dois modos (CSRF_MODE):
+- "redis" (padrão): token aleatório armazenado no Redis com TTL curto.
+- "stateless": token assinado com HMAC sobre (session_id, emissão, nonce),
+  no mesmo esquema de session_tokens.py. A validação é só CPU, sem ida ao
+  Redis. Suporta rotação via CSRF_SIGNING_KEYS ("kid:segredo,..."; a
+  primeira chave assina, as demais continuam válidas para verificação).
+
+Migração para "stateless": os tokens já emitidos no Redis continuam válidos
+(consulta ao Redis só para tokens fora do formato assinado) enquanto
+CSRF_ACCEPT_REDIS_TOKENS=true, o padrão. Desligar após CSRF_TOKEN_TTL.
 """
+import base64
+import hashlib
+import hmac
+import os
 import secrets
 import logging
-from typing import Optional
-from config.redis_config import get_redis_client, is_redis_available
+import time
+from typing import Dict, Optional, Tuple
+from config.redis_config import (
+    get_redis_client,
+    is_redis_available,
+    get_async_redis_client,
+    record_redis_failure,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +33,88 @@ logger = logging.getLogger(__name__)
 CSRF_PREFIX = "csrf:token:"
 CSRF_TOKEN_TTL = 3600  # 1 hora em segundos
 
+CSRF_MODE_STATELESS = "stateless"
+CSRF_MODE_REDIS = "redis"
+CSRF_MODE = os.getenv("CSRF_MODE", CSRF_MODE_REDIS).lower()
+# No modo stateless, aceitar tokens emitidos no Redis (janela de migração)
+CSRF_ACCEPT_REDIS_TOKENS = os.getenv("CSRF_ACCEPT_REDIS_TOKENS", "true").lower() == "true"
+STATELESS_TOKEN_VERSION = "v1"
+
+
+def _load_signing_keys() -> Tuple[str, Dict[str, bytes]]:
+    """Retorna (kid ativo, {kid: chave}) a partir de CSRF_SIGNING_KEYS ou do segredo da aplicação."""
+    keys: Dict[str, bytes] = {}
+    active = None
+    for item in os.getenv("CSRF_SIGNING_KEYS", "").split(","):
+        kid, sep, secret = item.strip().partition(":")
+        if not sep or not kid or not secret or "." in kid:
+            continue
+        keys[kid] = secret.encode("utf-8")
+        active = active or kid
+    if active:
+        return active, keys
+
+    secret = os.getenv("SESSION_ACTION_SECRET") or os.getenv("JWT_SECRET_KEY") or os.getenv("API_KEY")
+    if not secret:
+        logger.warning("CSRF_SIGNING_KEYS nao configurada. Usando chave temporaria.")
+        secret = secrets.token_urlsafe(32)
+    # Derivar chave própria para não reutilizar o segredo do JWT diretamente
+    return "0", {"0": hmac.new(secret.encode("utf-8"), b"csrf-token", hashlib.sha256).digest()}
+
+
+_active_kid, _signing_keys = _load_signing_keys()
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("utf-8").rstrip("=")
+
+
+def _sign(key: bytes, kid: str, session_id: Optional[str], issued_at: str, nonce: str) -> str:
+    message = f"{STATELESS_TOKEN_VERSION}.{kid}.{session_id or ''}.{issued_at}.{nonce}".encode("utf-8")
+    return _b64(hmac.new(key, message, hashlib.sha256).digest())
+
+
+def create_stateless_csrf_token(session_id: Optional[str] = None) -> str:
+    """Gera token CSRF assinado (v1.kid.emissao.nonce.assinatura)."""
+    issued_at = str(int(time.time()))
+    nonce = secrets.token_urlsafe(12)
+    signature = _sign(_signing_keys[_active_kid], _active_kid, session_id, issued_at, nonce)
+    return f"{STATELESS_TOKEN_VERSION}.{_active_kid}.{issued_at}.{nonce}.{signature}"
+
+
+def verify_stateless_csrf_token(token: str, session_id: Optional[str] = None) -> bool:
+    """Valida assinatura e idade do token sem acesso à rede."""
+    if not token:
+        return False
+    parts = token.split(".")
+    if len(parts) != 5 or parts[0] != STATELESS_TOKEN_VERSION:
+        return False
+    _, kid, issued_at, nonce, signature = parts
+    key = _signing_keys.get(kid)
+    if key is None or not issued_at.isdigit():
+        return False
+    age = time.time() - int(issued_at)
+    if age > CSRF_TOKEN_TTL or age < -60:
+        return False
+    return hmac.compare_digest(_sign(key, kid, session_id, issued_at, nonce), signature)
+
+
+def _is_stateless_token(token: str) -> bool:
+    return token.startswith(f"{STATELESS_TOKEN_VERSION}.")
+
+
+def _verify_legacy_redis_token(token: str, session_id: Optional[str]) -> bool:
+    """Token emitido no modo redis (migração): só vale se existir no Redis."""
+    if not is_redis_available():
+        return False
+    try:
+        redis_client = get_redis_client()
+        return redis_client is not None and bool(redis_client.exists(_csrf_key(token, session_id)))
+    except Exception as e:
+        record_redis_failure(e)
+        logger.error(f"Erro ao verificar token CSRF: {e}")
+        return False
+
 
 def generate_csrf_token() -> str:
     """
@@ -72,9 +174,13 @@ def verify_csrf_token(token: str, session_id: Optional[str] = None) -> bool:
     # Se token está vazio, sempre rejeitar
     if not token or len(token) == 0:
         return False
+
+    if CSRF_MODE == CSRF_MODE_STATELESS:
+        if CSRF_ACCEPT_REDIS_TOKENS and not _is_stateless_token(token):
+            return _verify_legacy_redis_token(token, session_id)
+        return verify_stateless_csrf_token(token, session_id)
     
     # Em modo de teste, aceitar tokens se Redis não estiver disponível
-    import os
     if os.getenv("TESTING") == "1" and not is_redis_available():
         # Em testes, aceitar qualquer token não vazio como válido
         # (permite testes sem Redis)
@@ -102,6 +208,48 @@ def verify_csrf_token(token: str, session_id: Optional[str] = None) -> bool:
         return bool(exists)
         
     except Exception as e:
+        record_redis_failure(e)
+        logger.error(f"Erro ao verificar token CSRF: {e}")
+        return False
+
+
+def _csrf_key(token: str, session_id: Optional[str]) -> str:
+    if session_id:
+        return f"{CSRF_PREFIX}{session_id}:{token}"
+    return f"{CSRF_PREFIX}{token}"
+
+
+async def verify_csrf_token_async(token: str, session_id: Optional[str] = None) -> bool:
+    """
+    Versão async de verify_csrf_token (redis.asyncio), para uso em
+    middlewares e handlers async sem bloquear o event loop.
+    """
+    if not token:
+        return False
+    if CSRF_MODE == CSRF_MODE_STATELESS:
+        if CSRF_ACCEPT_REDIS_TOKENS and not _is_stateless_token(token):
+            redis_client = await get_async_redis_client()
+            if redis_client is None:
+                return False
+            try:
+                return bool(await redis_client.exists(_csrf_key(token, session_id)))
+            except Exception as e:
+                record_redis_failure(e)
+                logger.error(f"Erro ao verificar token CSRF: {e}")
+                return False
+        return verify_stateless_csrf_token(token, session_id)
+
+    redis_client = await get_async_redis_client()
+    if redis_client is None:
+        # Mesmo fallback de verify_csrf_token: aceitar token não vazio
+        if os.getenv("TESTING") != "1":
+            logger.warning("Redis não disponível, aceitando token CSRF sem validação no Redis")
+        return True
+
+    try:
+        return bool(await redis_client.exists(_csrf_key(token, session_id)))
+    except Exception as e:
+        record_redis_failure(e)
         logger.error(f"Erro ao verificar token CSRF: {e}")
         return False
 
@@ -140,7 +288,8 @@ def remove_csrf_token(token: str, session_id: Optional[str] = None) -> bool:
 
 def generate_and_store_csrf_token(session_id: Optional[str] = None) -> Optional[str]:
     """
-    Gera e armazena um novo token CSRF.
+    Gera e armazena um novo token CSRF (no modo stateless apenas gera o
+    token assinado, sem Redis).
     
     Args:
         session_id: ID da sessão (opcional)
@@ -149,6 +298,9 @@ def generate_and_store_csrf_token(session_id: Optional[str] = None) -> Optional[
         Token CSRF gerado. Retorna token mesmo se Redis não estiver disponível
         (o token ainda pode ser usado, apenas não será validado no Redis)
     """
+    if CSRF_MODE == CSRF_MODE_STATELESS:
+        return create_stateless_csrf_token(session_id)
+
     token = generate_csrf_token()
     
     # Tentar armazenar no Redis se disponível
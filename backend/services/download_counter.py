@@ -0,0 +1,68 @@
+"""
+Contador de downloads por usuário em janela fixa, para a detecção de
+download em massa.
+
+No Redis, SET NX EX abre a janela no primeiro download e INCR devolve a
+contagem, em uma transação (uma ida ao Redis). Sem Redis a contagem fica
+em memória do processo, com a mesma semântica. Substitui o INSERT + COUNT
+em user_download_events a cada exame aberto.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, List
+
+from config.redis_config import get_redis_client, is_redis_available, record_redis_failure
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_COUNTER_ENABLED = os.getenv(
+    "DOWNLOAD_COUNTER_ENABLED", "false" if os.getenv("TESTING") else "true"
+).lower() == "true"
+DOWNLOAD_COUNTER_LOCAL_MAX_USERS = int(os.getenv("DOWNLOAD_COUNTER_LOCAL_MAX_USERS", "50000"))
+
+DOWNLOAD_COUNTER_PREFIX = "security:downloads:"
+
+_lock = threading.Lock()
+# user_id -> [fim da janela (monotonic), contagem]
+_local: Dict[int, List[float]] = {}
+
+
+def _increment_local(user_id: int, window_seconds: int) -> int:
+    now = time.monotonic()
+    with _lock:
+        window = _local.get(user_id)
+        if window is None or window[0] <= now:
+            if len(_local) >= DOWNLOAD_COUNTER_LOCAL_MAX_USERS:
+                for key in [key for key, value in _local.items() if value[0] <= now]:
+                    del _local[key]
+                if len(_local) >= DOWNLOAD_COUNTER_LOCAL_MAX_USERS:
+                    _local.pop(next(iter(_local)))
+            window = _local[user_id] = [now + window_seconds, 0]
+        window[1] += 1
+        return int(window[1])
+
+
+def increment_download_count(user_id: int, window_minutes: int) -> int:
+    """Registra um download e devolve quantos o usuário fez na janela atual."""
+    window_seconds = window_minutes * 60
+    if is_redis_available():
+        try:
+            client = get_redis_client()
+            if client is not None:
+                key = f"{DOWNLOAD_COUNTER_PREFIX}{user_id}"
+                pipe = client.pipeline()
+                pipe.set(key, 0, ex=window_seconds, nx=True)
+                pipe.incr(key)
+                _, count = pipe.execute()
+                return int(count)
+        except Exception as e:
+            record_redis_failure(e)
+            logger.warning(f"Erro no contador de downloads do usuário {user_id}: {e}")
+    return _increment_local(user_id, window_seconds)
+
+
+def clear_download_counters() -> None:
+    with _lock:
+        _local.clear()
@@ -9,6 +9,7 @@ import secrets
 from typing import Optional, Dict, Any, List
 from datetime import datetime, timezone
 from sqlalchemy.orm import Session
+from database import use_family_shard, use_profile_shard
 from models import (
     EmergencyProfile, EmergencyAccessLog, FamilyProfile,
     EmergencyContact, Medication, MedicalExam, DoctorVisit
@@ -164,6 +165,7 @@ def get_emergency_info(
     
     if not family_profile:
         raise ValueError("Perfil não encontrado")
+    use_family_shard(db, family_profile.family_id)
     
     # Obter configurações de emergência
     emergency_profile = db.query(EmergencyProfile).filter(
@@ -175,17 +177,17 @@ def get_emergency_info(
         raise ValueError("Modo de emergência não configurado")
     
     # Preparar informações
-        # Determinar nome a exibir
-        if emergency_profile.show_full_name:
-            display_name = family_profile.name
-        else:
-            display_name = _get_initials(family_profile.name)
-        
-        info = {
-            "profile_id": profile_id,
-            "name": display_name,
-            "blood_type": family_profile.blood_type if emergency_profile.show_blood_type else None,
-        }
+    # Determinar nome a exibir
+    if emergency_profile.show_full_name:
+        display_name = family_profile.name
+    else:
+        display_name = _get_initials(family_profile.name)
+    
+    info = {
+        "profile_id": profile_id,
+        "name": display_name,
+        "blood_type": family_profile.blood_type if emergency_profile.show_blood_type else None,
+    }
     
     # Alergias críticas (podem estar em notes do perfil ou em campo específico)
     if emergency_profile.show_allergies:
@@ -320,7 +322,8 @@ def notify_emergency_contacts(
     if not emergency_profile or not emergency_profile.notify_contacts_on_access:
         return False
     
-    # Obter contatos de emergência
+    # Obter contatos de emergência (shard da família do perfil)
+    use_profile_shard(db, profile_id)
     contacts = db.query(EmergencyContact).filter(
         EmergencyContact.profile_id == profile_id
     ).all()
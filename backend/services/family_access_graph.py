@@ -0,0 +1,218 @@
+"""
+Family Access Graph - In-process cache of family access relationships
+
+Keeps, per family, a compact graph of profiles, profile ownership, caregiver
+links and active data shares so permission checks become in-memory lookups.
+Each family has a version number in Redis (INCR on every change); local
+graphs are rebuilt when the published version moves, and the family and
+caregiver endpoints bump it after committing their changes. When the
+published version cannot be read (Redis down), no graph is served: the
+caller falls back to the SQL resolver and local graphs are dropped, since
+bumps made during the outage may have been lost.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from config.redis_config import get_redis_client, is_redis_available
+from models import User, FamilyProfile, FamilyCaregiver, FamilyDataShare
+from services.permission_service import AccessGrants, DataShareGrant
+
+logger = logging.getLogger(__name__)
+
+FAMILY_GRAPH_ENABLED = os.getenv(
+    "FAMILY_GRAPH_ENABLED", "false" if os.getenv("TESTING") else "true"
+).lower() == "true"
+# Intervalo para reler a versão publicada no Redis
+FAMILY_GRAPH_VERSION_CHECK_SECONDS = float(os.getenv("FAMILY_GRAPH_VERSION_CHECK_SECONDS", "2"))
+# Idade máxima de um grafo local (proteção contra alterações fora dos endpoints)
+FAMILY_GRAPH_MAX_AGE_SECONDS = float(os.getenv("FAMILY_GRAPH_MAX_AGE_SECONDS", "300"))
+FAMILY_GRAPH_MAX_FAMILIES = int(os.getenv("FAMILY_GRAPH_MAX_FAMILIES", "10000"))
+
+VERSION_PREFIX = "family_graph:version:"
+
+
+class FamilyGraph:
+    """Immutable snapshot of one family's access relationships."""
+
+    __slots__ = (
+        "family_id", "version", "built_at", "checked_at",
+        "profiles", "own_profiles", "caregivers", "shares",
+    )
+
+    def __init__(self, family_id: int, version: int, profiles: frozenset,
+                 own_profiles: Dict[int, Tuple[int, ...]],
+                 caregivers: Dict[Tuple[int, int], str],
+                 shares: Dict[Tuple[int, int], tuple]):
+        self.family_id = family_id
+        self.version = version
+        self.built_at = time.monotonic()
+        self.checked_at = self.built_at
+        # ids dos perfis da família
+        self.profiles = profiles
+        # user_id -> ids (ordenados) dos perfis criados pelo usuário
+        self.own_profiles = own_profiles
+        # (profile_id, caregiver_user_id) -> access_level
+        self.caregivers = caregivers
+        # (from_profile_id, to_profile_id) -> (expires_at, permissions) do compartilhamento ativo
+        self.shares = shares
+
+
+_lock = threading.Lock()
+_graphs: Dict[int, FamilyGraph] = {}
+_local_versions: Dict[int, int] = {}
+_stats = {"hits": 0, "builds": 0, "fallbacks": 0, "unversioned": 0}
+
+
+def _published_version(family_id: int) -> Optional[int]:
+    if not is_redis_available():
+        return None
+    try:
+        client = get_redis_client()
+        if client is None:
+            return None
+        value = client.get(f"{VERSION_PREFIX}{family_id}")
+        return int(value) if value is not None else 0
+    except Exception as e:
+        logger.warning(f"Erro ao ler versão do grafo da família {family_id}: {e}")
+        return None
+
+
+def bump_family_graph_version(family_id: Optional[int]) -> None:
+    """Invalidate the family graph here and in every process (via Redis)."""
+    if family_id is None:
+        return
+    with _lock:
+        _graphs.pop(family_id, None)
+        _local_versions[family_id] = _local_versions.get(family_id, 0) + 1
+    try:
+        if is_redis_available():
+            client = get_redis_client()
+            if client is not None:
+                client.incr(f"{VERSION_PREFIX}{family_id}")
+    except Exception as e:
+        logger.warning(f"Erro ao publicar versão do grafo da família {family_id}: {e}")
+
+
+def build_family_graph(db: Session, family_id: int, version: int) -> FamilyGraph:
+    """Load the family's relationships (three queries) into a FamilyGraph."""
+    profile_rows = db.query(FamilyProfile.id, FamilyProfile.created_by).filter(
+        FamilyProfile.family_id == family_id
+    ).order_by(FamilyProfile.id).all()
+    profiles = frozenset(profile_id for profile_id, _ in profile_rows)
+
+    own: Dict[int, list] = {}
+    for profile_id, created_by in profile_rows:
+        if created_by is not None:
+            own.setdefault(created_by, []).append(profile_id)
+
+    caregivers: Dict[Tuple[int, int], str] = {}
+    if profiles:
+        caregiver_rows = db.query(
+            FamilyCaregiver.profile_id, FamilyCaregiver.caregiver_user_id, FamilyCaregiver.access_level
+        ).filter(
+            FamilyCaregiver.profile_id.in_(profiles)
+        ).order_by(FamilyCaregiver.id).all()
+        for profile_id, caregiver_user_id, access_level in caregiver_rows:
+            caregivers.setdefault((profile_id, caregiver_user_id), access_level)
+
+    shares: Dict[Tuple[int, int], tuple] = {}
+    share_rows = db.query(
+        FamilyDataShare.from_profile_id, FamilyDataShare.to_profile_id,
+        FamilyDataShare.expires_at, FamilyDataShare.permissions
+    ).filter(
+        FamilyDataShare.family_id == family_id,
+        FamilyDataShare.revoked_at.is_(None)
+    ).order_by(FamilyDataShare.id).all()
+    for from_profile_id, to_profile_id, expires_at, permissions in share_rows:
+        shares.setdefault((from_profile_id, to_profile_id), (expires_at, permissions))
+
+    return FamilyGraph(
+        family_id,
+        version,
+        profiles,
+        {user_id: tuple(ids) for user_id, ids in own.items()},
+        caregivers,
+        shares,
+    )
+
+
+def get_family_graph(db: Session, family_id: int) -> Optional[FamilyGraph]:
+    """
+    Return the cached graph for the family, rebuilding it if stale.
+    Returns None when the published version cannot be read.
+    """
+    now = time.monotonic()
+    with _lock:
+        graph = _graphs.get(family_id)
+        local_version = _local_versions.get(family_id, 0)
+    if graph is not None and now - graph.built_at < FAMILY_GRAPH_MAX_AGE_SECONDS:
+        if now - graph.checked_at < FAMILY_GRAPH_VERSION_CHECK_SECONDS:
+            _stats["hits"] += 1
+            return graph
+    published = _published_version(family_id)
+    if published is None:
+        with _lock:
+            _graphs.clear()
+            _stats["unversioned"] += 1
+        return None
+    if graph is not None and now - graph.built_at < FAMILY_GRAPH_MAX_AGE_SECONDS and published == graph.version:
+        graph.checked_at = now
+        _stats["hits"] += 1
+        return graph
+
+    graph = build_family_graph(db, family_id, published)
+    with _lock:
+        if len(_graphs) >= FAMILY_GRAPH_MAX_FAMILIES:
+            _graphs.pop(next(iter(_graphs)))
+        # Não cachear se houve bump local durante a construção
+        if _local_versions.get(family_id, 0) == local_version:
+            _graphs[family_id] = graph
+        _stats["builds"] += 1
+    return graph
+
+
+def get_graph_grants(user: User, resource_owner_id: int, db: Session):
+    """
+    Access grants of ``user`` on ``resource_owner_id`` from the family graph.
+    Returns None when the graph cannot answer (no family, target outside
+    the family or version unavailable), so the caller falls back to the SQL
+    resolver.
+    """
+    if not user.family_id:
+        _stats["fallbacks"] += 1
+        return None
+    graph = get_family_graph(db, user.family_id)
+    if graph is None or resource_owner_id not in graph.profiles:
+        _stats["fallbacks"] += 1
+        return None
+
+    own_ids = graph.own_profiles.get(user.id, ())
+    own_profile_id = own_ids[0] if own_ids else None
+    data_share = None
+    if own_profile_id is not None:
+        share = graph.shares.get((resource_owner_id, own_profile_id))
+        if share is not None:
+            data_share = DataShareGrant(own_profile_id, share[0], share[1])
+    return AccessGrants(
+        target_in_family=True,
+        own_profile_id=own_profile_id,
+        caregiver_access_level=graph.caregivers.get((resource_owner_id, user.id)),
+        data_share=data_share,
+    )
+
+
+def get_graph_stats() -> dict:
+    with _lock:
+        return {**_stats, "families": len(_graphs)}
+
+
+def clear_family_graphs() -> None:
+    with _lock:
+        _graphs.clear()
+        _local_versions.clear()
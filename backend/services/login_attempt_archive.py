@@ -0,0 +1,60 @@
+"""
+Arquivo append-only das tentativas de login, gravado em lote.
+
+Com o contador no Redis (login_attempt_counter) as linhas de
+user_login_attempts deixam de ser lidas no login e servem apenas para
+auditoria/forense. Em vez de um INSERT por tentativa, as linhas vão para
+um AuditSink (INSERT em lote periódico, por volume ou no shutdown).
+"""
+import os
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+import models
+from services.audit_sink import AuditSink
+
+LOGIN_ATTEMPT_ARCHIVE_FLUSH_MAX_ENTRIES = int(os.getenv("LOGIN_ATTEMPT_ARCHIVE_FLUSH_MAX_ENTRIES", "500"))
+LOGIN_ATTEMPT_ARCHIVE_MAX_PENDING = int(os.getenv("LOGIN_ATTEMPT_ARCHIVE_MAX_PENDING", "20000"))
+
+_sink = AuditSink(
+    "login_attempts",
+    models.UserLoginAttempt,
+    LOGIN_ATTEMPT_ARCHIVE_FLUSH_MAX_ENTRIES,
+    LOGIN_ATTEMPT_ARCHIVE_MAX_PENDING,
+)
+
+
+def archive_login_attempt(
+    email: str,
+    ip_address: Optional[str],
+    user_agent: Optional[str],
+    success: bool,
+    created_at: Optional[datetime] = None
+) -> None:
+    """Enfileira a tentativa para o próximo INSERT em lote."""
+    _sink.add({
+        "email": email,
+        "ip_address": ip_address,
+        "user_agent": user_agent,
+        "success": success,
+        "created_at": created_at or datetime.now(timezone.utc),
+    })
+
+
+def flush_login_attempts(db: Optional[Session] = None) -> int:
+    """Grava as tentativas pendentes em um INSERT em lote. Retorna o número de linhas."""
+    return _sink.flush(db)
+
+
+def pending_login_attempts() -> int:
+    return _sink.pending()
+
+
+def get_login_attempt_archive_stats() -> dict:
+    return _sink.stats()
+
+
+def clear_login_attempt_archive() -> None:
+    _sink.clear()
@@ -0,0 +1,92 @@
+"""
+Contador de tentativas de login falhadas em janela deslizante no Redis.
+
+Cada par (email, IP) tem um sorted set com o instante (ms) de cada falha.
+Um script Lua remove as falhas fora da janela, opcionalmente registra a
+nova e devolve a contagem: uma ida ao Redis, atômica mesmo com vários
+workers, no lugar do COUNT/INSERT/DELETE em user_login_attempts.
+
+As funções retornam None quando o Redis não está disponível; o chamador
+(login_security) volta para a contagem no banco.
+"""
+import logging
+import os
+import time
+import uuid
+from typing import Optional
+
+from config.redis_config import get_redis_client, is_redis_available, record_redis_failure
+
+logger = logging.getLogger(__name__)
+
+LOGIN_ATTEMPT_COUNTER_ENABLED = os.getenv(
+    "LOGIN_ATTEMPT_COUNTER_ENABLED", "false" if os.getenv("TESTING") else "true"
+).lower() == "true"
+
+LOGIN_FAILURES_PREFIX = "auth:login_failures:"
+
+# KEYS[1]: sorted set das falhas; ARGV: agora (ms), janela (ms), membro novo ('' = apenas contar)
+_SLIDING_WINDOW_LUA = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if ARGV[3] ~= '' then
+    redis.call('ZADD', KEYS[1], now, ARGV[3])
+    redis.call('PEXPIRE', KEYS[1], window)
+end
+return redis.call('ZCARD', KEYS[1])
+"""
+
+_script = None
+
+
+def login_failures_key(email: str, ip_address: Optional[str]) -> str:
+    return f"{LOGIN_FAILURES_PREFIX}{email.lower()}:{ip_address or '-'}"
+
+
+def _run(email: str, ip_address: Optional[str], window_minutes: int, member: str) -> Optional[int]:
+    global _script
+    if not is_redis_available():
+        return None
+    try:
+        client = get_redis_client()
+        if client is None:
+            return None
+        if _script is None:
+            _script = client.register_script(_SLIDING_WINDOW_LUA)
+        now_ms = int(time.time() * 1000)
+        return int(_script(
+            keys=[login_failures_key(email, ip_address)],
+            args=[now_ms, window_minutes * 60 * 1000, member],
+            client=client,
+        ))
+    except Exception as e:
+        record_redis_failure(e)
+        logger.warning(f"Erro no contador de tentativas de login: {e}")
+        return None
+
+
+def count_failed_attempts(email: str, ip_address: Optional[str], window_minutes: int) -> Optional[int]:
+    """Falhas de (email, IP) na janela, ou None sem Redis."""
+    return _run(email, ip_address, window_minutes, "")
+
+
+def add_failed_attempt(email: str, ip_address: Optional[str], window_minutes: int) -> Optional[int]:
+    """Registra uma falha e devolve a contagem na janela já incluindo-a, ou None sem Redis."""
+    return _run(email, ip_address, window_minutes, f"{time.time_ns()}:{uuid.uuid4().hex[:8]}")
+
+
+def reset_failed_attempts(email: str, ip_address: Optional[str]) -> bool:
+    """Zera o contador de (email, IP) após um login bem-sucedido."""
+    if not is_redis_available():
+        return False
+    try:
+        client = get_redis_client()
+        if client is None:
+            return False
+        client.delete(login_failures_key(email, ip_address))
+        return True
+    except Exception as e:
+        record_redis_failure(e)
+        logger.warning(f"Erro ao zerar contador de tentativas de login: {e}")
+        return False
@@ -0,0 +1,279 @@
+"""
+Fila de notificações de saída (push Expo e email) com worker em background.
+Também é o outbox de email_service.send_email.
+
+As notificações de segurança eram enviadas dentro da requisição: um
+requests.post para a API do Expo (timeout de 5 s) e uma conexão SMTP por
+email. Aqui elas são apenas enfileiradas; o worker (notification_dispatch_loop
+em main.py) as entrega fora do caminho da requisição:
+
+- push: agrupados em lotes de até EXPO_PUSH_BATCH_SIZE mensagens (limite de
+  100 por requisição do Expo), em uma sessão HTTP com pool de conexões;
+- retry com backoff exponencial para erros de rede, HTTP 429/5xx e tickets
+  MessageRateExceeded, até NOTIFICATION_MAX_ATTEMPTS tentativas;
+- os emails de uma passada saem pela mesma conexão do pool SMTP
+  (email_service.SMTPConnectionPool), sem handshake TLS/LOGIN por email;
+- alertas idênticos (mesmo destinatário, título e texto) dentro de
+  NOTIFICATION_DEDUPE_SECONDS são enviados uma vez só. Com Redis a
+  deduplicação vale entre workers; sem ele, por processo.
+
+Com o dispatcher desativado (padrão em TESTING) notification_service envia
+na hora, como antes.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config.redis_config import get_redis_client, is_redis_available, record_redis_failure
+from email_service import deliver_emails
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_DISPATCHER_ENABLED = os.getenv(
+    "NOTIFICATION_DISPATCHER_ENABLED", "false" if os.getenv("TESTING") else "true"
+).lower() == "true"
+NOTIFICATION_DISPATCH_INTERVAL_SECONDS = float(os.getenv("NOTIFICATION_DISPATCH_INTERVAL_SECONDS", "1"))
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "4"))
+NOTIFICATION_RETRY_BASE_SECONDS = float(os.getenv("NOTIFICATION_RETRY_BASE_SECONDS", "2"))
+NOTIFICATION_DEDUPE_SECONDS = int(os.getenv("NOTIFICATION_DEDUPE_SECONDS", "300"))
+NOTIFICATION_MAX_PENDING = int(os.getenv("NOTIFICATION_MAX_PENDING", "10000"))
+
+EXPO_PUSH_URL = os.getenv("EXPO_PUSH_URL", "https://exp.host/--/api/v2/push/send")
+EXPO_PUSH_BATCH_SIZE = min(100, int(os.getenv("EXPO_PUSH_BATCH_SIZE", "100")))
+EXPO_PUSH_TIMEOUT_SECONDS = float(os.getenv("EXPO_PUSH_TIMEOUT_SECONDS", "10"))
+EXPO_POOL_MAXSIZE = int(os.getenv("EXPO_POOL_MAXSIZE", "4"))
+
+NOTIFICATION_DEDUPE_PREFIX = "notify:dedupe:"
+# Erros de ticket do Expo que valem nova tentativa
+_RETRYABLE_TICKET_ERRORS = {"MessageRateExceeded"}
+
+_lock = threading.Lock()
+_pending: Deque[dict] = deque()
+_dedupe: Dict[str, float] = {}
+_stats = {"enqueued": 0, "deduplicated": 0, "sent": 0, "retried": 0, "failed": 0, "dropped": 0, "push_requests": 0}
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_wakeup: Optional[asyncio.Event] = None
+
+
+def _get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=EXPO_POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+                _session = session
+    return _session
+
+
+def is_expo_push_token(push_token: Optional[str]) -> bool:
+    return bool(push_token) and push_token.startswith("ExponentPushToken")
+
+
+def push_message(push_token: str, title: str, body: str) -> dict:
+    return {"to": push_token, "title": title, "body": body, "sound": "default"}
+
+
+def send_push_now(push_token: str, title: str, body: str) -> None:
+    """Envio imediato de um push (dispatcher desativado); erros são ignorados."""
+    try:
+        _get_session().post(EXPO_PUSH_URL, json=push_message(push_token, title, body), timeout=5)
+    except Exception:
+        return
+
+
+# ---- Enfileiramento (qualquer thread) ----
+
+def _dedupe_key(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:32]
+
+
+def _is_duplicate(key: str) -> bool:
+    if is_redis_available():
+        try:
+            client = get_redis_client()
+            if client is not None:
+                return not client.set(f"{NOTIFICATION_DEDUPE_PREFIX}{key}", 1, ex=NOTIFICATION_DEDUPE_SECONDS, nx=True)
+        except Exception as e:
+            record_redis_failure(e)
+            logger.warning(f"Erro na deduplicação de notificações: {e}")
+    now = time.monotonic()
+    with _lock:
+        if len(_dedupe) > NOTIFICATION_MAX_PENDING:
+            for expired in [k for k, expires in _dedupe.items() if expires <= now]:
+                del _dedupe[expired]
+        if _dedupe.get(key, 0) > now:
+            return True
+        _dedupe[key] = now + NOTIFICATION_DEDUPE_SECONDS
+        return False
+
+
+def _enqueue(kind: str, payload: dict, dedupe_key: Optional[str]) -> bool:
+    if dedupe_key is not None and _is_duplicate(dedupe_key):
+        with _lock:
+            _stats["deduplicated"] += 1
+        return False
+    with _lock:
+        if len(_pending) >= NOTIFICATION_MAX_PENDING:
+            _stats["dropped"] += 1
+            logger.warning("Fila de notificações cheia; notificação descartada")
+            return False
+        _pending.append({"kind": kind, "payload": payload, "attempts": 0, "not_before": 0.0})
+        _stats["enqueued"] += 1
+    if _loop is not None and _wakeup is not None:
+        try:
+            _loop.call_soon_threadsafe(_wakeup.set)
+        except RuntimeError:
+            pass
+    return True
+
+
+def enqueue_push(push_token: str, title: str, body: str) -> bool:
+    """Enfileira um push Expo. Retorna False se deduplicado ou descartado."""
+    return _enqueue("push", push_message(push_token, title, body), _dedupe_key("push", push_token, title, body))
+
+
+def enqueue_email(to_email: str, subject: str, body: str, dedupe: bool = True) -> bool:
+    """
+    Enfileira um email. Retorna False se deduplicado ou descartado.
+    Emails transacionais (verificação, reset, convites) usam dedupe=False.
+    """
+    payload = {"to_email": to_email, "subject": subject, "body": body}
+    return _enqueue("email", payload, _dedupe_key("email", to_email.lower(), subject, body) if dedupe else None)
+
+
+# ---- Entrega (worker) ----
+
+def _retry_or_fail(item: dict, reason: str) -> None:
+    item["attempts"] += 1
+    with _lock:
+        if item["attempts"] >= NOTIFICATION_MAX_ATTEMPTS:
+            _stats["failed"] += 1
+            logger.error(f"Notificação {item['kind']} descartada após {item['attempts']} tentativas: {reason}")
+            return
+        item["not_before"] = time.monotonic() + NOTIFICATION_RETRY_BASE_SECONDS * 2 ** (item["attempts"] - 1)
+        _pending.append(item)
+        _stats["retried"] += 1
+
+
+def _take_ready(force: bool) -> List[dict]:
+    now = time.monotonic()
+    with _lock:
+        ready, waiting = [], deque()
+        while _pending:
+            item = _pending.popleft()
+            (ready if force or item["not_before"] <= now else waiting).append(item)
+        _pending.extend(waiting)
+        return ready
+
+
+def _send_push_batch(items: List[dict]) -> None:
+    with _lock:
+        _stats["push_requests"] += 1
+    try:
+        response = _get_session().post(
+            EXPO_PUSH_URL, json=[item["payload"] for item in items], timeout=EXPO_PUSH_TIMEOUT_SECONDS
+        )
+    except requests.RequestException as e:
+        for item in items:
+            _retry_or_fail(item, str(e))
+        return
+
+    if response.status_code == 429 or response.status_code >= 500:
+        for item in items:
+            _retry_or_fail(item, f"HTTP {response.status_code}")
+        return
+    if response.status_code >= 400:
+        with _lock:
+            _stats["failed"] += len(items)
+        logger.error(f"Expo recusou lote de push: HTTP {response.status_code} {response.text[:200]}")
+        return
+
+    try:
+        tickets = response.json().get("data") or []
+    except ValueError:
+        tickets = []
+    sent = 0
+    for index, item in enumerate(items):
+        ticket = tickets[index] if index < len(tickets) and isinstance(tickets[index], dict) else {}
+        if ticket.get("status") == "error":
+            error = (ticket.get("details") or {}).get("error")
+            if error in _RETRYABLE_TICKET_ERRORS:
+                _retry_or_fail(item, error)
+            else:
+                with _lock:
+                    _stats["failed"] += 1
+                logger.warning(f"Push recusado pelo Expo: {error or ticket.get('message')}")
+        else:
+            sent += 1
+    with _lock:
+        _stats["sent"] += sent
+
+
+def _send_email_batch(items: List[dict]) -> None:
+    # Uma conexão SMTP do pool para o lote inteiro
+    results = deliver_emails([item["payload"] for item in items])
+    for item, delivered in zip(items, results):
+        if delivered:
+            with _lock:
+                _stats["sent"] += 1
+        else:
+            _retry_or_fail(item, "falha no envio SMTP")
+
+
+def dispatch_pending(force: bool = False) -> int:
+    """
+    Entrega as notificações prontas (force=True ignora o backoff, usado no
+    shutdown). Retorna quantas foram processadas nesta passada.
+    """
+    items = _take_ready(force)
+    pushes = [item for item in items if item["kind"] == "push"]
+    for start in range(0, len(pushes), EXPO_PUSH_BATCH_SIZE):
+        _send_push_batch(pushes[start:start + EXPO_PUSH_BATCH_SIZE])
+    emails = [item for item in items if item["kind"] == "email"]
+    if emails:
+        _send_email_batch(emails)
+    return len(items)
+
+
+async def wait_for_notifications(timeout: float) -> None:
+    """Aguarda novas notificações (ou o timeout); chamado pelo worker."""
+    global _loop, _wakeup
+    if _wakeup is None or _loop is not asyncio.get_running_loop():
+        _loop = asyncio.get_running_loop()
+        _wakeup = asyncio.Event()
+    try:
+        await asyncio.wait_for(_wakeup.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    _wakeup.clear()
+
+
+def pending_notifications() -> int:
+    with _lock:
+        return len(_pending)
+
+
+def get_notification_dispatcher_stats() -> dict:
+    with _lock:
+        return {**_stats, "enabled": NOTIFICATION_DISPATCHER_ENABLED, "pending": len(_pending)}
+
+
+def clear_notification_queue() -> None:
+    with _lock:
+        _pending.clear()
+        _dedupe.clear()
@@ -0,0 +1,176 @@
+"""
+Hash e verificação de senhas (bcrypt) em um pool de processos dedicado.
+
+bcrypt consome ~200-300 ms de CPU por operação segurando o GIL em boa parte
+do tempo; executado nas threads da aplicação, uma rajada de logins deixa os
+demais endpoints sem threads livres. Aqui as operações vão para um
+ProcessPoolExecutor limitado: a thread chamadora apenas espera o resultado
+(sem o GIL) e chamadores async usam as variantes *_async.
+
+A fila é limitada por PASSWORD_HASH_MAX_PENDING; acima disso a requisição é
+recusada com 503 em vez de acumular latência. Com o pool desativado (padrão
+em TESTING) as operações rodam inline, como antes.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import bcrypt as _bcrypt
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+# passlib lê bcrypt.__about__, removido nas versões novas do pacote bcrypt
+if not hasattr(_bcrypt, "__about__"):
+    class _About:
+        __version__ = getattr(_bcrypt, "__version__", "unknown")
+    _bcrypt.__about__ = _About()
+
+# Fator de trabalho configurado; hashes com outro fator são refeitos no login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_POOL_ENABLED = os.getenv(
+    "PASSWORD_HASH_POOL_ENABLED", "false" if os.getenv("TESTING") else "true"
+).lower() == "true"
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 8)))
+# spawn evita fork de um processo com threads (locks herdados travados)
+PASSWORD_HASH_START_METHOD = os.getenv("PASSWORD_HASH_START_METHOD", "spawn")
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_pending = 0
+_stats = {"submitted": 0, "completed": 0, "rejected": 0, "rehashed": 0, "max_depth": 0}
+
+
+# ---- Executado nos processos do pool (funções de módulo, serializáveis) ----
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed: str) -> bool:
+    return pwd_context.verify(password, hashed)
+
+
+def _verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, hashed)
+
+
+# ---- Lado da aplicação ----
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=PASSWORD_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context(PASSWORD_HASH_START_METHOD),
+                )
+    return _pool
+
+
+def _release(_future: Future) -> None:
+    global _pending
+    with _stats_lock:
+        _pending -= 1
+        _stats["completed"] += 1
+
+
+def _submit(fn, *args) -> Future:
+    global _pending
+    with _stats_lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            _stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Servidor ocupado. Tente novamente em instantes."
+            )
+        _pending += 1
+        _stats["submitted"] += 1
+        _stats["max_depth"] = max(_stats["max_depth"], _pending)
+    try:
+        future = _get_pool().submit(fn, *args)
+    except Exception:
+        _release(None)
+        raise
+    future.add_done_callback(_release)
+    return future
+
+
+def hash_password(password: str) -> str:
+    if not PASSWORD_HASH_POOL_ENABLED:
+        return _hash(password)
+    return _submit(_hash, password).result()
+
+
+def verify_and_update_password(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifica a senha e, se o hash usa outro fator de trabalho, devolve o novo
+    hash em ``(valido, novo_hash)`` para o chamador gravar.
+    """
+    if not PASSWORD_HASH_POOL_ENABLED:
+        valid, new_hash = _verify_and_update(password, hashed)
+    else:
+        valid, new_hash = _submit(_verify_and_update, password, hashed).result()
+    if new_hash:
+        with _stats_lock:
+            _stats["rehashed"] += 1
+    return valid, new_hash
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    if not PASSWORD_HASH_POOL_ENABLED:
+        return _verify(password, hashed)
+    return _submit(_verify, password, hashed).result()
+
+
+async def hash_password_async(password: str) -> str:
+    if not PASSWORD_HASH_POOL_ENABLED:
+        return await asyncio.to_thread(_hash, password)
+    return await asyncio.wrap_future(_submit(_hash, password))
+
+
+async def verify_and_update_password_async(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    if not PASSWORD_HASH_POOL_ENABLED:
+        valid, new_hash = await asyncio.to_thread(_verify_and_update, password, hashed)
+    else:
+        valid, new_hash = await asyncio.wrap_future(_submit(_verify_and_update, password, hashed))
+    if new_hash:
+        with _stats_lock:
+            _stats["rehashed"] += 1
+    return valid, new_hash
+
+
+async def verify_password_async(password: str, hashed: str) -> bool:
+    if not PASSWORD_HASH_POOL_ENABLED:
+        return await asyncio.to_thread(_verify, password, hashed)
+    return await asyncio.wrap_future(_submit(_verify, password, hashed))
+
+
+def get_password_hasher_metrics() -> dict:
+    with _stats_lock:
+        return {
+            "enabled": PASSWORD_HASH_POOL_ENABLED,
+            "workers": PASSWORD_HASH_WORKERS,
+            "rounds": BCRYPT_ROUNDS,
+            "queue_depth": _pending,
+            "max_pending": PASSWORD_HASH_MAX_PENDING,
+            **_stats,
+        }
+
+
+def shutdown_password_hasher() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
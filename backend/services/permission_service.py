@@ -5,7 +5,9 @@ This service provides a centralized function to check permissions for users
 accessing resources in the multi-tenant system.
 """
 
-from typing import Optional, Dict, Any
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, NamedTuple
+from sqlalchemy import DateTime, Integer, JSON, String, cast, literal, null, select, union_all
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
 import sys
@@ -24,50 +26,116 @@ from utils.rbac import (
     has_permission
 )
 
+GRANT_TARGET = "target"
+GRANT_OWN = "own"
+GRANT_CAREGIVER = "caregiver"
+GRANT_SHARE = "share"
 
-def check_permission(
-    user: User,
-    action: str,
-    resource_owner_id: int,
-    db: Session,
-    resource_type: Optional[str] = None
-) -> bool:
+
+class DataShareGrant(NamedTuple):
+    to_profile_id: int
+    expires_at: Optional[datetime]
+    permissions: Optional[Dict[str, Any]]
+
+
+class AccessGrants(NamedTuple):
+    """Every access grant a user has on a target profile."""
+    target_in_family: bool
+    own_profile_id: Optional[int]
+    caregiver_access_level: Optional[str]
+    data_share: Optional[DataShareGrant]
+
+
+def _grants_statement(user: User, resource_owner_id: int):
     """
-    Centralized permission checking function.
-    
-    Checks if a user has permission to perform an action on a resource owned by another user.
-    
-    Args:
-        user: The user requesting access
-        action: The action to perform (view, edit, delete)
-        resource_owner_id: The profile_id that owns the resource
-        db: Database session
-        resource_type: Optional resource type (own_data, child_data, elder_data, etc.)
-    
-    Returns:
-        True if permission is granted, raises HTTPException(403) if denied
-    
-    Raises:
-        HTTPException: 403 if permission is denied
+    Single UNION ALL statement returning the rows relevant to the permission
+    decision: target profile in the user's family, profiles created by the
+    user, caregiver links and active data shares to the user's profiles.
+    """
+    no_int = cast(null(), Integer)
+    no_str = cast(null(), String)
+    no_date = cast(null(), DateTime(timezone=True))
+    no_json = cast(null(), JSON)
+
+    own_profiles = select(FamilyProfile.id).where(
+        FamilyProfile.family_id == user.family_id,
+        FamilyProfile.created_by == user.id
+    )
+    target = select(
+        literal(GRANT_TARGET).label("kind"), FamilyProfile.id.label("row_id"),
+        no_str.label("access_level"), no_int.label("to_profile_id"),
+        no_date.label("expires_at"), no_json.label("permissions")
+    ).where(
+        FamilyProfile.id == resource_owner_id,
+        FamilyProfile.family_id == user.family_id
+    )
+    own = select(
+        literal(GRANT_OWN), FamilyProfile.id, no_str, no_int, no_date, no_json
+    ).where(
+        FamilyProfile.family_id == user.family_id,
+        FamilyProfile.created_by == user.id
+    )
+    caregiver = select(
+        literal(GRANT_CAREGIVER), FamilyCaregiver.id, FamilyCaregiver.access_level, no_int, no_date, no_json
+    ).where(
+        FamilyCaregiver.profile_id == resource_owner_id,
+        FamilyCaregiver.caregiver_user_id == user.id
+    )
+    share = select(
+        literal(GRANT_SHARE), FamilyDataShare.id, no_str, FamilyDataShare.to_profile_id,
+        FamilyDataShare.expires_at, FamilyDataShare.permissions
+    ).where(
+        FamilyDataShare.family_id == user.family_id,
+        FamilyDataShare.from_profile_id == resource_owner_id,
+        FamilyDataShare.to_profile_id.in_(own_profiles),
+        FamilyDataShare.revoked_at.is_(None)
+    )
+    return union_all(target, own, caregiver, share)
+
+
+def load_access_grants(user: User, resource_owner_id: int, db: Session) -> AccessGrants:
+    """Load all grants of ``user`` on ``resource_owner_id`` with one query."""
+    rows = db.execute(_grants_statement(user, resource_owner_id)).all()
+    target_in_family = False
+    own_ids = []
+    caregivers = []
+    shares = []
+    for kind, row_id, access_level, to_profile_id, expires_at, permissions in rows:
+        if kind == GRANT_TARGET:
+            target_in_family = True
+        elif kind == GRANT_OWN:
+            own_ids.append(row_id)
+        elif kind == GRANT_CAREGIVER:
+            caregivers.append((row_id, access_level))
+        elif kind == GRANT_SHARE:
+            shares.append((row_id, DataShareGrant(to_profile_id, expires_at, permissions)))
+
+    # Same choice as the previous .first() lookups (lowest id)
+    own_profile_id = min(own_ids) if own_ids else None
+    caregiver_access_level = min(caregivers)[1] if caregivers else None
+    own_shares = sorted(
+        (share for share in shares if share[1].to_profile_id == own_profile_id),
+        key=lambda share: share[0]
+    )
+    data_share = own_shares[0][1] if own_shares else None
+    return AccessGrants(target_in_family, own_profile_id, caregiver_access_level, data_share)
+
+
+def decide_permission(user: User, action: str, resource_owner_id: int, grants: AccessGrants) -> bool:
+    """
+    Pure permission decision over the loaded grants.
+
+    Returns True if permission is granted, raises HTTPException(403) if denied.
     """
     # 1. Check if user is family_admin (full access)
     if user.account_type == ACCOUNT_TYPE_FAMILY_ADMIN:
         # Verify profile belongs to user's family
-        profile = db.query(FamilyProfile).filter(
-            FamilyProfile.id == resource_owner_id,
-            FamilyProfile.family_id == user.family_id
-        ).first()
-        if profile:
+        if grants.target_in_family:
             return True
         raise HTTPException(status_code=403, detail="Perfil não pertence à família")
     
     # 2. Check if it's own data
-    user_profile = db.query(FamilyProfile).filter(
-        FamilyProfile.family_id == user.family_id,
-        FamilyProfile.created_by == user.id
-    ).first()
-    
-    if user_profile and user_profile.id == resource_owner_id:
+    if grants.own_profile_id is not None and grants.own_profile_id == resource_owner_id:
         # Own data - check account type permissions
         if action == ACTION_VIEW:
             return True  # Users can always view their own data
@@ -84,77 +152,52 @@ def check_permission(
         return True
     
     # 3. Check if user is a caregiver for this profile
-    caregiver = db.query(FamilyCaregiver).filter(
-        FamilyCaregiver.profile_id == resource_owner_id,
-        FamilyCaregiver.caregiver_user_id == user.id
-    ).first()
-    
-    if caregiver:
+    if grants.caregiver_access_level is not None:
         # Verify profile belongs to same family
-        profile = db.query(FamilyProfile).filter(
-            FamilyProfile.id == resource_owner_id,
-            FamilyProfile.family_id == user.family_id
-        ).first()
-        if not profile:
+        if not grants.target_in_family:
             raise HTTPException(status_code=403, detail="Perfil não pertence à família")
         
         # Check if access level allows the action
-        if can_perform_action(caregiver.access_level, action):
+        if can_perform_action(grants.caregiver_access_level, action):
             return True
         raise HTTPException(
             status_code=403,
-            detail=f"Sem permissão para {action} (nível de acesso: {caregiver.access_level})"
+            detail=f"Sem permissão para {action} (nível de acesso: {grants.caregiver_access_level})"
         )
     
     # 4. Check data sharing (FamilyDataShare)
-    if user_profile:
-        data_share = db.query(FamilyDataShare).filter(
-            FamilyDataShare.family_id == user.family_id,
-            FamilyDataShare.from_profile_id == resource_owner_id,
-            FamilyDataShare.to_profile_id == user_profile.id,
-            FamilyDataShare.revoked_at.is_(None)
-        ).first()
+    data_share = grants.data_share
+    if data_share:
+        # Verify profile belongs to same family
+        if not grants.target_in_family:
+            raise HTTPException(status_code=403, detail="Perfil não pertence à família")
+        
+        # Check expiration
+        if data_share.expires_at and data_share.expires_at < datetime.now(timezone.utc):
+            raise HTTPException(status_code=403, detail="Compartilhamento expirado")
+        
+        # Check permissions in data_share
+        permissions = data_share.permissions or {}
+        
+        if action == ACTION_VIEW:
+            if permissions.get("can_view", False):
+                return True
+            raise HTTPException(status_code=403, detail="Sem permissão para visualizar")
+        
+        if action == ACTION_EDIT:
+            if permissions.get("can_edit", False):
+                return True
+            raise HTTPException(status_code=403, detail="Sem permissão para editar")
         
-        if data_share:
-            # Verify profile belongs to same family
-            profile = db.query(FamilyProfile).filter(
-                FamilyProfile.id == resource_owner_id,
-                FamilyProfile.family_id == user.family_id
-            ).first()
-            if not profile:
-                raise HTTPException(status_code=403, detail="Perfil não pertence à família")
-            
-            # Check expiration
-            from datetime import datetime, timezone
-            if data_share.expires_at and data_share.expires_at < datetime.now(timezone.utc):
-                raise HTTPException(status_code=403, detail="Compartilhamento expirado")
-            
-            # Check permissions in data_share
-            permissions = data_share.permissions or {}
-            
-            if action == ACTION_VIEW:
-                if permissions.get("can_view", False):
-                    return True
-                raise HTTPException(status_code=403, detail="Sem permissão para visualizar")
-            
-            if action == ACTION_EDIT:
-                if permissions.get("can_edit", False):
-                    return True
-                raise HTTPException(status_code=403, detail="Sem permissão para editar")
-            
-            if action == ACTION_DELETE:
-                if permissions.get("can_delete", False):
-                    return True
-                raise HTTPException(status_code=403, detail="Sem permissão para deletar")
+        if action == ACTION_DELETE:
+            if permissions.get("can_delete", False):
+                return True
+            raise HTTPException(status_code=403, detail="Sem permissão para deletar")
     
     # 5. Check if user can view family data (read-only access to other profiles)
     if action == ACTION_VIEW and has_permission(user.account_type, "can_view_family_data"):
         # Verify profile belongs to same family
-        profile = db.query(FamilyProfile).filter(
-            FamilyProfile.id == resource_owner_id,
-            FamilyProfile.family_id == user.family_id
-        ).first()
-        if profile:
+        if grants.target_in_family:
             return True
     
     # Permission denied
@@ -164,6 +207,42 @@ def check_permission(
     )
 
 
+def check_permission(
+    user: User,
+    action: str,
+    resource_owner_id: int,
+    db: Session,
+    resource_type: Optional[str] = None
+) -> bool:
+    """
+    Centralized permission checking function.
+    
+    Checks if a user has permission to perform an action on a resource owned by another user.
+    Grants come from the in-memory family graph when enabled, otherwise from a
+    single query (see load_access_grants); the decision runs in Python (see
+    decide_permission).
+    
+    Args:
+        user: The user requesting access
+        action: The action to perform (view, edit, delete)
+        resource_owner_id: The profile_id that owns the resource
+        db: Database session
+        resource_type: Optional resource type (own_data, child_data, elder_data, etc.)
+    
+    Returns:
+        True if permission is granted, raises HTTPException(403) if denied
+    
+    Raises:
+        HTTPException: 403 if permission is denied
+    """
+    from services.family_access_graph import FAMILY_GRAPH_ENABLED, get_graph_grants
+
+    grants = get_graph_grants(user, resource_owner_id, db) if FAMILY_GRAPH_ENABLED else None
+    if grants is None:
+        grants = load_access_grants(user, resource_owner_id, db)
+    return decide_permission(user, action, resource_owner_id, grants)
+
+
 def check_profile_access(
     user: User,
     profile_id: int,
@@ -6,7 +6,7 @@ from typing import Optional
 from datetime import datetime, timedelta, timezone
 import logging
 
-from config.redis_config import get_redis_client, is_redis_available
+from config.redis_config import get_redis_client, is_redis_available, record_redis_failure
 
 logger = logging.getLogger(__name__)
 
@@ -78,6 +78,7 @@ def check_email_rate_limit(
         
         return True, None
     except Exception as e:
+        record_redis_failure(e)
         logger.error(f"Erro ao verificar rate limit por email: {e}")
         # Em caso de erro, permitir (fail-open)
         return True, None
@@ -145,6 +146,7 @@ def check_user_email_daily_limit(user_id: int, max_emails: int = 10) -> tuple[bo
         
         return True, None
     except Exception as e:
+        record_redis_failure(e)
         logger.error(f"Erro ao verificar limite diário de emails: {e}")
         # Em caso de erro, permitir (fail-open)
         return True, None
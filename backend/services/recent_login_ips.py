@@ -0,0 +1,113 @@
+"""
+IPs recentes de login por usuário, para a detecção de login suspeito.
+
+Cada usuário tem um sorted set no Redis (IP -> último acesso, em segundos)
+aparado pela janela de retenção e limitado a RECENT_LOGIN_IPS_MAX_PER_USER
+IPs. "Houve login de outro IP na janela?" vira um ZCOUNT + ZSCORE em uma
+ida ao Redis, no lugar da consulta em user_login_events (que só cresce).
+
+log_login_event alimenta a estrutura. Sem Redis vale um LRU em memória do
+processo, alimentado sempre (também quando o Redis responde), de modo que
+uma queda do Redis não começa com o LRU frio.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from config.redis_config import get_redis_client, is_redis_available, record_redis_failure
+
+logger = logging.getLogger(__name__)
+
+RECENT_LOGIN_IPS_ENABLED = os.getenv(
+    "RECENT_LOGIN_IPS_ENABLED", "false" if os.getenv("TESTING") else "true"
+).lower() == "true"
+# Deve cobrir a maior janela consultada (SUSPICIOUS_LOGIN_WINDOW_MINUTES)
+RECENT_LOGIN_IPS_RETENTION_MINUTES = int(os.getenv("RECENT_LOGIN_IPS_RETENTION_MINUTES", "60"))
+RECENT_LOGIN_IPS_MAX_PER_USER = int(os.getenv("RECENT_LOGIN_IPS_MAX_PER_USER", "32"))
+RECENT_LOGIN_IPS_LRU_USERS = int(os.getenv("RECENT_LOGIN_IPS_LRU_USERS", "10000"))
+
+RECENT_LOGIN_IPS_PREFIX = "auth:recent_ips:"
+
+_lock = threading.Lock()
+# user_id -> {ip: último acesso}; ordem LRU dos usuários
+_local: "OrderedDict[int, Dict[str, float]]" = OrderedDict()
+
+
+def _key(user_id: int) -> str:
+    return f"{RECENT_LOGIN_IPS_PREFIX}{user_id}"
+
+
+def _record_local(user_id: int, ip_address: str, seen_at: float) -> None:
+    horizon = seen_at - RECENT_LOGIN_IPS_RETENTION_MINUTES * 60
+    with _lock:
+        ips = _local.pop(user_id, {})
+        ips[ip_address] = seen_at
+        ips = {ip: ts for ip, ts in ips.items() if ts > horizon}
+        if len(ips) > RECENT_LOGIN_IPS_MAX_PER_USER:
+            ips = dict(sorted(ips.items(), key=lambda item: item[1])[-RECENT_LOGIN_IPS_MAX_PER_USER:])
+        _local[user_id] = ips
+        while len(_local) > RECENT_LOGIN_IPS_LRU_USERS:
+            _local.popitem(last=False)
+
+
+def record_login_ip(user_id: int, ip_address: Optional[str], seen_at: Optional[float] = None) -> None:
+    """Registra o IP do login (chamado por log_login_event)."""
+    if not ip_address:
+        return
+    seen_at = seen_at or time.time()
+    _record_local(user_id, ip_address, seen_at)
+    if not is_redis_available():
+        return
+    try:
+        client = get_redis_client()
+        if client is None:
+            return
+        key = _key(user_id)
+        retention = RECENT_LOGIN_IPS_RETENTION_MINUTES * 60
+        pipe = client.pipeline(transaction=False)
+        pipe.zadd(key, {ip_address: seen_at})
+        pipe.zremrangebyscore(key, "-inf", seen_at - retention)
+        pipe.zremrangebyrank(key, 0, -(RECENT_LOGIN_IPS_MAX_PER_USER + 1))
+        pipe.expire(key, retention)
+        pipe.execute()
+    except Exception as e:
+        record_redis_failure(e)
+        logger.warning(f"Erro ao registrar IP recente do usuário {user_id}: {e}")
+
+
+def _other_ip_local(user_id: int, ip_address: str, cutoff: float) -> bool:
+    with _lock:
+        ips = _local.get(user_id)
+        if ips is None:
+            return False
+        _local.move_to_end(user_id)
+        return any(ts >= cutoff for ip, ts in ips.items() if ip != ip_address)
+
+
+def has_other_recent_ip(user_id: int, ip_address: Optional[str], window_minutes: int) -> bool:
+    """True se o usuário fez login de um IP diferente de ``ip_address`` na janela."""
+    if not ip_address:
+        return False
+    cutoff = time.time() - window_minutes * 60
+    if is_redis_available():
+        try:
+            client = get_redis_client()
+            if client is not None:
+                pipe = client.pipeline(transaction=False)
+                pipe.zcount(_key(user_id), cutoff, "+inf")
+                pipe.zscore(_key(user_id), ip_address)
+                in_window, own_score = pipe.execute()
+                own = 1 if own_score is not None and float(own_score) >= cutoff else 0
+                return int(in_window) - own > 0
+        except Exception as e:
+            record_redis_failure(e)
+            logger.warning(f"Erro ao consultar IPs recentes do usuário {user_id}: {e}")
+    return _other_ip_local(user_id, ip_address, cutoff)
+
+
+def clear_recent_login_ips() -> None:
+    with _lock:
+        _local.clear()
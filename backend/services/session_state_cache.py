@@ -0,0 +1,189 @@
+"""
+Cache do estado das sessões de dispositivo usado na autenticação.
+
+Cada requisição JWT com device_id precisava consultar UserSession apenas para
+saber se a sessão ativa existe e não está bloqueada. O registro compacto
+(sessão ativa, bloqueio, confiança e expiração da confiança) fica em dois
+níveis: memória do processo (TTL curto) e Redis (TTL maior, compartilhado
+entre workers). As escritas de session_service gravam o novo estado nos dois
+níveis após o commit (write-through).
+
+O preenchimento após um miss (read-through) nunca sobrescreve: o estado lido
+do banco pode ser anterior a uma revogação/bloqueio cujo write-through já
+chegou ao cache. Por isso ele usa SET NX (e só entra no nível local se não
+houver entrada), com TTL menor que o das escritas.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import timezone
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from config.redis_config import get_redis_client, is_redis_available, record_redis_failure
+
+logger = logging.getLogger(__name__)
+
+SESSION_STATE_CACHE_ENABLED = os.getenv(
+    "SESSION_STATE_CACHE_ENABLED", "false" if os.getenv("TESTING") else "true"
+).lower() == "true"
+# TTL do nível local; limita a defasagem entre processos após uma escrita
+SESSION_STATE_LOCAL_TTL_SECONDS = float(os.getenv("SESSION_STATE_LOCAL_TTL_SECONDS", "5"))
+SESSION_STATE_TTL_SECONDS = int(os.getenv("SESSION_STATE_TTL_SECONDS", "300"))
+# TTL das entradas preenchidas por leitura (read-through)
+SESSION_STATE_FILL_TTL_SECONDS = int(os.getenv("SESSION_STATE_FILL_TTL_SECONDS", "60"))
+SESSION_STATE_MAX_ENTRIES = int(os.getenv("SESSION_STATE_MAX_ENTRIES", "100000"))
+
+SESSION_STATE_PREFIX = "auth:session:"
+
+
+class SessionState(NamedTuple):
+    """Estado da sessão ativa (revoked_at IS NULL) de um dispositivo."""
+    session_id: Optional[int]
+    revoked: bool
+    blocked: bool
+    trusted: bool
+    trust_expires_at: Optional[float]
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.revoked and not self.blocked
+
+    @property
+    def is_trusted(self) -> bool:
+        if not self.trusted or self.revoked:
+            return False
+        return self.trust_expires_at is None or self.trust_expires_at >= time.time()
+
+
+# Dispositivo sem sessão ativa (nunca criada ou revogada)
+NO_ACTIVE_SESSION = SessionState(None, True, False, False, None)
+
+_lock = threading.Lock()
+_local: Dict[Tuple[int, str], Tuple[SessionState, float]] = {}
+_stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "writes": 0, "fills": 0, "fills_skipped": 0}
+
+
+def state_from_session(session) -> SessionState:
+    """Projeta um models.UserSession (ou None) no registro compacto."""
+    if session is None or session.revoked_at is not None:
+        return NO_ACTIVE_SESSION
+    expires_at = session.trust_expires_at
+    if expires_at is not None and expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return SessionState(
+        session_id=session.id,
+        revoked=False,
+        blocked=bool(session.blocked),
+        trusted=bool(session.trusted),
+        trust_expires_at=expires_at.timestamp() if expires_at is not None else None,
+    )
+
+
+def _redis_key(user_id: int, device_id: str) -> str:
+    return f"{SESSION_STATE_PREFIX}{user_id}:{device_id}"
+
+
+def _store_local(key: Tuple[int, str], state: SessionState, only_if_absent: bool = False) -> None:
+    now = time.monotonic()
+    with _lock:
+        if only_if_absent:
+            current = _local.get(key)
+            if current is not None and current[1] > now:
+                return
+        if len(_local) >= SESSION_STATE_MAX_ENTRIES:
+            _local.pop(next(iter(_local)))
+        _local[key] = (state, now + SESSION_STATE_LOCAL_TTL_SECONDS)
+
+
+def get_cached_session_state(user_id: int, device_id: str) -> Optional[SessionState]:
+    """Retorna o estado em cache (local, depois Redis) ou None."""
+    key = (user_id, device_id)
+    with _lock:
+        cached = _local.get(key)
+        if cached is not None:
+            if cached[1] > time.monotonic():
+                _stats["local_hits"] += 1
+                return cached[0]
+            del _local[key]
+
+    if is_redis_available():
+        try:
+            client = get_redis_client()
+            raw = client.get(_redis_key(user_id, device_id)) if client is not None else None
+            if raw is not None:
+                state = SessionState(*json.loads(raw))
+                _store_local(key, state)
+                _stats["redis_hits"] += 1
+                return state
+        except Exception as e:
+            record_redis_failure(e)
+            logger.warning(f"Erro ao ler estado da sessão {user_id}/{device_id}: {e}")
+
+    _stats["misses"] += 1
+    return None
+
+
+def cache_session_state(user_id: int, device_id: str, state: SessionState) -> SessionState:
+    """Grava o estado nos dois níveis. Chamar após o commit da alteração."""
+    _store_local((user_id, device_id), state)
+    with _lock:
+        _stats["writes"] += 1
+    if is_redis_available():
+        try:
+            client = get_redis_client()
+            if client is not None:
+                client.setex(_redis_key(user_id, device_id), SESSION_STATE_TTL_SECONDS, json.dumps(state))
+        except Exception as e:
+            record_redis_failure(e)
+            logger.warning(f"Erro ao gravar estado da sessão {user_id}/{device_id}: {e}")
+    return state
+
+
+def fill_session_state(user_id: int, device_id: str, state: SessionState) -> SessionState:
+    """
+    Preenche o cache com o estado lido do banco após um miss. Não sobrescreve
+    um estado gravado por uma escrita concorrente (SET NX).
+    """
+    if is_redis_available():
+        try:
+            client = get_redis_client()
+            if client is not None and not client.set(
+                _redis_key(user_id, device_id), json.dumps(state), ex=SESSION_STATE_FILL_TTL_SECONDS, nx=True
+            ):
+                # Uma escrita chegou antes: o estado lido pode estar defasado
+                with _lock:
+                    _stats["fills_skipped"] += 1
+                return state
+        except Exception as e:
+            record_redis_failure(e)
+            logger.warning(f"Erro ao preencher estado da sessão {user_id}/{device_id}: {e}")
+    _store_local((user_id, device_id), state, only_if_absent=True)
+    with _lock:
+        _stats["fills"] += 1
+    return state
+
+
+def invalidate_session_state(user_id: int, device_id: str) -> None:
+    """Remove o estado dos dois níveis; a próxima leitura volta ao banco."""
+    with _lock:
+        _local.pop((user_id, device_id), None)
+    if is_redis_available():
+        try:
+            client = get_redis_client()
+            if client is not None:
+                client.delete(_redis_key(user_id, device_id))
+        except Exception as e:
+            record_redis_failure(e)
+            logger.warning(f"Erro ao invalidar estado da sessão {user_id}/{device_id}: {e}")
+
+
+def get_session_state_cache_stats() -> dict:
+    with _lock:
+        return {**_stats, "local_entries": len(_local)}
+
+
+def clear_session_state_cache() -> None:
+    with _lock:
+        _local.clear()
@@ -1,17 +1,126 @@
 """
 Serviço para gerenciar blacklist de tokens JWT em Redis.
 Permite logout imediato invalidando tokens antes da expiração.
+
+Cada processo mantém um espelho local dos hashes revogados, sincronizado
+por versão: toda alteração incrementa ``blacklist:version`` e registra o
+hash em ``blacklist:index`` (ZSET com score = expiração). O espelho relê o
+índice quando a versão muda, no máximo a cada BLACKLIST_SYNC_SECONDS, e o
+caso comum (token não revogado) é respondido em memória; o Redis só é
+consultado quando o hash está no espelho ou quando o espelho está defasado.
 """
 import logging
 import hashlib
-from typing import Optional
+import os
+import threading
+import time
+from typing import Dict, Optional
 from datetime import datetime, timezone, timedelta
-from config.redis_config import get_redis_client, is_redis_available
+from config.redis_config import get_redis_client, is_redis_available, record_redis_failure
 
 logger = logging.getLogger(__name__)
 
 # Prefixo para chaves Redis
 BLACKLIST_PREFIX = "blacklist:token:"
+BLACKLIST_INDEX_KEY = "blacklist:index"
+BLACKLIST_VERSION_KEY = "blacklist:version"
+
+BLACKLIST_MIRROR_ENABLED = os.getenv(
+    "BLACKLIST_MIRROR_ENABLED", "false" if os.getenv("TESTING") else "true"
+).lower() == "true"
+# Intervalo entre leituras da versão no Redis
+BLACKLIST_SYNC_SECONDS = float(os.getenv("BLACKLIST_SYNC_SECONDS", "1"))
+# Sem sincronização bem-sucedida dentro deste prazo o espelho não é usado
+BLACKLIST_MAX_STALENESS_SECONDS = float(os.getenv("BLACKLIST_MAX_STALENESS_SECONDS", "10"))
+SCAN_BATCH_SIZE = 500
+
+
+class _BlacklistMirror:
+    """Cópia local dos hashes revogados (hash -> expiração em epoch)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hashes: Dict[str, float] = {}
+        self.version: Optional[int] = None
+        self.synced_at = 0.0
+        self.attempted_at = 0.0
+
+    def reset(self) -> None:
+        with self.lock:
+            self.hashes = {}
+            self.version = None
+            self.synced_at = 0.0
+            self.attempted_at = 0.0
+
+    def is_fresh(self, now: float) -> bool:
+        return self.version is not None and now - self.synced_at < BLACKLIST_MAX_STALENESS_SECONDS
+
+    def sync(self, redis_client) -> None:
+        """Relê o índice se a versão publicada mudou."""
+        now = time.monotonic()
+        self.attempted_at = now
+        raw_version = redis_client.get(BLACKLIST_VERSION_KEY)
+        version = int(raw_version) if raw_version is not None else 0
+        if version != self.version:
+            epoch = time.time()
+            # Podar entradas expiradas antes de recarregar
+            redis_client.zremrangebyscore(BLACKLIST_INDEX_KEY, "-inf", epoch)
+            entries = redis_client.zrangebyscore(BLACKLIST_INDEX_KEY, epoch, "+inf", withscores=True)
+            hashes = {
+                (member.decode() if isinstance(member, bytes) else member): float(score)
+                for member, score in entries
+            }
+            with self.lock:
+                self.hashes = hashes
+                self.version = version
+        self.synced_at = now
+
+    def contains(self, token_hash: str) -> bool:
+        expires_at = self.hashes.get(token_hash)
+        return expires_at is not None and expires_at > time.time()
+
+    def add(self, token_hash: str, expires_at: float) -> None:
+        with self.lock:
+            self.hashes[token_hash] = expires_at
+
+    def discard(self, token_hash: str) -> None:
+        with self.lock:
+            self.hashes.pop(token_hash, None)
+
+
+_mirror = _BlacklistMirror()
+
+
+def _mirror_is_usable() -> bool:
+    """Sincroniza o espelho quando necessário; False se ele não é confiável."""
+    now = time.monotonic()
+    if now - _mirror.synced_at < BLACKLIST_SYNC_SECONDS and _mirror.version is not None:
+        return True
+    if now - _mirror.attempted_at >= BLACKLIST_SYNC_SECONDS:
+        try:
+            if is_redis_available():
+                redis_client = get_redis_client()
+                if redis_client is not None:
+                    _mirror.sync(redis_client)
+        except Exception as e:
+            record_redis_failure(e)
+            logger.warning(f"Erro ao sincronizar espelho da blacklist: {e}")
+    return _mirror.is_fresh(now)
+
+
+def get_blacklist_mirror_stats() -> dict:
+    now = time.monotonic()
+    return {
+        "enabled": BLACKLIST_MIRROR_ENABLED,
+        "version": _mirror.version,
+        "entries": len(_mirror.hashes),
+        "fresh": _mirror.is_fresh(now),
+        "seconds_since_sync": round(now - _mirror.synced_at, 3) if _mirror.synced_at else None,
+    }
+
+
+def reset_blacklist_mirror() -> None:
+    _mirror.reset()
 
 
 def _hash_token(token: str) -> str:
@@ -42,8 +151,17 @@ def add_to_blacklist(token: str, expires_in_seconds: int) -> bool:
         token_hash = _hash_token(token)
         key = f"{BLACKLIST_PREFIX}{token_hash}"
         
-        # Armazenar com TTL igual ao tempo de expiração do token
-        redis_client.setex(key, expires_in_seconds, "1")
+        # Chave com TTL igual ao tempo de expiração do token, índice e versão
+        # em uma única transação (MULTI/EXEC): os espelhos nunca veem a chave
+        # sem o índice nem o índice sem a versão nova
+        expires_at = time.time() + expires_in_seconds
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.setex(key, expires_in_seconds, "1")
+        pipe.zadd(BLACKLIST_INDEX_KEY, {token_hash: expires_at})
+        pipe.incr(BLACKLIST_VERSION_KEY)
+        pipe.execute()
+        # Espelho local só depois da confirmação do Redis
+        _mirror.add(token_hash, expires_at)
         
         logger.info(f"Token adicionado à blacklist (expira em {expires_in_seconds}s)")
         return True
@@ -63,6 +181,11 @@ def is_blacklisted(token: str) -> bool:
     Returns:
         True se token está na blacklist, False caso contrário
     """
+    token_hash = _hash_token(token)
+    # Caso comum: espelho sincronizado e hash ausente, sem ida ao Redis
+    if BLACKLIST_MIRROR_ENABLED and _mirror_is_usable() and not _mirror.contains(token_hash):
+        return False
+
     if not is_redis_available():
         # Se Redis não estiver disponível, não podemos verificar blacklist
         # Retornar False para não bloquear requisições legítimas
@@ -73,7 +196,6 @@ def is_blacklisted(token: str) -> bool:
         if redis_client is None:
             return False
         
-        token_hash = _hash_token(token)
         key = f"{BLACKLIST_PREFIX}{token_hash}"
         
         # Verificar se chave existe
@@ -81,6 +203,7 @@ def is_blacklisted(token: str) -> bool:
         return bool(exists)
         
     except Exception as e:
+        record_redis_failure(e)
         logger.error(f"Erro ao verificar blacklist: {e}")
         # Em caso de erro, retornar False para não bloquear requisições
         return False
@@ -107,7 +230,13 @@ def remove_from_blacklist(token: str) -> bool:
         token_hash = _hash_token(token)
         key = f"{BLACKLIST_PREFIX}{token_hash}"
         
-        deleted = redis_client.delete(key)
+        # Chave, índice e versão na mesma transação, como em add_to_blacklist
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.zrem(BLACKLIST_INDEX_KEY, token_hash)
+        pipe.incr(BLACKLIST_VERSION_KEY)
+        deleted = pipe.execute()[0]
+        _mirror.discard(token_hash)
         return bool(deleted)
         
     except Exception as e:
@@ -130,16 +259,26 @@ def clear_all_blacklist() -> int:
         if redis_client is None:
             return 0
         
-        # Buscar todas as chaves com prefixo blacklist
+        # Percorrer com SCAN (não bloqueia o Redis como KEYS) e deletar em lotes
         pattern = f"{BLACKLIST_PREFIX}*"
-        keys = redis_client.keys(pattern)
-        
-        if not keys:
-            return 0
-        
-        # Deletar todas as chaves
-        deleted = redis_client.delete(*keys)
-        logger.info(f"Removidos {deleted} tokens da blacklist")
+        deleted = 0
+        batch = []
+        for key in redis_client.scan_iter(match=pattern, count=SCAN_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) >= SCAN_BATCH_SIZE:
+                deleted += redis_client.delete(*batch)
+                batch = []
+        if batch:
+            deleted += redis_client.delete(*batch)
+
+        pipe = redis_client.pipeline()
+        pipe.delete(BLACKLIST_INDEX_KEY)
+        pipe.incr(BLACKLIST_VERSION_KEY)
+        pipe.execute()
+        _mirror.reset()
+
+        if deleted:
+            logger.info(f"Removidos {deleted} tokens da blacklist")
         return deleted
         
     except Exception as e:
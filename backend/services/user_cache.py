@@ -0,0 +1,106 @@
+"""
+Cache da projeção de usuário usada na autenticação.
+
+Guarda apenas os campos que a autenticação consulta (id, family_id,
+account_type, role, is_active, email_verified) em dois níveis: memória do
+processo (TTL curto) e Redis (TTL maior, compartilhado entre workers). Os
+caminhos que alteram usuários chamam invalidate_user_cache após o commit.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from config.redis_config import get_redis_client, is_redis_available
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_ENABLED = os.getenv(
+    "USER_CACHE_ENABLED", "false" if os.getenv("TESTING") else "true"
+).lower() == "true"
+# TTL do nível local; limita a defasagem entre processos após uma invalidação
+USER_CACHE_LOCAL_TTL_SECONDS = float(os.getenv("USER_CACHE_LOCAL_TTL_SECONDS", "5"))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "50000"))
+
+USER_CACHE_PREFIX = "auth:user:"
+USER_PROJECTION_FIELDS = ("id", "family_id", "account_type", "role", "is_active", "email_verified")
+
+_lock = threading.Lock()
+_local: Dict[int, Tuple[dict, float]] = {}
+_stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _store_local(user_id: int, projection: dict) -> None:
+    with _lock:
+        if len(_local) >= USER_CACHE_MAX_ENTRIES:
+            _local.pop(next(iter(_local)))
+        _local[user_id] = (projection, time.monotonic() + USER_CACHE_LOCAL_TTL_SECONDS)
+
+
+def get_cached_user(user_id: int) -> Optional[dict]:
+    """Retorna a projeção em cache (local, depois Redis) ou None."""
+    with _lock:
+        cached = _local.get(user_id)
+        if cached is not None:
+            if cached[1] > time.monotonic():
+                _stats["local_hits"] += 1
+                return cached[0]
+            del _local[user_id]
+
+    if is_redis_available():
+        try:
+            client = get_redis_client()
+            raw = client.get(f"{USER_CACHE_PREFIX}{user_id}") if client is not None else None
+            if raw is not None:
+                projection = json.loads(raw)
+                _store_local(user_id, projection)
+                _stats["redis_hits"] += 1
+                return projection
+        except Exception as e:
+            logger.warning(f"Erro ao ler cache do usuário {user_id}: {e}")
+
+    _stats["misses"] += 1
+    return None
+
+
+def cache_user(user) -> dict:
+    """Grava a projeção do usuário nos dois níveis."""
+    projection = {field: getattr(user, field) for field in USER_PROJECTION_FIELDS}
+    _store_local(projection["id"], projection)
+    if is_redis_available():
+        try:
+            client = get_redis_client()
+            if client is not None:
+                client.setex(f"{USER_CACHE_PREFIX}{projection['id']}", USER_CACHE_TTL_SECONDS, json.dumps(projection))
+        except Exception as e:
+            logger.warning(f"Erro ao gravar cache do usuário {projection['id']}: {e}")
+    return projection
+
+
+def invalidate_user_cache(user_id: Optional[int]) -> None:
+    """Remove o usuário dos dois níveis. Chamar após o commit da alteração."""
+    if user_id is None:
+        return
+    with _lock:
+        _local.pop(user_id, None)
+        _stats["invalidations"] += 1
+    if is_redis_available():
+        try:
+            client = get_redis_client()
+            if client is not None:
+                client.delete(f"{USER_CACHE_PREFIX}{user_id}")
+        except Exception as e:
+            logger.warning(f"Erro ao invalidar cache do usuário {user_id}: {e}")
+
+
+def get_user_cache_stats() -> dict:
+    with _lock:
+        return {**_stats, "local_entries": len(_local)}
+
+
+def clear_user_cache() -> None:
+    with _lock:
+        _local.clear()
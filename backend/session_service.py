@@ -6,6 +6,20 @@ from sqlalchemy.orm import Session
 
 import models
 import schemas
+from services.session_state_cache import (
+    NO_ACTIVE_SESSION,
+    SessionState,
+    cache_session_state,
+    fill_session_state,
+    get_cached_session_state,
+    invalidate_session_state,
+    state_from_session,
+)
+import services.session_state_cache as session_state_cache
+from services.activity_buffer import record_session_activity
+import services.activity_buffer as activity_buffer
+from services.recent_login_ips import record_login_ip
+import services.recent_login_ips as recent_login_ips
 
 TRUST_DEVICE_DAYS = int(os.getenv("TRUST_DEVICE_DAYS", "90"))
 
@@ -20,6 +34,37 @@ def _apply_trust_expiration(session: models.UserSession) -> None:
         session.trust_expires_at = None
 
 
+def _active_session(db: Session, user_id: int, device_id: str) -> Optional[models.UserSession]:
+    return db.query(models.UserSession).filter(
+        models.UserSession.user_id == user_id,
+        models.UserSession.device_id == device_id,
+        models.UserSession.revoked_at.is_(None)
+    ).first()
+
+
+def refresh_session_state(session: Optional[models.UserSession]) -> None:
+    """Grava no cache o estado de uma sessão já commitada (write-through)."""
+    if not session_state_cache.SESSION_STATE_CACHE_ENABLED or session is None or not session.device_id:
+        return
+    if session.revoked_at is not None:
+        # Uma sessão revogada não representa o dispositivo: pode haver outra ativa
+        invalidate_session_state(session.user_id, session.device_id)
+        return
+    cache_session_state(session.user_id, session.device_id, state_from_session(session))
+
+
+def get_session_state(db: Session, user_id: int, device_id: str) -> SessionState:
+    """Estado da sessão ativa do dispositivo, do cache quando possível."""
+    if session_state_cache.SESSION_STATE_CACHE_ENABLED:
+        state = get_cached_session_state(user_id, device_id)
+        if state is not None:
+            return state
+    state = state_from_session(_active_session(db, user_id, device_id))
+    if session_state_cache.SESSION_STATE_CACHE_ENABLED:
+        fill_session_state(user_id, device_id, state)
+    return state
+
+
 def is_device_blocked(
     db: Session,
     user_id: int,
@@ -27,12 +72,7 @@ def is_device_blocked(
 ) -> bool:
     if not device_id:
         return False
-    session = db.query(models.UserSession).filter(
-        models.UserSession.user_id == user_id,
-        models.UserSession.device_id == device_id,
-        models.UserSession.revoked_at.is_(None)
-    ).first()
-    return bool(session and session.blocked)
+    return get_session_state(db, user_id, device_id).blocked
 
 
 def upsert_session(
@@ -40,16 +80,31 @@ def upsert_session(
     user_id: int,
     device: Optional[schemas.DeviceInfo],
     ip_address: Optional[str],
-    user_agent: Optional[str]
+    user_agent: Optional[str],
+    commit: bool = True
 ) -> Tuple[Optional[models.UserSession], bool]:
+    """
+    Cria ou atualiza a sessão ativa do dispositivo.
+
+    Com commit=False a sessão fica na transação do chamador, que após o commit
+    deve chamar refresh_session_state (e, com write-behind, registrar a
+    atividade de sessões existentes).
+    """
     if not device or not device.device_id:
         return None, False
 
-    session = db.query(models.UserSession).filter(
-        models.UserSession.user_id == user_id,
-        models.UserSession.device_id == device.device_id,
-        models.UserSession.revoked_at.is_(None)
-    ).first()
+    session = None
+    state = (
+        get_cached_session_state(user_id, device.device_id)
+        if session_state_cache.SESSION_STATE_CACHE_ENABLED else None
+    )
+    if state is None:
+        session = _active_session(db, user_id, device.device_id)
+    elif state.session_id is not None:
+        # Busca por PK (identity map) em vez do filtro por usuário/dispositivo
+        session = db.get(models.UserSession, state.session_id)
+        if session is None or session.revoked_at is not None:
+            session = _active_session(db, user_id, device.device_id)
 
     is_new = False
     if not session:
@@ -76,11 +131,26 @@ def upsert_session(
         session.location_accuracy_km = device.location_accuracy_km
     session.ip_address = ip_address or session.ip_address
     session.user_agent = user_agent or session.user_agent
-    session.last_activity_at = _now()
+
+    write_behind = activity_buffer.ACTIVITY_WRITE_BEHIND_ENABLED and not is_new
+    if not write_behind:
+        session.last_activity_at = _now()
+    if not commit:
+        db.add(session)
+        return session, is_new
+
+    if write_behind:
+        # Sem mudanças além da atividade: nenhum commit, só o buffer write-behind
+        if db.is_modified(session):
+            db.commit()
+            refresh_session_state(session)
+        record_session_activity(session)
+        return session, is_new
 
     db.add(session)
     db.commit()
     db.refresh(session)
+    refresh_session_state(session)
     return session, is_new
 
 
@@ -108,6 +178,7 @@ def mark_session_trusted(
     db.add(session)
     db.commit()
     db.refresh(session)
+    refresh_session_state(session)
     return session
 
 
@@ -135,6 +206,7 @@ def mark_session_blocked(
     db.add(session)
     db.commit()
     db.refresh(session)
+    refresh_session_state(session)
     return session
 
 
@@ -163,6 +235,10 @@ def revoke_sessions(
         _apply_trust_expiration(session)
         session.revoked_at = _now()
     db.commit()
+    if session_state_cache.SESSION_STATE_CACHE_ENABLED:
+        for session in sessions:
+            if session.device_id:
+                cache_session_state(user_id, session.device_id, NO_ACTIVE_SESSION)
     return len(sessions)
 
 
@@ -171,7 +247,8 @@ def log_login_event(
     user_id: int,
     device_id: Optional[str],
     ip_address: Optional[str],
-    user_agent: Optional[str]
+    user_agent: Optional[str],
+    commit: bool = True
 ) -> models.UserLoginEvent:
     event = models.UserLoginEvent(
         user_id=user_id,
@@ -181,6 +258,9 @@ def log_login_event(
         created_at=_now()
     )
     db.add(event)
-    db.commit()
-    db.refresh(event)
+    if recent_login_ips.RECENT_LOGIN_IPS_ENABLED:
+        record_login_ip(user_id, ip_address, event.created_at.timestamp())
+    if commit:
+        db.commit()
+        db.refresh(event)
     return event
@@ -0,0 +1,70 @@
+"""
+Testes do buffer write-behind de last_activity_at / last_login_at.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import models
+import schemas
+import services.activity_buffer as activity_buffer
+from services.activity_buffer import (
+    clear_activity_buffer,
+    flush_activity,
+    pending_activity_count,
+    record_session_activity,
+    record_user_login,
+)
+from session_service import upsert_session
+
+
+@pytest.fixture
+def write_behind(monkeypatch):
+    monkeypatch.setattr(activity_buffer, "ACTIVITY_WRITE_BEHIND_ENABLED", True)
+    clear_activity_buffer()
+    yield
+    clear_activity_buffer()
+
+
+def _as_utc(value):
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class TestActivityBuffer:
+    """Testes do buffer de timestamps de atividade"""
+
+    def test_repeated_logins_coalesce_into_one_update(self, write_behind, test_user, db_session, statements):
+        device = schemas.DeviceInfo(device_id="device-1")
+        session, _ = upsert_session(db_session, test_user.id, device, "10.0.0.1", "pytest")
+        latest = datetime.now(timezone.utc) + timedelta(minutes=5)
+        statements.clear()
+
+        for _ in range(3):
+            upsert_session(db_session, test_user.id, device, "10.0.0.1", "pytest")
+            record_user_login(test_user)
+        record_session_activity(session, latest)
+
+        assert not any(stmt.startswith("UPDATE") for stmt in statements)
+        assert pending_activity_count() == 2
+        assert flush_activity(db_session) == 2
+        assert sum(stmt.startswith("UPDATE") for stmt in statements) == 2
+
+        db_session.expire_all()
+        assert _as_utc(db_session.get(models.UserSession, session.id).last_activity_at) == latest
+        assert db_session.get(models.User, test_user.id).last_login_at is not None
+
+    def test_changed_device_info_still_commits(self, write_behind, test_user, db_session):
+        upsert_session(db_session, test_user.id, schemas.DeviceInfo(device_id="device-1"), None, None)
+        upsert_session(db_session, test_user.id, schemas.DeviceInfo(device_id="device-1", device_name="Novo"), None, None)
+        db_session.expire_all()
+        stored = db_session.query(models.UserSession).filter_by(device_id="device-1").one()
+        assert stored.device_name == "Novo"
+
+    def test_flush_when_buffer_is_full(self, write_behind, test_user, db_session, monkeypatch):
+        monkeypatch.setattr(activity_buffer, "ACTIVITY_FLUSH_MAX_ENTRIES", 1)
+        monkeypatch.setattr(activity_buffer, "SessionLocal", lambda: db_session)
+        monkeypatch.setattr(db_session, "close", lambda: None)
+        record_user_login(test_user)
+        assert pending_activity_count() == 0
+        db_session.expire_all()
+        assert db_session.get(models.User, test_user.id).last_login_at is not None
@@ -0,0 +1,157 @@
+"""
+Testes dos middlewares ASGI puros (headers de segurança, CSRF, validação).
+"""
+import asyncio
+import json
+
+from fastapi import FastAPI
+from pydantic import BaseModel
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from middleware.csrf_middleware import CSRFMiddleware
+from middleware.path_matching import PrefixTrie
+from middleware.security_headers_middleware import DEFAULT_CSP, DOCS_CSP, SecurityHeadersMiddleware
+from middleware.validation_middleware import (
+    VALIDATED_JSON_STATE,
+    ValidatedJSONRoute,
+    ValidationMiddleware,
+)
+from utils.validation import MAX_PAYLOAD_SIZE_KB
+
+
+async def echo(request):
+    if request.method == "POST":
+        return JSONResponse(request.scope["state"][VALIDATED_JSON_STATE])
+    return PlainTextResponse("ok", headers={"X-Frame-Options": "SAMEORIGIN"})
+
+
+def _client(*middlewares):
+    app = Starlette(routes=[
+        Route("/api/family/profiles", echo, methods=["GET", "POST"]),
+        Route("/docs", echo),
+    ])
+    for middleware in middlewares:
+        app.add_middleware(middleware)
+    return TestClient(app)
+
+
+class TestPrefixTrie:
+    """Testes do casamento de prefixos"""
+
+    def test_matches_prefixes(self):
+        trie = PrefixTrie(["/api/auth/", "/health", "/api/csrf-token"])
+        assert trie.matches("/api/auth/login")
+        assert trie.matches("/health")
+        assert trie.matches("/healthz")
+        assert not trie.matches("/api/au")
+        assert not trie.matches("/api/family/profiles")
+        assert not trie.matches("")
+
+    def test_empty_prefix_matches_everything(self):
+        assert PrefixTrie([""]).matches("/qualquer")
+        assert not PrefixTrie([]).matches("/qualquer")
+
+
+class TestSecurityHeadersMiddleware:
+    """Testes dos headers de segurança pré-computados"""
+
+    def test_default_headers_replace_existing(self):
+        response = _client(SecurityHeadersMiddleware).get("/api/family/profiles")
+        assert response.headers["content-security-policy"] == DEFAULT_CSP
+        assert response.headers["x-content-type-options"] == "nosniff"
+        assert response.headers.get_list("x-frame-options") == ["DENY"]
+
+    def test_docs_csp(self):
+        response = _client(SecurityHeadersMiddleware).get("/docs")
+        assert response.headers["content-security-policy"] == DOCS_CSP
+
+
+class TestASGIRequestMiddlewares:
+    """Testes de CSRF e validação sem BaseHTTPMiddleware"""
+
+    def test_csrf_missing_token_returns_403(self):
+        response = _client(CSRFMiddleware).post("/api/family/profiles", json={"name": "x"})
+        assert response.status_code == 403
+        assert response.json() == {"detail": "CSRF token missing"}
+
+    def test_csrf_get_passes_through(self):
+        assert _client(CSRFMiddleware).get("/api/family/profiles").status_code == 200
+
+    def test_validation_replays_sanitized_body(self):
+        response = _client(ValidationMiddleware).post(
+            "/api/family/profiles", json={"name": "  Maria\x00   Silva  "}
+        )
+        assert response.status_code == 200
+        assert response.json() == {"name": "Maria Silva"}
+
+
+class ProfilePayload(BaseModel):
+    name: str
+
+
+def _fastapi_client():
+    app = FastAPI()
+    app.router.route_class = ValidatedJSONRoute
+
+    @app.post("/api/family/profiles")
+    def create_profile(payload: ProfilePayload):
+        return {"name": payload.name}
+
+    app.add_middleware(ValidationMiddleware)
+    return TestClient(app)
+
+
+class TestStreamingValidation:
+    """Testes do limite de tamanho por streaming e reuso do JSON parseado"""
+
+    def test_route_receives_sanitized_payload_without_reparsing(self, monkeypatch):
+        calls = []
+        original_loads = json.loads
+        monkeypatch.setattr(json, "loads", lambda *a, **k: calls.append(1) or original_loads(*a, **k))
+        client = _fastapi_client()
+        response = client.post("/api/family/profiles", json={"name": "  Maria\x00   Silva "})
+        # Apenas o middleware parseia o corpo
+        assert len(calls) == 1
+        assert response.status_code == 200
+        assert response.json() == {"name": "Maria Silva"}
+
+    def test_content_length_over_limit_rejected_before_reading(self):
+        max_bytes = MAX_PAYLOAD_SIZE_KB * 1024
+        received = []
+
+        async def receive():
+            received.append(1)
+            return {"type": "http.request", "body": b"{}", "more_body": False}
+
+        response = self._call(receive, headers=[(b"content-length", str(max_bytes + 1).encode())])
+        assert response["status"] == 413
+        assert received == []
+
+    def test_streamed_body_over_limit_rejected_early(self):
+        chunk = b"x" * (256 * 1024)
+        received = []
+
+        async def receive():
+            received.append(1)
+            return {"type": "http.request", "body": chunk, "more_body": True}
+
+        response = self._call(receive, headers=[])
+        assert response["status"] == 413
+        assert len(received) == MAX_PAYLOAD_SIZE_KB * 1024 // len(chunk) + 1
+
+    @staticmethod
+    def _call(receive, headers):
+        messages = []
+
+        async def app(scope, receive, send):
+            raise AssertionError("aplicação não deveria ser chamada")
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": "/api/family/profiles", "headers": headers}
+        asyncio.run(ValidationMiddleware(app)(scope, receive, send))
+        return messages[0]
@@ -0,0 +1,82 @@
+"""
+Testes para o modo de leitura assíncrona do banco.
+"""
+import asyncio
+from unittest.mock import patch
+
+from fastapi import status
+from sqlalchemy import select
+
+import database
+from models import Medication
+
+
+class TestAsyncDatabaseUrl:
+    """Testes de conversão de URL para drivers assíncronos"""
+
+    def test_postgres_uses_asyncpg(self):
+        url = database.get_async_database_url("postgresql://u:p@localhost:5432/db")
+        assert url == "postgresql+asyncpg://u:p@localhost:5432/db"
+
+    def test_sqlite_uses_aiosqlite(self):
+        url = database.get_async_database_url("sqlite:///./test.db")
+        assert url == "sqlite+aiosqlite:///./test.db"
+
+    def test_async_url_is_kept(self):
+        url = "postgresql+asyncpg://u:p@localhost/db"
+        assert database.get_async_database_url(url) == url
+
+
+class TestThreadpoolSession:
+    """Testes do fallback síncrono em threadpool"""
+
+    def test_execute_returns_buffered_result(self, db_session, test_profile):
+        """Resultado é materializado antes de voltar ao event loop"""
+        db_session.add(Medication(name="Dipirona", schedules=["08:00"], profile_id=test_profile.id))
+        db_session.commit()
+
+        session = database.ThreadpoolSession(db_session)
+        result = asyncio.run(session.execute(
+            select(Medication).where(Medication.profile_id == test_profile.id)
+        ))
+        names = [m.name for m in result.scalars().all()]
+        assert names == ["Dipirona"]
+
+
+class TestAsyncListEndpoints:
+    """Endpoints de listagem usando a sessão de leitura assíncrona"""
+
+    def test_list_medications(self, client, db_session, jwt_token, test_profile):
+        db_session.add(Medication(name="Paracetamol", schedules=["08:00"], profile_id=test_profile.id))
+        db_session.commit()
+
+        response = client.get(
+            "/api/medications",
+            headers={
+                "Authorization": f"Bearer {jwt_token}",
+                "X-Profile-Id": str(test_profile.id)
+            }
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert [m["name"] for m in response.json()] == ["Paracetamol"]
+
+    def test_list_requires_user(self, client):
+        response = client.get("/api/medication-logs", headers={"Authorization": "Bearer invalido"})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_audit_log_runs_off_event_loop(self, client, jwt_token, test_profile):
+        """O INSERT de auditoria da listagem não roda no event loop"""
+        calls = []
+
+        def fake_log_view_action(*args):
+            try:
+                asyncio.get_running_loop()
+                calls.append("event_loop")
+            except RuntimeError:
+                calls.append("threadpool")
+
+        headers = {"Authorization": f"Bearer {jwt_token}", "X-Profile-Id": str(test_profile.id)}
+        with patch("main.log_view_action", side_effect=fake_log_view_action):
+            for path in ("/api/medications", "/api/doctor-visits", "/api/medical-exams"):
+                assert client.get(path, headers=headers).status_code == status.HTTP_200_OK
+        assert calls == ["threadpool"] * 3
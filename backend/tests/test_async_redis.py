@@ -0,0 +1,84 @@
+"""
+Testes do caminho async (redis.asyncio) para CSRF.
+"""
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+import config.redis_config as redis_config
+from services.csrf_service import verify_csrf_token_async
+
+
+@pytest.fixture(autouse=True)
+def reset_connection():
+    redis_config.reset_redis_connection()
+    yield
+    redis_config.reset_redis_connection()
+
+
+@pytest.fixture
+def async_client():
+    client = MagicMock()
+    client.exists = AsyncMock(return_value=1)
+    return client
+
+
+class TestAsyncClient:
+    """Testes do cliente redis.asyncio"""
+
+    def test_open_circuit_skips_connection(self):
+        for _ in range(redis_config.REDIS_BREAKER_FAILURE_THRESHOLD):
+            redis_config.record_redis_failure()
+        with patch("config.redis_config.aioredis.Redis") as redis_class:
+            assert asyncio.run(redis_config.get_async_redis_client()) is None
+        redis_class.assert_not_called()
+
+    def test_client_reused_within_loop(self):
+        instance = MagicMock()
+        instance.ping = AsyncMock(return_value=True)
+
+        async def get_twice():
+            return await redis_config.get_async_redis_client(), await redis_config.get_async_redis_client()
+
+        with patch("config.redis_config.aioredis.Redis", return_value=instance) as redis_class:
+            first, second = asyncio.run(get_twice())
+        assert first is instance and second is instance
+        redis_class.assert_called_once()
+        instance.ping.assert_awaited_once()
+
+    def test_failed_ping_closes_client(self):
+        from redis.exceptions import ConnectionError
+        instance = MagicMock()
+        instance.ping = AsyncMock(side_effect=ConnectionError("Connection refused"))
+        instance.aclose = AsyncMock()
+        with patch("config.redis_config.aioredis.Redis", return_value=instance):
+            assert asyncio.run(redis_config.get_async_redis_client()) is None
+        instance.aclose.assert_awaited_once()
+
+    def test_background_probe_skips_half_open(self, monkeypatch):
+        monkeypatch.setattr(redis_config._breaker, "reset_seconds", 0)
+        for _ in range(redis_config.REDIS_BREAKER_FAILURE_THRESHOLD):
+            redis_config.record_redis_failure()
+        redis_config.set_background_probe(True)
+        try:
+            with patch("config.redis_config.aioredis.Redis") as redis_class:
+                assert asyncio.run(redis_config.get_async_redis_client()) is None
+            redis_class.assert_not_called()
+        finally:
+            redis_config.set_background_probe(False)
+
+
+class TestAsyncServices:
+    """Testes da variante async da verificação CSRF"""
+
+    @patch("services.csrf_service.get_async_redis_client", new_callable=AsyncMock)
+    def test_verify_csrf_token_async(self, mock_get_client, async_client):
+        mock_get_client.return_value = async_client
+        assert asyncio.run(verify_csrf_token_async("token", "1")) is True
+        async_client.exists.assert_awaited_once_with("csrf:token:1:token")
+        assert asyncio.run(verify_csrf_token_async("")) is False
+
+    @patch("services.csrf_service.get_async_redis_client", new_callable=AsyncMock, return_value=None)
+    def test_verify_csrf_token_async_without_redis(self, mock_get_client):
+        assert asyncio.run(verify_csrf_token_async("token")) is True
@@ -0,0 +1,97 @@
+"""
+Testes para o AuthContext (autenticacao resolvida uma unica vez por requisicao).
+"""
+import pytest
+from fastapi import HTTPException, status
+from starlette.requests import Request
+
+from auth import create_access_token
+from models import Family, FamilyProfile
+
+
+def _make_request(headers=None):
+    raw_headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw_headers})
+
+
+class TestAuthContextResolution:
+    """Testes de resolucao do contexto"""
+
+    def test_context_is_cached_on_request(self, client, db_session, jwt_token, test_profile):
+        """O mesmo contexto e reaproveitado dentro da requisicao"""
+        import main
+
+        request = _make_request({"Authorization": f"Bearer {jwt_token}"})
+        first = main._load_auth_context(request, jwt_token, db_session)
+        second = main._load_auth_context(request, jwt_token, db_session)
+        assert first is second
+        assert first.user.email == "test@example.com"
+        assert main.get_request_user(request, db_session) is first.user
+
+    def test_profile_resolved_once(self, client, db_session, jwt_token, test_profile):
+        """Perfil efetivo e resolvido e memorizado no contexto"""
+        import main
+
+        request = _make_request({
+            "Authorization": f"Bearer {jwt_token}",
+            "X-Profile-Id": str(test_profile.id)
+        })
+        context = main._load_auth_context(request, jwt_token, db_session)
+        assert context.profile_id == test_profile.id
+        assert main.get_profile_context(request, db_session) == test_profile.id
+
+    def test_profile_from_other_family_rejected(self, client, db_session, test_user, jwt_token, test_profile):
+        """Perfil de outra familia sem compartilhamento retorna 403"""
+        import main
+
+        other_family = Family(name="Outra", admin_user_id=test_user.id)
+        db_session.add(other_family)
+        db_session.commit()
+        other_profile = FamilyProfile(family_id=other_family.id, name="Outro", account_type="adult_member")
+        db_session.add(other_profile)
+        db_session.commit()
+
+        request = _make_request({"X-Profile-Id": str(other_profile.id)})
+        context = main._load_auth_context(request, jwt_token, db_session)
+        with pytest.raises(HTTPException) as exc:
+            context.profile_id
+        assert exc.value.status_code == 403
+
+    def test_invalid_session_rejected(self, client, db_session, test_user):
+        """Token com device_id sem sessao ativa e rejeitado"""
+        import main
+
+        token = create_access_token({"sub": str(test_user.id), "device_id": "sem-sessao"})
+        with pytest.raises(HTTPException) as exc:
+            main._load_auth_context(_make_request(), token, db_session)
+        assert exc.value.status_code == 401
+
+
+class TestAuthContextEndpoints:
+    """Testes de integracao com os endpoints"""
+
+    def test_api_key_rejected_on_jwt_only_endpoint(self, client, api_key):
+        """Endpoints de familia continuam exigindo JWT"""
+        response = client.get(
+            "/api/family/invites",
+            headers={"Authorization": f"Bearer {api_key}"}
+        )
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_header_profile_outside_family_returns_401(self, client, db_session, test_user, jwt_token, test_profile):
+        """X-Profile-Id fora da familia e rejeitado na autenticacao"""
+        other_family = Family(name="Outra", admin_user_id=test_user.id)
+        db_session.add(other_family)
+        db_session.commit()
+        other_profile = FamilyProfile(family_id=other_family.id, name="Outro", account_type="adult_member")
+        db_session.add(other_profile)
+        db_session.commit()
+
+        response = client.get(
+            "/api/medications",
+            headers={
+                "Authorization": f"Bearer {jwt_token}",
+                "X-Profile-Id": str(other_profile.id)
+            }
+        )
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
@@ -0,0 +1,126 @@
+"""
+Testes dos caches do login biométrico (registro do dispositivo e chave parseada).
+"""
+import base64
+from unittest.mock import MagicMock, patch
+
+import pytest
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import event
+
+import main
+import models
+import services.biometric_key_cache as biometric_key_cache
+from services.biometric_key_cache import (
+    clear_biometric_caches,
+    fill_biometric_device,
+    get_cached_biometric_device,
+    get_public_key,
+    invalidate_biometric_device,
+    record_from_device,
+)
+
+
+def _pem(private_key) -> str:
+    return private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode("utf-8")
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    monkeypatch.setattr(biometric_key_cache, "BIOMETRIC_DEVICE_CACHE_ENABLED", True)
+    monkeypatch.setattr(biometric_key_cache, "is_redis_available", lambda: False)
+    monkeypatch.setattr(main.limiter, "enabled", False)
+    monkeypatch.setenv("SESSION_ACTION_SECRET", "segredo-de-teste")
+    clear_biometric_caches()
+    yield
+    clear_biometric_caches()
+
+
+@pytest.fixture
+def private_key():
+    return ec.generate_private_key(ec.SECP256R1())
+
+
+@pytest.fixture
+def device(db_session, test_profile, private_key):
+    user = db_session.query(models.User).one()
+    device = models.BiometricDevice(user_id=user.id, device_id="bio-device-1", public_key=_pem(private_key))
+    db_session.add(device)
+    db_session.commit()
+    return device
+
+
+@pytest.fixture
+def device_selects(db_session):
+    captured = []
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if "FROM biometric_devices" in statement:
+            captured.append(statement)
+
+    engine = db_session.get_bind()
+    event.listen(engine, "before_cursor_execute", before_execute)
+    yield captured
+    event.remove(engine, "before_cursor_execute", before_execute)
+
+
+class TestBiometricCaches:
+    """Testes dos caches do login biométrico"""
+
+    def test_parsed_key_reused_until_key_changes(self, caches, private_key):
+        pem = _pem(private_key)
+        with patch("services.biometric_key_cache.load_pem_public_key",
+                   side_effect=biometric_key_cache.load_pem_public_key) as loader:
+            first = get_public_key(7, pem)
+            assert get_public_key(7, pem) is first
+            assert loader.call_count == 1
+            get_public_key(7, _pem(ec.generate_private_key(ec.SECP256R1())))
+            assert loader.call_count == 2
+            invalidate_biometric_device("qualquer", 7)
+            get_public_key(7, pem)
+            assert loader.call_count == 3
+
+    def test_challenge_and_login_query_device_once(self, caches, client, device, private_key, device_selects):
+        challenge = client.post("/api/auth/biometric/challenge", json={"device_id": "bio-device-1"})
+        assert challenge.status_code == 200
+        token = challenge.json()["challenge"]
+        signature = private_key.sign(token.encode("utf-8"), ec.ECDSA(hashes.SHA256()))
+        response = client.post("/api/auth/biometric", json={
+            "device_id": "bio-device-1",
+            "challenge": token,
+            "signature": base64.urlsafe_b64encode(signature).decode("utf-8"),
+        })
+        assert response.status_code == 200, response.text
+        assert len(device_selects) == 1
+
+    def test_revoke_invalidates_cached_device(self, caches, client, device, jwt_token, db_session):
+        assert client.post("/api/auth/biometric/challenge", json={"device_id": "bio-device-1"}).status_code == 200
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=jwt_token)
+        assert main.revoke_biometric_device("bio-device-1", credentials, db_session) == {"success": True}
+        assert client.post("/api/auth/biometric/challenge", json={"device_id": "bio-device-1"}).status_code == 404
+
+    def test_read_through_fill_does_not_overwrite_revoke(self, caches, client, device, jwt_token, db_session):
+        # Leitura do banco feita antes da revogação, preenchimento depois dela
+        stale = record_from_device(device)
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=jwt_token)
+        assert main.revoke_biometric_device("bio-device-1", credentials, db_session) == {"success": True}
+        fill_biometric_device(stale)
+        assert get_cached_biometric_device("bio-device-1") is None
+        assert client.post("/api/auth/biometric/challenge", json={"device_id": "bio-device-1"}).status_code == 404
+
+    def test_read_through_fill_is_set_nx_in_redis(self, caches, device, monkeypatch):
+        redis_client = MagicMock()
+        redis_client.set.return_value = None
+        monkeypatch.setattr(biometric_key_cache, "is_redis_available", lambda: True)
+        monkeypatch.setattr(biometric_key_cache, "get_redis_client", lambda: redis_client)
+        fill_biometric_device(record_from_device(device))
+        args, kwargs = redis_client.set.call_args
+        assert args[0] == "auth:biometric_device:bio-device-1"
+        assert kwargs == {"ex": biometric_key_cache.BIOMETRIC_DEVICE_FILL_TTL_SECONDS, "nx": True}
+        # SET NX recusado: o registro lido também não entra no nível local
+        redis_client.get.return_value = None
+        assert get_cached_biometric_device("bio-device-1") is None
@@ -1,6 +1,8 @@
 """
 Testes TDD para proteção CSRF.
 """
+import time
+
 import pytest
 from unittest.mock import Mock, patch, MagicMock
 from fastapi.testclient import TestClient
@@ -141,6 +143,83 @@ class TestCSRFService:
         assert len(token) > 0
 
 
+class TestStatelessCSRF:
+    """Testes para tokens CSRF assinados (modo stateless)."""
+
+    @pytest.fixture(autouse=True)
+    def stateless(self, monkeypatch):
+        import services.csrf_service as csrf_service
+        monkeypatch.setattr(csrf_service, "CSRF_MODE", csrf_service.CSRF_MODE_STATELESS)
+        return csrf_service
+
+    @patch('services.csrf_service.get_redis_client')
+    @patch('services.csrf_service.is_redis_available')
+    def test_roundtrip_without_redis(self, mock_available, mock_get_client, stateless):
+        """Token gerado valida sem nenhuma chamada ao Redis."""
+        token = generate_and_store_csrf_token("42")
+        assert verify_csrf_token(token, "42") is True
+        mock_available.assert_not_called()
+        mock_get_client.assert_not_called()
+
+    def test_bound_to_session(self, stateless):
+        """Token de uma sessão não vale para outra."""
+        token = stateless.create_stateless_csrf_token("42")
+        assert verify_csrf_token(token, "43") is False
+        assert verify_csrf_token(token, None) is False
+
+    def test_tampered_token_rejected(self, stateless):
+        """Alterar qualquer parte invalida a assinatura."""
+        token = stateless.create_stateless_csrf_token("42")
+        version, kid, issued_at, nonce, signature = token.split(".")
+        tampered = ".".join([version, kid, str(int(issued_at) + 1), nonce, signature])
+        assert verify_csrf_token(tampered, "42") is False
+        assert verify_csrf_token("token_aleatorio", "42") is False
+
+    def test_expired_token_rejected(self, stateless):
+        """Token mais velho que CSRF_TOKEN_TTL é rejeitado."""
+        token = stateless.create_stateless_csrf_token("42")
+        with patch('services.csrf_service.time.time', return_value=time.time() + stateless.CSRF_TOKEN_TTL + 1):
+            assert verify_csrf_token(token, "42") is False
+
+    def test_key_rotation(self, stateless, monkeypatch):
+        """Tokens da chave anterior continuam válidos enquanto ela estiver configurada."""
+        monkeypatch.setattr(stateless, "_active_kid", "old")
+        monkeypatch.setattr(stateless, "_signing_keys", {"old": b"segredo-antigo"})
+        old_token = stateless.create_stateless_csrf_token("42")
+
+        monkeypatch.setattr(stateless, "_active_kid", "new")
+        monkeypatch.setattr(stateless, "_signing_keys", {"new": b"segredo-novo", "old": b"segredo-antigo"})
+        assert verify_csrf_token(old_token, "42") is True
+        assert stateless.create_stateless_csrf_token("42").split(".")[1] == "new"
+
+        monkeypatch.setattr(stateless, "_signing_keys", {"new": b"segredo-novo"})
+        assert verify_csrf_token(old_token, "42") is False
+
+    @patch('services.csrf_service.get_redis_client')
+    @patch('services.csrf_service.is_redis_available', return_value=True)
+    def test_redis_tokens_accepted_during_migration(self, mock_available, mock_get_client, stateless, monkeypatch):
+        """Tokens emitidos no modo redis continuam válidos após a troca para stateless."""
+        mock_client = MagicMock()
+        mock_client.exists.return_value = 1
+        mock_get_client.return_value = mock_client
+        assert verify_csrf_token("token_do_redis", "42") is True
+        mock_client.exists.assert_called_once_with("csrf:token:42:token_do_redis")
+
+        mock_client.exists.return_value = 0
+        assert verify_csrf_token("token_desconhecido", "42") is False
+
+        monkeypatch.setattr(stateless, "CSRF_ACCEPT_REDIS_TOKENS", False)
+        mock_client.exists.return_value = 1
+        assert verify_csrf_token("token_do_redis", "42") is False
+
+    def test_signing_keys_from_env(self, stateless, monkeypatch):
+        """CSRF_SIGNING_KEYS define a chave ativa (primeira) e as aceitas."""
+        monkeypatch.setenv("CSRF_SIGNING_KEYS", "k2:segredo2, k1:segredo1")
+        active, keys = stateless._load_signing_keys()
+        assert active == "k2"
+        assert set(keys) == {"k2", "k1"}
+
+
 class TestCSRFMiddleware:
     """Testes para middleware CSRF."""
     
@@ -149,7 +228,7 @@ class TestCSRFMiddleware:
         """Cliente de teste FastAPI."""
         return TestClient(app)
     
-    @patch('middleware.csrf_middleware.verify_csrf_token', return_value=True)
+    @patch('middleware.csrf_middleware.verify_csrf_token_async', return_value=True)
     def test_csrf_middleware_allows_get_requests(self, mock_verify, client):
         """Testa que requisições GET não precisam de CSRF token."""
         response = client.get("/api/medications")
@@ -178,7 +257,7 @@ class TestCSRFMiddleware:
             else:
                 raise  # Re-raise se for outro tipo de exceção
     
-    @patch('middleware.csrf_middleware.verify_csrf_token', return_value=True)
+    @patch('middleware.csrf_middleware.verify_csrf_token_async', return_value=True)
     def test_csrf_middleware_with_valid_token(self, mock_verify, client):
         """Testa requisição POST com token CSRF válido."""
         response = client.post(
@@ -206,7 +285,7 @@ class TestCSRFMiddleware:
         # Não deve retornar 403 (CSRF), pode retornar 401 (auth) ou 422 (validation)
         assert response.status_code != 403
     
-    @patch('middleware.csrf_middleware.verify_csrf_token', return_value=False)
+    @patch('middleware.csrf_middleware.verify_csrf_token_async', return_value=False)
     def test_csrf_middleware_rejects_invalid_token(self, mock_verify, client):
         """Testa que middleware rejeita token CSRF inválido."""
         try:
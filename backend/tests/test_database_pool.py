@@ -0,0 +1,61 @@
+"""
+Testes para configuração do pool de conexões e detecção de vazamentos.
+"""
+from sqlalchemy import text
+
+import database
+
+
+class TestPoolConfiguration:
+    """Testes de configuração do pool"""
+
+    def test_postgres_options_include_pool_settings(self):
+        """Pool configurável para bancos de servidor"""
+        options = database.build_engine_options("postgresql://u:p@localhost/db")
+        assert options["pool_size"] == database.DATABASE_POOL_SIZE
+        assert options["max_overflow"] == database.DATABASE_MAX_OVERFLOW
+        assert options["pool_recycle"] == database.DATABASE_POOL_RECYCLE
+        assert options["pool_timeout"] == database.DATABASE_POOL_TIMEOUT
+        assert options["pool_pre_ping"] == database.DATABASE_POOL_PRE_PING
+
+    def test_sqlite_options_skip_queue_settings(self):
+        """SQLite usa o pool padrão"""
+        options = database.build_engine_options("sqlite:///./test.db")
+        assert "pool_size" not in options
+
+
+class TestLeakDetection:
+    """Testes do detector de vazamento de conexões"""
+
+    def test_get_db_closes_session(self):
+        """A dependência devolve a conexão ao pool"""
+        before = database.get_pool_metrics()["in_use"]
+        gen = database.get_db()
+        db = next(gen)
+        db.execute(text("SELECT 1"))
+        assert database.get_pool_metrics()["in_use"] == before + 1
+        gen.close()
+        assert database.get_pool_metrics()["in_use"] == before
+
+    def test_held_connection_reported_with_route(self):
+        """Conexão mantida além do limite é reportada com a rota"""
+        db = database.SessionLocal()
+        db.info["route"] = "GET /api/medications"
+        try:
+            db.execute(text("SELECT 1"))
+            leaks = database.report_leaked_connections(threshold_seconds=0)
+            assert {"route": "GET /api/medications"} in [{"route": leak["route"]} for leak in leaks]
+            # Cada checkout é reportado apenas uma vez
+            assert database.report_leaked_connections(threshold_seconds=0) == []
+        finally:
+            db.close()
+
+    def test_metrics_count_checkouts(self):
+        """Métricas de checkout são atualizadas"""
+        before = database.get_pool_metrics()["checkouts"]
+        db = database.SessionLocal()
+        db.execute(text("SELECT 1"))
+        db.close()
+        metrics = database.get_pool_metrics()
+        assert metrics["checkouts"] == before + 1
+        assert "overflow" in metrics or metrics["pool_class"] != "QueuePool"
@@ -0,0 +1,67 @@
+"""
+Testes do contador de downloads (detecção de download em massa) e da
+auditoria em lote.
+"""
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import models
+import services.download_counter as download_counter
+from download_security import DOWNLOAD_THRESHOLD, flush_download_audit, record_download
+from services.audit_sink import AuditSink
+from services.download_counter import clear_download_counters, increment_download_count
+
+
+@pytest.fixture
+def counter(monkeypatch):
+    monkeypatch.setattr(download_counter, "DOWNLOAD_COUNTER_ENABLED", True)
+    monkeypatch.setattr(download_counter, "is_redis_available", lambda: False)
+    clear_download_counters()
+    yield
+    clear_download_counters()
+
+
+class TestDownloadCounter:
+    """Testes do contador de downloads por usuário"""
+
+    def test_local_window_resets(self, counter):
+        with patch("services.download_counter.time.monotonic", return_value=100.0):
+            assert increment_download_count(1, 5) == 1
+            assert increment_download_count(1, 5) == 2
+            assert increment_download_count(2, 5) == 1
+        with patch("services.download_counter.time.monotonic", return_value=100.0 + 5 * 60):
+            assert increment_download_count(1, 5) == 1
+
+    def test_redis_single_round_trip(self, counter, monkeypatch):
+        client = MagicMock()
+        client.pipeline.return_value.execute.return_value = [None, 7]
+        monkeypatch.setattr(download_counter, "is_redis_available", lambda: True)
+        monkeypatch.setattr(download_counter, "get_redis_client", lambda: client)
+        assert increment_download_count(1, 5) == 7
+        client.pipeline.return_value.set.assert_called_once_with("security:downloads:1", 0, ex=300, nx=True)
+        client.pipeline.return_value.execute.assert_called_once()
+
+    def test_record_download_counts_and_batches_audit(self, counter, test_user, db_session):
+        counts = [
+            record_download(db_session, test_user.id, "medical_exam", str(i), "10.0.0.1", "pytest")
+            for i in range(DOWNLOAD_THRESHOLD)
+        ]
+        assert counts == list(range(1, DOWNLOAD_THRESHOLD + 1))
+        assert db_session.query(models.UserDownloadEvent).count() == 0
+        assert flush_download_audit(db_session) == DOWNLOAD_THRESHOLD
+        assert db_session.query(models.UserDownloadEvent).filter_by(user_id=test_user.id).count() == DOWNLOAD_THRESHOLD
+
+    def test_audit_sink_requeues_and_bounds_on_failure(self):
+        sink = AuditSink("test_sink", models.UserDownloadEvent, flush_max_entries=100, max_pending=3)
+        failing = MagicMock()
+        failing.execute.side_effect = RuntimeError("banco fora")
+        for i in range(4):
+            sink.add({"user_id": 1, "resource_type": "medical_exam", "resource_id": str(i)})
+        assert sink.flush(failing) == 0
+        failing.rollback.assert_called_once()
+        stats = sink.stats()
+        assert stats["pending"] == 3
+        assert stats["dropped"] == 1
+        assert stats["errors"] == 1
+        sink.clear()
@@ -0,0 +1,149 @@
+"""
+Testes do pool de conexões SMTP e do outbox de email, contra um servidor
+SMTP local mínimo (sem TLS).
+"""
+import socket
+import socketserver
+import threading
+
+import pytest
+
+import email_service
+import services.notification_dispatcher as notification_dispatcher
+from email_service import SMTPConnectionPool, send_email
+from services.notification_dispatcher import clear_notification_queue, dispatch_pending, pending_notifications
+
+
+class SMTPStandIn:
+    """Servidor SMTP de teste: aceita AUTH PLAIN e guarda as mensagens recebidas."""
+
+    def __init__(self, close_after_message=False):
+        self.connections = 0
+        self.logins = 0
+        self.messages = []
+        self.close_after_message = close_after_message
+        stand_in = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+            def handle(self):
+                stand_in.connections += 1
+                self.reply("220 standin ESMTP")
+                while True:
+                    line = self.rfile.readline().decode("utf-8", "replace").strip()
+                    if not line:
+                        return
+                    command = line.split(" ", 1)[0].upper()
+                    if command == "EHLO":
+                        self.reply("250-standin")
+                        self.reply("250 AUTH PLAIN LOGIN")
+                    elif command == "AUTH":
+                        stand_in.logins += 1
+                        self.reply("235 2.7.0 Authentication successful")
+                    elif command == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        data = []
+                        while True:
+                            chunk = self.rfile.readline()
+                            if chunk in (b".\r\n", b".\n", b""):
+                                break
+                            data.append(chunk)
+                        stand_in.messages.append(b"".join(data))
+                        self.reply("250 OK")
+                        if stand_in.close_after_message:
+                            return
+                    elif command == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("250 OK")
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _configure_smtp(monkeypatch, port):
+    monkeypatch.setenv("SMTP_HOST", "127.0.0.1")
+    monkeypatch.setenv("SMTP_PORT", str(port))
+    monkeypatch.setenv("SMTP_USER", "saudenold")
+    monkeypatch.setenv("SMTP_PASSWORD", "segredo")
+    monkeypatch.setenv("SMTP_FROM_EMAIL", "no-reply@saudenold.test")
+    monkeypatch.setenv("SMTP_USE_TLS", "false")
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    stand_in = SMTPStandIn()
+    _configure_smtp(monkeypatch, stand_in.port)
+    pool = SMTPConnectionPool(2)
+    monkeypatch.setattr(email_service, "_pool", pool)
+    yield stand_in
+    pool.close()
+    stand_in.close()
+
+
+class TestSMTPPool:
+    """Testes do pool de conexões SMTP"""
+
+    def test_connection_reused_across_emails(self, smtp):
+        for i in range(3):
+            assert send_email(f"user{i}@example.com", "Assunto", "Corpo")
+        assert len(smtp.messages) == 3
+        assert smtp.connections == 1
+        assert smtp.logins == 1
+        assert email_service.get_smtp_pool_stats()["connections_reused"] == 2
+
+    def test_reconnects_when_server_drops_connection(self, smtp):
+        smtp.close_after_message = True
+        assert send_email("a@example.com", "Assunto", "Corpo")
+        assert send_email("b@example.com", "Assunto", "Corpo")
+        assert len(smtp.messages) == 2
+        assert smtp.connections == 2
+
+
+class TestEmailOutbox:
+    """Testes do outbox de email (fila de notificações)"""
+
+    @pytest.fixture
+    def outbox(self, monkeypatch):
+        monkeypatch.setattr(notification_dispatcher, "NOTIFICATION_DISPATCHER_ENABLED", True)
+        monkeypatch.setattr(notification_dispatcher, "NOTIFICATION_RETRY_BASE_SECONDS", 0)
+        clear_notification_queue()
+        yield
+        clear_notification_queue()
+
+    def test_emails_queued_and_sent_over_one_connection(self, smtp, outbox):
+        for _ in range(3):
+            # Emails transacionais idênticos não são deduplicados
+            assert send_email("user@example.com", "Verificacao de email", "Codigo: 123")
+        assert smtp.messages == []
+        assert dispatch_pending() == 3
+        assert len(smtp.messages) == 3
+        assert smtp.connections == 1
+
+    def test_retried_while_server_is_down(self, monkeypatch, outbox):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            closed_port = sock.getsockname()[1]
+        _configure_smtp(monkeypatch, closed_port)
+        monkeypatch.setattr(email_service, "_pool", SMTPConnectionPool(1))
+        assert send_email("user@example.com", "Assunto", "Corpo")
+        dispatch_pending()
+        assert pending_notifications() == 1
+
+        stand_in = SMTPStandIn()
+        try:
+            monkeypatch.setenv("SMTP_PORT", str(stand_in.port))
+            dispatch_pending()
+            assert pending_notifications() == 0
+            assert len(stand_in.messages) == 1
+        finally:
+            stand_in.close()
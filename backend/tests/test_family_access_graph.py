@@ -0,0 +1,140 @@
+"""
+Testes do grafo de acesso da família em memória.
+"""
+import pytest
+from fastapi import HTTPException
+
+import services.family_access_graph as family_access_graph
+from models import User, Family, FamilyProfile, FamilyCaregiver, FamilyDataShare
+from services.family_access_graph import (
+    bump_family_graph_version,
+    clear_family_graphs,
+    get_family_graph,
+    get_graph_grants,
+)
+from services.permission_service import check_permission, load_access_grants
+from utils.rbac import ACTION_VIEW, ACTION_EDIT
+
+
+class FakeVersionRedis:
+    """Redis mínimo para as versões publicadas (get/incr/publish)."""
+
+    def __init__(self):
+        self.values = {}
+        self.down = False
+
+    def get(self, key):
+        if self.down:
+            raise ConnectionError("redis fora")
+        return self.values.get(key)
+
+    def incr(self, key):
+        if self.down:
+            raise ConnectionError("redis fora")
+        self.values[key] = int(self.values.get(key, 0)) + 1
+        return self.values[key]
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = FakeVersionRedis()
+    monkeypatch.setattr(family_access_graph, "is_redis_available", lambda: True)
+    monkeypatch.setattr(family_access_graph, "get_redis_client", lambda: client)
+    return client
+
+
+@pytest.fixture
+def graph_enabled(monkeypatch, redis):
+    monkeypatch.setattr(family_access_graph, "FAMILY_GRAPH_ENABLED", True)
+    clear_family_graphs()
+    yield
+    clear_family_graphs()
+
+
+@pytest.fixture
+def family_setup(db_session):
+    """Família com admin, adulto (com perfil próprio) e perfil alvo"""
+    admin = User(email="admin@graph.com", password_hash="x", is_active=True, email_verified=True,
+                 account_type="family_admin")
+    member = User(email="adulto@graph.com", password_hash="x", is_active=True, email_verified=True,
+                  account_type="adult_member")
+    db_session.add_all([admin, member])
+    db_session.commit()
+    family = Family(name="Familia", admin_user_id=admin.id)
+    db_session.add(family)
+    db_session.commit()
+    admin.family_id = family.id
+    member.family_id = family.id
+    own = FamilyProfile(family_id=family.id, name="Adulto", account_type="adult_member", created_by=member.id)
+    target = FamilyProfile(family_id=family.id, name="Alvo", account_type="adult_member", created_by=admin.id)
+    db_session.add_all([own, target])
+    db_session.commit()
+    db_session.add(FamilyCaregiver(profile_id=target.id, caregiver_user_id=member.id, access_level="read_only"))
+    db_session.add(FamilyDataShare(
+        family_id=family.id,
+        from_profile_id=target.id,
+        to_profile_id=own.id,
+        permissions={"can_view": True, "can_edit": False}
+    ))
+    db_session.commit()
+    return {"admin": admin, "member": member, "own": own, "target": target, "family": family}
+
+
+class TestGraphGrants:
+    """O grafo produz as mesmas concessões que a consulta SQL"""
+
+    def test_matches_sql_grants(self, graph_enabled, db_session, family_setup):
+        member = family_setup["member"]
+        for profile in (family_setup["own"], family_setup["target"]):
+            assert get_graph_grants(member, profile.id, db_session) == \
+                load_access_grants(member, profile.id, db_session)
+
+    def test_target_outside_family_falls_back(self, graph_enabled, db_session, family_setup):
+        admin = family_setup["admin"]
+        assert get_graph_grants(admin, 99999, db_session) is None
+        with pytest.raises(HTTPException) as exc:
+            check_permission(admin, ACTION_VIEW, 99999, db_session)
+        assert exc.value.detail == "Perfil não pertence à família"
+
+    def test_graph_is_reused(self, graph_enabled, db_session, family_setup):
+        family_id = family_setup["family"].id
+        assert get_family_graph(db_session, family_id) is get_family_graph(db_session, family_id)
+
+
+class TestInvalidation:
+    """Alterações publicadas reconstroem o grafo"""
+
+    def test_bump_rebuilds_graph(self, graph_enabled, db_session, family_setup):
+        member = family_setup["member"]
+        target_id = family_setup["target"].id
+        family_id = family_setup["family"].id
+        with pytest.raises(HTTPException):
+            check_permission(member, ACTION_EDIT, target_id, db_session)
+
+        caregiver = db_session.query(FamilyCaregiver).filter(FamilyCaregiver.profile_id == target_id).first()
+        caregiver.access_level = "full"
+        db_session.commit()
+        # Sem bump o grafo antigo continua valendo
+        assert get_family_graph(db_session, family_id).caregivers[(target_id, member.id)] == "read_only"
+
+        bump_family_graph_version(family_id)
+        assert check_permission(member, ACTION_EDIT, target_id, db_session)
+
+    def test_unreadable_version_falls_back_to_sql(self, graph_enabled, redis, monkeypatch, db_session, family_setup):
+        member = family_setup["member"]
+        target_id = family_setup["target"].id
+        family_id = family_setup["family"].id
+        assert get_family_graph(db_session, family_id) is not None
+
+        # Redis fora: a alteração não é publicada e o grafo em cache não pode ser servido
+        monkeypatch.setattr(family_access_graph, "FAMILY_GRAPH_VERSION_CHECK_SECONDS", 0)
+        redis.down = True
+        caregiver = db_session.query(FamilyCaregiver).filter(FamilyCaregiver.profile_id == target_id).first()
+        caregiver.access_level = "full"
+        db_session.commit()
+        assert get_graph_grants(member, target_id, db_session) is None
+        assert check_permission(member, ACTION_EDIT, target_id, db_session)
+
+        # Com o Redis de volta (versão inalterada) o grafo é reconstruído do banco
+        redis.down = False
+        assert get_family_graph(db_session, family_id).caregivers[(target_id, member.id)] == "full"
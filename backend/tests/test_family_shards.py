@@ -0,0 +1,309 @@
+"""
+Testes para roteamento por shard de família e rebalanceamento.
+"""
+import json
+import os
+
+import pytest
+from sqlalchemy import create_engine
+
+import database
+import rebalance_family_shards
+from database import Base
+from models import (
+    Family, FamilyDataShare, FamilyProfile, FamilyShard, Medication, MedicationLog, MedicalExam, ExamDataPoint,
+    EmergencyContact,
+)
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from services.compliance_service import export_user_data, request_data_deletion, execute_data_deletion
+from services.emergency_service import get_emergency_info, get_or_create_emergency_profile
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    """Dois shards em arquivos SQLite separados"""
+    engines = [create_engine(f"sqlite:///{tmp_path / f'shard{i}.db'}") for i in range(2)]
+    tables = [table for name, table in Base.metadata.tables.items() if name in database.SHARDED_TABLES]
+    for shard_engine in engines:
+        Base.metadata.create_all(bind=shard_engine, tables=tables)
+    monkeypatch.setattr(database, "shard_engines", engines)
+    monkeypatch.setattr(rebalance_family_shards, "shard_engines", engines)
+    monkeypatch.setattr(database, "_shard_cache", {})
+    monkeypatch.setattr(database, "_profile_family_cache", {})
+    monkeypatch.setattr(database, "_id_blocks", {})
+    yield engines
+    for shard_engine in engines:
+        shard_engine.dispose()
+
+
+@pytest.fixture
+def family(db_session, test_user):
+    family = Family(name="Familia Shard", admin_user_id=test_user.id)
+    db_session.add(family)
+    db_session.commit()
+    profile = FamilyProfile(family_id=family.id, name="Perfil", account_type="adult_member")
+    db_session.add(profile)
+    db_session.commit()
+    return family, profile
+
+
+def _count(shard_engine, model):
+    session = database.Session(bind=shard_engine)
+    try:
+        return session.query(model).count()
+    finally:
+        session.close()
+
+
+class TestShardRouting:
+    """Testes do roteamento de tabelas médicas"""
+
+    def test_default_shard_is_modulo(self, shards, family):
+        fam, _ = family
+        assert database.get_family_shard(fam.id) == fam.id % 2
+
+    def test_medical_tables_go_to_family_shard(self, shards, family):
+        fam, profile = family
+        db = database.SessionLocal()
+        try:
+            database.use_family_shard(db, fam.id)
+            db.add(Medication(name="Losartana", schedules=["08:00"], profile_id=profile.id))
+            db.commit()
+            # Tabelas globais continuam no primário
+            assert db.query(FamilyProfile).filter(FamilyProfile.id == profile.id).count() == 1
+        finally:
+            db.close()
+        shard = fam.id % 2
+        assert _count(shards[shard], Medication) == 1
+        assert _count(shards[1 - shard], Medication) == 0
+
+
+    def test_unrouted_session_fails_loudly(self, shards, family):
+        db = database.SessionLocal()
+        try:
+            with pytest.raises(database.UnroutedShardError):
+                db.query(Medication).count()
+        finally:
+            db.close()
+
+    def test_ids_are_unique_across_shards(self, shards, family, test_user, db_session):
+        fam, profile = family
+        other = Family(name="Outra Familia", admin_user_id=test_user.id)
+        db_session.add(other)
+        db_session.commit()
+        db_session.add(FamilyShard(family_id=other.id, shard_index=1 - fam.id % 2))
+        db_session.commit()
+        db = database.SessionLocal()
+        try:
+            ids = []
+            for family_id in (fam.id, other.id, fam.id, other.id):
+                database.use_family_shard(db, family_id)
+                medication = Medication(name="Losartana", schedules=["08:00"], profile_id=profile.id)
+                db.add(medication)
+                db.commit()
+                ids.append(medication.id)
+        finally:
+            db.close()
+        assert len(set(ids)) == 4
+        assert _count(shards[0], Medication) == _count(shards[1], Medication) == 2
+
+    def test_profile_family_lookup_is_cached(self, shards, family, db_session):
+        fam, profile = family
+        assert database.get_profile_family(profile.id) == fam.id
+        db_session.delete(profile)
+        db_session.commit()
+        assert database.get_profile_family(profile.id) == fam.id
+
+    def test_unrouted_medical_route_returns_403(self, shards, client, jwt_token):
+        # Usuário sem família: a rota não consegue escolher um shard
+        response = client.post(
+            "/api/medications",
+            json={"name": "Losartana", "schedules": ["08:00"]},
+            headers={"Authorization": f"Bearer {jwt_token}"},
+        )
+        assert response.status_code == 403
+
+    def test_shared_profile_routes_to_its_family(self, shards, family, test_user, db_session):
+        import main
+
+        fam, own_profile = family
+        own_profile.created_by = test_user.id
+        test_user.family_id = fam.id
+        other = Family(name="Outra Familia", admin_user_id=test_user.id)
+        db_session.add(other)
+        db_session.commit()
+        shared = FamilyProfile(family_id=other.id, name="Compartilhado", account_type="adult_member")
+        db_session.add(shared)
+        db_session.commit()
+        db_session.add(FamilyDataShare(family_id=fam.id, from_profile_id=shared.id, to_profile_id=own_profile.id))
+        db_session.commit()
+
+        db = database.SessionLocal()
+        try:
+            request = SimpleNamespace(headers={"X-Profile-Id": str(shared.id)})
+            context = main.AuthContext(request, db, "jwt")
+            context._user = test_user
+            database.use_family_shard(db, fam.id)
+            assert context.profile_id == shared.id
+            assert db.info["shard_index"] == other.id % 2 != fam.id % 2
+        finally:
+            db.close()
+
+
+class TestShardedServices:
+    """Exportação, exclusão e modo emergência leem o shard da família"""
+
+    @pytest.fixture
+    def member(self, family, test_user, db_session):
+        fam, profile = family
+        test_user.family_id = fam.id
+        db_session.commit()
+        session = database.Session(bind=database.shard_engines[fam.id % 2])
+        session.add(Medication(name="Losartana", schedules=["08:00"], profile_id=profile.id))
+        session.add(EmergencyContact(name="Maria", phone="11999999999", relationship="filha", profile_id=profile.id))
+        session.commit()
+        session.close()
+        return fam, profile, test_user
+
+    def test_export_includes_shard_rows(self, shards, member):
+        fam, profile, user = member
+        db = database.SessionLocal()
+        try:
+            data_export = export_user_data(db, user.id, include_audit_logs=False)
+            with open(data_export.file_path, encoding="utf-8") as f:
+                exported = json.load(f)
+        finally:
+            db.close()
+        os.remove(data_export.file_path)
+        assert [m["name"] for m in exported["profiles"][0]["medications"]] == ["Losartana"]
+
+    def test_deletion_removes_shard_rows(self, shards, member):
+        fam, profile, user = member
+        db = database.SessionLocal()
+        try:
+            deletion_request = request_data_deletion(db, user.id, request_type="partial")
+            assert execute_data_deletion(db, deletion_request.id)
+        finally:
+            db.close()
+        assert _count(shards[fam.id % 2], Medication) == 0
+        assert _count(shards[fam.id % 2], EmergencyContact) == 0
+
+    def test_emergency_info_reads_shard(self, shards, member):
+        fam, profile, _ = member
+        db = database.SessionLocal()
+        try:
+            emergency_profile = get_or_create_emergency_profile(db, profile.id)
+            emergency_profile.show_medications = True
+            emergency_profile.show_emergency_contacts = False
+            db.commit()
+            info = get_emergency_info(db, profile.id)
+        finally:
+            db.close()
+        assert [m["name"] for m in info["medications"]] == ["Losartana"]
+
+
+class TestRebalance:
+    """Testes da ferramenta de rebalanceamento"""
+
+    def test_move_family_rows(self, shards, family, db_session):
+        fam, profile = family
+        source = fam.id % 2
+        target = 1 - source
+        session = database.Session(bind=shards[source])
+        exam = MedicalExam(profile_id=profile.id, exam_type="sangue", exam_date=datetime.now(timezone.utc))
+        session.add(Medication(name="Losartana", schedules=["08:00"], profile_id=profile.id))
+        session.add(exam)
+        session.commit()
+        session.add(ExamDataPoint(exam_id=exam.id, parameter_name="glicose", value="90", exam_date=exam.exam_date))
+        session.commit()
+        session.close()
+
+        counts = rebalance_family_shards.rebalance_family(fam.id, target)
+
+        assert counts["medications"] == 1
+        assert counts["exam_data_points"] == 1
+        assert _count(shards[target], Medication) == 1
+        assert _count(shards[target], ExamDataPoint) == 1
+        assert _count(shards[source], Medication) == 0
+        assert database.get_family_shard(fam.id) == target
+        db_session.expire_all()
+        assert db_session.get(FamilyShard, fam.id).shard_index == target
+
+    def test_move_into_non_empty_shard_keeps_ids(self, shards, family, test_user, db_session):
+        fam, profile = family
+        source = fam.id % 2
+        target = 1 - source
+        # Outra família já no shard de destino
+        other = Family(name="Outra Familia", admin_user_id=test_user.id)
+        db_session.add(other)
+        db_session.commit()
+        other_profile = FamilyProfile(family_id=other.id, name="Outro", account_type="adult_member")
+        db_session.add(other_profile)
+        db_session.commit()
+        db_session.add(FamilyShard(family_id=other.id, shard_index=target))
+        db_session.commit()
+
+        now = datetime.now(timezone.utc)
+        db = database.SessionLocal()
+        try:
+            database.use_family_shard(db, other.id)
+            db.add(Medication(name="Outra", schedules=["09:00"], profile_id=other_profile.id))
+            db.commit()
+            database.use_family_shard(db, fam.id)
+            medication = Medication(name="Losartana", schedules=["08:00"], profile_id=profile.id)
+            exam = MedicalExam(profile_id=profile.id, exam_type="sangue", exam_date=now)
+            db.add_all([medication, exam])
+            db.commit()
+            db.add(MedicationLog(profile_id=profile.id, medication_id=medication.id, medication_name="Losartana", status="taken"))
+            db.add(ExamDataPoint(exam_id=exam.id, parameter_name="glicose", value="90", exam_date=now))
+            db.commit()
+            medication_id, exam_id = medication.id, exam.id
+        finally:
+            db.close()
+
+        rebalance_family_shards.rebalance_family(fam.id, target)
+
+        session = database.Session(bind=shards[target])
+        try:
+            assert session.query(Medication).count() == 2
+            assert session.get(Medication, medication_id).name == "Losartana"
+            assert session.query(MedicationLog).filter_by(profile_id=profile.id).one().medication_id == medication_id
+            assert session.get(MedicalExam, exam_id).profile_id == profile.id
+            assert session.query(ExamDataPoint).one().exam_id == exam_id
+        finally:
+            session.close()
+        assert _count(shards[source], Medication) == 0
+
+    def test_conflicting_legacy_ids_abort(self, shards, family):
+        fam, profile = family
+        source = fam.id % 2
+        target = 1 - source
+        # Linhas gravadas antes da reserva global de IDs
+        for shard_index, name, profile_id in ((target, "Outra", 9999), (source, "Losartana", profile.id)):
+            session = database.Session(bind=shards[shard_index])
+            session.add(Medication(id=1, name=name, schedules=["08:00"], profile_id=profile_id))
+            session.commit()
+            session.close()
+
+        with pytest.raises(RuntimeError):
+            rebalance_family_shards.rebalance_family(fam.id, target)
+        assert _count(shards[source], Medication) == 1
+        assert database.get_family_shard(fam.id) == source
+
+    def test_dry_run_does_not_move(self, shards, family):
+        fam, profile = family
+        source = fam.id % 2
+        session = database.Session(bind=shards[source])
+        session.add(Medication(name="Losartana", schedules=["08:00"], profile_id=profile.id))
+        session.commit()
+        session.close()
+
+        counts = rebalance_family_shards.rebalance_family(fam.id, 1 - source, dry_run=True)
+        assert counts["medications"] == 1
+        assert _count(shards[source], Medication) == 1
+
+    def test_invalid_target(self, shards, family):
+        fam, _ = family
+        with pytest.raises(ValueError):
+            rebalance_family_shards.rebalance_family(fam.id, 5)
@@ -0,0 +1,75 @@
+"""
+Testes do cache de claims JWT verificados.
+"""
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from fastapi import HTTPException
+
+import auth
+from auth import (
+    create_access_token,
+    clear_claims_cache,
+    decode_token_payload,
+    get_claims_cache_stats,
+    get_user_from_token,
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_claims_cache()
+    yield
+    clear_claims_cache()
+
+
+class TestClaimsCache:
+    """Testes do LRU de claims"""
+
+    def test_second_decode_is_a_hit(self):
+        token = create_access_token({"sub": "1"})
+        before = get_claims_cache_stats()
+        with patch("auth.jwt.decode", wraps=auth.jwt.decode) as decode:
+            assert decode_token_payload(token)["sub"] == "1"
+            assert decode_token_payload(token)["sub"] == "1"
+        assert decode.call_count == 1
+        stats = get_claims_cache_stats()
+        assert stats["hits"] == before["hits"] + 1
+        assert stats["misses"] == before["misses"] + 1
+
+    def test_cached_claims_are_copies(self):
+        token = create_access_token({"sub": "1"})
+        decode_token_payload(token)["sub"] = "2"
+        assert decode_token_payload(token)["sub"] == "1"
+
+    def test_expired_entry_is_reverified(self):
+        token = create_access_token({"sub": "1"}, expires_delta=timedelta(seconds=30))
+        decode_token_payload(token)
+        with patch("auth.time.time", return_value=auth.time.time() + 60), \
+                patch("auth.jwt.decode", wraps=auth.jwt.decode) as decode:
+            decode_token_payload(token)
+        assert decode.call_count == 1
+
+    def test_invalid_token_not_cached(self):
+        with pytest.raises(HTTPException):
+            decode_token_payload("nao.e.jwt")
+        assert get_claims_cache_stats()["size"] == 0
+
+    def test_lru_is_bounded(self, monkeypatch):
+        monkeypatch.setattr(auth, "JWT_CLAIMS_CACHE_SIZE", 2)
+        tokens = [create_access_token({"sub": str(i)}) for i in range(3)]
+        for token in tokens:
+            decode_token_payload(token)
+        stats = get_claims_cache_stats()
+        assert stats["size"] == 2
+        assert stats["evictions"] >= 1
+
+    def test_blacklisted_token_rejected_after_cache(self, db_session, test_user):
+        token = create_access_token({"sub": str(test_user.id)})
+        assert get_user_from_token(db_session, token).id == test_user.id
+        with patch("auth.is_blacklisted", return_value=True):
+            with pytest.raises(HTTPException) as exc:
+                get_user_from_token(db_session, token)
+        assert exc.value.detail == "Token revoked"
+        assert get_claims_cache_stats()["size"] == 0
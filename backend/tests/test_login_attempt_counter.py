@@ -0,0 +1,93 @@
+"""
+Testes do contador de tentativas de login no Redis (janela deslizante) e do
+arquivo em lote de user_login_attempts.
+"""
+from unittest.mock import patch
+
+import pytest
+
+import main
+import models
+import services.login_attempt_counter as login_attempt_counter
+from login_security import MAX_ATTEMPTS
+from services.login_attempt_archive import clear_login_attempt_archive, flush_login_attempts, pending_login_attempts
+from services.login_attempt_counter import add_failed_attempt, count_failed_attempts
+
+
+class FakeRedis:
+    """Executa o script da janela deslizante em Python (sorted sets em dicts)."""
+
+    def __init__(self):
+        self.zsets = {}
+        self.script_calls = 0
+
+    def register_script(self, _lua):
+        def run(keys, args, client=None):
+            self.script_calls += 1
+            now, window, member = int(args[0]), int(args[1]), args[2]
+            zset = self.zsets.setdefault(keys[0], {})
+            for key in [key for key, score in zset.items() if score <= now - window]:
+                del zset[key]
+            if member:
+                zset[member] = now
+            return len(zset)
+        return run
+
+    def delete(self, key):
+        self.zsets.pop(key, None)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(login_attempt_counter, "LOGIN_ATTEMPT_COUNTER_ENABLED", True)
+    monkeypatch.setattr(login_attempt_counter, "_script", None)
+    monkeypatch.setattr(login_attempt_counter, "is_redis_available", lambda: True)
+    monkeypatch.setattr(login_attempt_counter, "get_redis_client", lambda: fake)
+    monkeypatch.setattr(main.limiter, "enabled", False)
+    clear_login_attempt_archive()
+    yield fake
+    clear_login_attempt_archive()
+
+
+def _login(client, password):
+    return client.post("/api/auth/login", json={"email": "test@example.com", "password": password})
+
+
+class TestLoginAttemptCounter:
+    """Testes do contador de falhas de login"""
+
+    def test_sliding_window_drops_old_failures(self, fake_redis):
+        with patch("services.login_attempt_counter.time.time", return_value=1000.0):
+            assert add_failed_attempt("a@b.com", "1.2.3.4", 15) == 1
+            assert add_failed_attempt("a@b.com", "1.2.3.4", 15) == 2
+            assert count_failed_attempts("a@b.com", "5.6.7.8", 15) == 0
+        with patch("services.login_attempt_counter.time.time", return_value=1000.0 + 15 * 60 + 1):
+            assert count_failed_attempts("a@b.com", "1.2.3.4", 15) == 0
+
+    def test_login_uses_counter_and_batches_archive(self, fake_redis, client, test_user, db_session):
+        for _ in range(MAX_ATTEMPTS):
+            assert _login(client, "errada").status_code == 401
+        assert _login(client, "Test1234!").status_code == 429
+        # Nada foi gravado por requisição; o arquivo sai em um INSERT em lote
+        assert db_session.query(models.UserLoginAttempt).count() == 0
+        assert pending_login_attempts() == MAX_ATTEMPTS
+        assert flush_login_attempts(db_session) == MAX_ATTEMPTS
+        assert db_session.query(models.UserLoginAttempt).filter_by(success=False).count() == MAX_ATTEMPTS
+
+    def test_success_resets_counter_and_keeps_archive(self, fake_redis, client, test_user, db_session):
+        assert _login(client, "errada").status_code == 401
+        assert _login(client, "Test1234!").status_code == 200
+        assert not fake_redis.zsets
+        flush_login_attempts(db_session)
+        assert db_session.query(models.UserLoginAttempt).count() == 2
+
+    def test_fallback_to_archive_without_redis(self, fake_redis, client, test_user, db_session, monkeypatch):
+        monkeypatch.setattr(login_attempt_counter, "is_redis_available", lambda: False)
+        for _ in range(2):
+            assert _login(client, "errada").status_code == 401
+        assert main.get_failed_attempts_count(db_session, "test@example.com", "testclient") == 2
+        assert _login(client, "Test1234!").status_code == 200
+        # As falhas seguem no arquivo, mas não contam após o login bem-sucedido
+        assert main.get_failed_attempts_count(db_session, "test@example.com", "testclient") == 0
+        assert db_session.query(models.UserLoginAttempt).filter_by(success=False).count() == 2
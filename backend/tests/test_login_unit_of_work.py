@@ -0,0 +1,76 @@
+"""
+Testes da unidade de trabalho do login (um único commit por login).
+"""
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import event
+
+import main
+import models
+
+
+@pytest.fixture
+def commits(db_session):
+    counter = {"commits": 0}
+    engine = db_session.get_bind()
+
+    def on_commit(conn):
+        counter["commits"] += 1
+
+    event.listen(engine, "commit", on_commit)
+    yield counter
+    event.remove(engine, "commit", on_commit)
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch):
+    monkeypatch.setattr(main.limiter, "enabled", False)
+
+
+def _login(client, device_id="device-uow"):
+    return client.post("/api/auth/login", json={
+        "email": "test@example.com",
+        "password": "Test1234!",
+        "device": {"device_id": device_id, "device_name": "Celular"},
+    })
+
+
+class TestLoginUnitOfWork:
+    """Testes do login em transação única"""
+
+    def test_login_commits_once_and_persists_everything(self, client, test_profile, db_session, commits):
+        with patch("main.send_login_notification") as notify:
+            response = _login(client)
+        assert response.status_code == 200, response.text
+        assert commits["commits"] == 1
+
+        user_id = response.json()["user"]["id"]
+        db_session.expire_all()
+        assert db_session.query(models.UserSession).filter_by(user_id=user_id, device_id="device-uow").count() == 1
+        assert db_session.query(models.UserLoginEvent).filter_by(user_id=user_id).count() == 1
+        assert db_session.query(models.RefreshToken).filter_by(user_id=user_id).count() == 1
+        assert db_session.query(models.UserLoginAttempt).filter_by(email="test@example.com", success=True).count() == 1
+        assert db_session.get(models.User, user_id).last_login_at is not None
+        # Notificação de novo dispositivo enviada após o commit
+        notify.assert_called_once()
+
+    def test_blocked_device_writes_nothing(self, client, test_profile, db_session, commits):
+        assert _login(client).status_code == 200
+        session = db_session.query(models.UserSession).filter_by(device_id="device-uow").one()
+        session.blocked = True
+        db_session.commit()
+        commits["commits"] = 0
+
+        response = _login(client)
+        assert response.status_code == 403
+        assert commits["commits"] == 0
+        assert db_session.query(models.UserLoginEvent).count() == 1
+
+    def test_suspicious_login_from_second_ip(self, client, test_profile, db_session):
+        user_id = db_session.query(models.User).one().id
+        db_session.add(models.UserLoginEvent(user_id=user_id, device_id="outro", ip_address="10.9.9.9"))
+        db_session.commit()
+        with patch("main.send_suspicious_login_alert") as alert, patch("main.send_login_notification"):
+            assert _login(client).status_code == 200
+        alert.assert_called_once()
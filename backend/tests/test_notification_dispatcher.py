@@ -0,0 +1,124 @@
+"""
+Testes da fila de notificações (push Expo em lote, retry e deduplicação)
+contra um servidor Expo local.
+"""
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+
+import services.notification_dispatcher as notification_dispatcher
+from notification_service import _deliver_email, send_login_blocked_alert, send_push_notification
+from services.notification_dispatcher import (
+    clear_notification_queue,
+    dispatch_pending,
+    get_notification_dispatcher_stats,
+    pending_notifications,
+)
+
+
+class MockExpo:
+    """Servidor Expo local: registra os lotes e responde com os status programados."""
+
+    def __init__(self):
+        self.batches = []
+        self.statuses = []
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                messages = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                mock.batches.append(messages)
+                status = mock.statuses.pop(0) if mock.statuses else 200
+                payload = {"data": [{"status": "ok", "id": str(i)} for i in range(len(messages))]}
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/--/api/v2/push/send"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def expo(monkeypatch):
+    mock = MockExpo()
+    monkeypatch.setattr(notification_dispatcher, "NOTIFICATION_DISPATCHER_ENABLED", True)
+    monkeypatch.setattr(notification_dispatcher, "EXPO_PUSH_URL", mock.url)
+    monkeypatch.setattr(notification_dispatcher, "NOTIFICATION_RETRY_BASE_SECONDS", 0)
+    monkeypatch.setattr(notification_dispatcher, "is_redis_available", lambda: False)
+    clear_notification_queue()
+    yield mock
+    clear_notification_queue()
+    mock.close()
+
+
+class TestNotificationDispatcher:
+    """Testes do dispatcher de notificações"""
+
+    def test_push_batched_up_to_expo_limit(self, expo):
+        for i in range(150):
+            send_push_notification(f"ExponentPushToken[{i}]", "Novo login detectado", "Revise no app.")
+        # Nada sai durante a requisição; o worker envia em lotes de 100
+        assert expo.batches == []
+        assert dispatch_pending() == 150
+        assert [len(batch) for batch in expo.batches] == [100, 50]
+        assert pending_notifications() == 0
+
+    def test_identical_alerts_deduplicated(self, expo):
+        for _ in range(3):
+            send_push_notification("ExponentPushToken[a]", "Login bloqueado", "Muitas tentativas.")
+        send_push_notification("ExponentPushToken[b]", "Login bloqueado", "Muitas tentativas.")
+        dispatch_pending()
+        assert [message["to"] for message in expo.batches[0]] == ["ExponentPushToken[a]", "ExponentPushToken[b]"]
+        assert get_notification_dispatcher_stats()["deduplicated"] >= 2
+
+    def test_retry_with_backoff_after_server_error(self, expo):
+        expo.statuses = [503]
+        send_push_notification("ExponentPushToken[r]", "Titulo", "Texto")
+        dispatch_pending()
+        assert pending_notifications() == 1
+        dispatch_pending()
+        assert pending_notifications() == 0
+        assert len(expo.batches) == 2
+
+    def test_email_alert_enqueued_not_sent_inline(self, expo):
+        with patch("notification_service.smtp_configured", return_value=True), \
+                patch("services.notification_dispatcher.deliver_emails", return_value=[True]) as send:
+            send_login_blocked_alert("user@example.com", "10.0.0.1", "pytest")
+            send_login_blocked_alert("user@example.com", "10.0.0.1", "pytest")
+            send.assert_not_called()
+            assert dispatch_pending() == 1
+        send.assert_called_once()
+
+    def test_email_without_smtp_is_not_enqueued(self, expo):
+        with patch("notification_service.smtp_configured", return_value=False), \
+                patch("email_service.smtp_configured", return_value=False), \
+                patch("email_service.logger") as email_logger:
+            _deliver_email("user@example.com", "Assunto", "Texto")
+        assert pending_notifications() == 0
+        email_logger.warning.assert_called_once()
+
+    def test_enqueue_from_thread_wakes_worker(self, expo):
+        async def scenario():
+            await notification_dispatcher.wait_for_notifications(0)
+            waiter = asyncio.create_task(notification_dispatcher.wait_for_notifications(30))
+            await asyncio.sleep(0)
+            await asyncio.to_thread(send_push_notification, "ExponentPushToken[w]", "Titulo", "Texto")
+            await asyncio.wait_for(waiter, 5)
+
+        asyncio.run(scenario())
+        assert pending_notifications() == 1
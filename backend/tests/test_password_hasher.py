@@ -0,0 +1,60 @@
+"""
+Testes do hash de senhas em pool de processos (bcrypt).
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+import services.password_hasher as password_hasher
+from auth import authenticate_user
+from models import User
+
+
+@pytest.fixture
+def fast_rounds(monkeypatch):
+    context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=4)
+    monkeypatch.setattr(password_hasher, "pwd_context", context)
+    return context
+
+
+class TestPasswordHasher:
+    """Testes do pool de hash de senha"""
+
+    def test_rehash_on_login_when_rounds_change(self, fast_rounds, db_session):
+        old_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=5).hash("Senha123!")
+        user = User(email="rehash@test.com", password_hash=old_hash, is_active=True)
+        db_session.add(user)
+        db_session.commit()
+
+        assert authenticate_user(db_session, "rehash@test.com", "Senha123!") is user
+        db_session.commit()
+        db_session.refresh(user)
+        assert user.password_hash != old_hash
+        assert user.password_hash.startswith("$2b$04$")
+        assert authenticate_user(db_session, "rehash@test.com", "errada") is None
+
+    def test_full_queue_rejects_with_503(self, monkeypatch):
+        monkeypatch.setattr(password_hasher, "PASSWORD_HASH_POOL_ENABLED", True)
+        monkeypatch.setattr(password_hasher, "PASSWORD_HASH_MAX_PENDING", 0)
+        before = password_hasher.get_password_hasher_metrics()["rejected"]
+        with pytest.raises(HTTPException) as exc:
+            password_hasher.hash_password("Senha123!")
+        assert exc.value.status_code == 503
+        assert password_hasher.get_password_hasher_metrics()["rejected"] == before + 1
+
+    def test_async_api_inline(self, fast_rounds):
+        hashed = asyncio.run(password_hasher.hash_password_async("Senha123!"))
+        assert asyncio.run(password_hasher.verify_password_async("Senha123!", hashed))
+        assert not asyncio.run(password_hasher.verify_password_async("errada", hashed))
+
+    def test_process_pool_round_trip(self, monkeypatch):
+        monkeypatch.setattr(password_hasher, "PASSWORD_HASH_POOL_ENABLED", True)
+        monkeypatch.setattr(password_hasher, "PASSWORD_HASH_WORKERS", 1)
+        try:
+            hashed = password_hasher.hash_password("Senha123!")
+            assert password_hasher.verify_password("Senha123!", hashed)
+            assert password_hasher.get_password_hasher_metrics()["submitted"] >= 2
+        finally:
+            password_hasher.shutdown_password_hasher()
@@ -0,0 +1,127 @@
+"""
+Testes do resolvedor de permissões em consulta única.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event
+
+from models import User, Family, FamilyProfile, FamilyCaregiver, FamilyDataShare
+from services.permission_service import check_permission, load_access_grants
+from utils.rbac import ACTION_VIEW, ACTION_EDIT, ACTION_DELETE
+
+
+@pytest.fixture
+def family_setup(db_session):
+    """Família com admin, adulto (com perfil próprio) e perfil alvo"""
+    admin = User(email="admin@perm.com", password_hash="x", is_active=True, email_verified=True,
+                 account_type="family_admin")
+    member = User(email="adulto@perm.com", password_hash="x", is_active=True, email_verified=True,
+                  account_type="adult_member")
+    db_session.add_all([admin, member])
+    db_session.commit()
+    family = Family(name="Familia", admin_user_id=admin.id)
+    db_session.add(family)
+    db_session.commit()
+    admin.family_id = family.id
+    member.family_id = family.id
+    own = FamilyProfile(family_id=family.id, name="Adulto", account_type="adult_member", created_by=member.id)
+    target = FamilyProfile(family_id=family.id, name="Alvo", account_type="adult_member", created_by=admin.id)
+    db_session.add_all([own, target])
+    db_session.commit()
+    return {"admin": admin, "member": member, "own": own, "target": target, "family": family}
+
+
+def _count_statements(db_session):
+    statements = []
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db_session.get_bind()
+    event.listen(engine, "before_cursor_execute", before_execute)
+    return statements, lambda: event.remove(engine, "before_cursor_execute", before_execute)
+
+
+class TestSingleQuery:
+    """O resolvedor usa uma única consulta"""
+
+    def test_one_statement_per_check(self, db_session, family_setup):
+        member = family_setup["member"]
+        own_id = family_setup["own"].id
+        # Carregar atributos expirados antes de contar
+        member.account_type, member.family_id
+        statements, stop = _count_statements(db_session)
+        try:
+            check_permission(member, ACTION_VIEW, own_id, db_session)
+        finally:
+            stop()
+        assert len(statements) == 1
+
+    def test_grants_loaded(self, db_session, family_setup):
+        grants = load_access_grants(family_setup["member"], family_setup["target"].id, db_session)
+        assert grants.target_in_family
+        assert grants.own_profile_id == family_setup["own"].id
+        assert grants.caregiver_access_level is None
+        assert grants.data_share is None
+
+
+class TestDecisions:
+    """Decisões equivalentes às regras RBAC"""
+
+    def test_admin_only_within_family(self, db_session, family_setup):
+        admin = family_setup["admin"]
+        assert check_permission(admin, ACTION_DELETE, family_setup["target"].id, db_session)
+        with pytest.raises(HTTPException) as exc:
+            check_permission(admin, ACTION_VIEW, 99999, db_session)
+        assert exc.value.detail == "Perfil não pertence à família"
+
+    def test_own_profile(self, db_session, family_setup):
+        member = family_setup["member"]
+        own_id = family_setup["own"].id
+        assert check_permission(member, ACTION_VIEW, own_id, db_session)
+        assert check_permission(member, ACTION_EDIT, own_id, db_session)
+        with pytest.raises(HTTPException) as exc:
+            check_permission(member, ACTION_DELETE, own_id, db_session)
+        assert exc.value.detail == "Sem permissão para deletar"
+
+    def test_caregiver_read_only(self, db_session, family_setup):
+        member = family_setup["member"]
+        target_id = family_setup["target"].id
+        db_session.add(FamilyCaregiver(profile_id=target_id, caregiver_user_id=member.id, access_level="read_only"))
+        db_session.commit()
+        assert check_permission(member, ACTION_VIEW, target_id, db_session)
+        with pytest.raises(HTTPException) as exc:
+            check_permission(member, ACTION_EDIT, target_id, db_session)
+        assert "read_only" in exc.value.detail
+
+    def test_data_share_permissions(self, db_session, family_setup):
+        member = family_setup["member"]
+        target_id = family_setup["target"].id
+        db_session.add(FamilyDataShare(
+            family_id=family_setup["family"].id,
+            from_profile_id=target_id,
+            to_profile_id=family_setup["own"].id,
+            permissions={"can_view": True, "can_edit": False}
+        ))
+        db_session.commit()
+        assert check_permission(member, ACTION_VIEW, target_id, db_session)
+        with pytest.raises(HTTPException) as exc:
+            check_permission(member, ACTION_EDIT, target_id, db_session)
+        assert exc.value.detail == "Sem permissão para editar"
+
+    def test_revoked_share_ignored(self, db_session, family_setup):
+        member = family_setup["member"]
+        target_id = family_setup["target"].id
+        db_session.add(FamilyDataShare(
+            family_id=family_setup["family"].id,
+            from_profile_id=target_id,
+            to_profile_id=family_setup["own"].id,
+            permissions={"can_view": True, "can_edit": True},
+            revoked_at=datetime.now() - timedelta(days=1)
+        ))
+        db_session.commit()
+        with pytest.raises(HTTPException) as exc:
+            check_permission(member, ACTION_EDIT, target_id, db_session)
+        assert exc.value.detail == "Sem permissão para edit neste recurso"
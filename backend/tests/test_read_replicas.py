@@ -0,0 +1,112 @@
+"""
+Testes para roteamento de leituras para réplicas.
+"""
+import itertools
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+import database
+
+
+@pytest.fixture
+def replica_setup(tmp_path, monkeypatch):
+    """Primário e réplica em arquivos SQLite separados"""
+    primary = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    for target, name in ((primary, "primary"), (replica, "replica")):
+        with target.begin() as conn:
+            conn.execute(text("CREATE TABLE origem (nome TEXT)"))
+            conn.execute(text("INSERT INTO origem VALUES (:nome)"), {"nome": name})
+
+    monkeypatch.setattr(database, "replica_engines", [replica])
+    monkeypatch.setattr(database, "_replica_cycle", itertools.cycle([0]))
+    monkeypatch.setattr(database, "_primary_pins", {})
+    monkeypatch.setattr(database, "_shared_pins", {})
+    factory = sessionmaker(class_=database.RoutingSession, bind=primary)
+    yield factory
+    primary.dispose()
+    replica.dispose()
+
+
+def _origin(db):
+    return db.execute(text("SELECT nome FROM origem")).scalar()
+
+
+class TestReplicaRouting:
+    """Testes do RoutingSession"""
+
+    def test_replica_route_prefixes(self, replica_setup):
+        assert database.is_replica_route("GET", "/api/medications")
+        assert database.is_replica_route("GET", "/api/analytics/dashboard")
+        assert database.is_replica_route("GET", "/api/compliance/audit-logs")
+        assert not database.is_replica_route("POST", "/api/medications")
+        assert not database.is_replica_route("GET", "/api/family/profiles")
+
+    def test_reads_go_to_replica(self, replica_setup):
+        db = replica_setup()
+        db.info["read_replica"] = True
+        try:
+            assert _origin(db) == "primary"
+            assert database.use_read_replica(db, user_id=1)
+            assert _origin(db) == "replica"
+        finally:
+            db.close()
+
+    def test_non_replica_route_stays_on_primary(self, replica_setup):
+        db = replica_setup()
+        try:
+            assert not database.use_read_replica(db, user_id=1)
+            assert _origin(db) == "primary"
+        finally:
+            db.close()
+
+    def test_write_pins_user_to_primary(self, replica_setup):
+        """Após uma escrita, o usuário lê do primário durante a janela"""
+        writer = replica_setup()
+        writer.info["user_id"] = 7
+        writer.info["wrote"] = True
+        writer.commit()
+        writer.close()
+
+        assert database.is_pinned_to_primary(7)
+        reader = replica_setup()
+        reader.info["read_replica"] = True
+        try:
+            assert not database.use_read_replica(reader, user_id=7)
+            assert _origin(reader) == "primary"
+        finally:
+            reader.close()
+
+    def test_audit_write_does_not_pin_user(self, replica_setup):
+        """Escritas em tabelas não servidas por réplicas (auditoria) não fixam o usuário"""
+        from models import AuditLog, Medication
+
+        writer = replica_setup()
+        writer.info["user_id"] = 8
+        writer.add(AuditLog(user_id=8, action_type="view", resource_type="medication"))
+        database._mark_session_wrote(writer, None)
+        assert writer.info["flushed"] and not writer.info.get("wrote")
+        writer.expunge_all()
+
+        writer.add(Medication(name="Dipirona", profile_id=1))
+        database._mark_session_wrote(writer, None)
+        assert writer.info["wrote"]
+        writer.close()
+
+    def test_pin_from_other_worker_read_from_shared_index(self, replica_setup, monkeypatch):
+        """Pins de outros workers vêm do índice no Redis, relido no máximo a cada intervalo"""
+        import time
+        from unittest.mock import MagicMock
+
+        client = MagicMock()
+        client.zrangebyscore.return_value = [(b"9", time.time() + 5)]
+        monkeypatch.setattr("config.redis_config.is_redis_available", lambda: True)
+        monkeypatch.setattr("config.redis_config.get_redis_client", lambda: client)
+        monkeypatch.setattr(database, "_shared_pins_synced_at", 0.0)
+        monkeypatch.setattr(database, "DATABASE_PIN_SYNC_SECONDS", 60)
+
+        assert database.is_pinned_to_primary(9)
+        assert not database.is_pinned_to_primary(10)
+        assert client.zrangebyscore.call_count == 1
@@ -0,0 +1,65 @@
+"""
+Testes do conjunto de IPs recentes por usuário (detecção de login suspeito).
+"""
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy import event
+
+import services.recent_login_ips as recent_login_ips
+from login_security import has_suspicious_login_pattern
+from services.recent_login_ips import clear_recent_login_ips, has_other_recent_ip, record_login_ip
+from session_service import log_login_event
+
+
+@pytest.fixture
+def recent_ips(monkeypatch):
+    monkeypatch.setattr(recent_login_ips, "RECENT_LOGIN_IPS_ENABLED", True)
+    monkeypatch.setattr(recent_login_ips, "is_redis_available", lambda: False)
+    clear_recent_login_ips()
+    yield
+    clear_recent_login_ips()
+
+
+class TestRecentLoginIps:
+    """Testes dos IPs recentes de login"""
+
+    def test_local_fallback_window(self, recent_ips):
+        record_login_ip(1, "10.0.0.1")
+        assert not has_other_recent_ip(1, "10.0.0.1", 60)
+        assert has_other_recent_ip(1, "10.0.0.2", 60)
+        assert not has_other_recent_ip(2, "10.0.0.2", 60)
+
+        record_login_ip(3, "10.0.0.1", time.time() - 2 * 3600)
+        assert not has_other_recent_ip(3, "10.0.0.2", 60)
+
+    def test_redis_answer_excludes_current_ip(self, recent_ips, monkeypatch):
+        client = MagicMock()
+        monkeypatch.setattr(recent_login_ips, "is_redis_available", lambda: True)
+        monkeypatch.setattr(recent_login_ips, "get_redis_client", lambda: client)
+        pipe = client.pipeline.return_value
+
+        pipe.execute.return_value = [1, time.time()]
+        assert not has_other_recent_ip(1, "10.0.0.1", 60)
+        pipe.execute.return_value = [2, time.time()]
+        assert has_other_recent_ip(1, "10.0.0.1", 60)
+        pipe.execute.return_value = [1, None]
+        assert has_other_recent_ip(1, "10.0.0.1", 60)
+
+    def test_login_events_feed_suspicious_check(self, recent_ips, test_user, db_session):
+        log_login_event(db_session, test_user.id, None, "203.0.113.7", "pytest")
+        selects = []
+
+        def before_execute(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("SELECT") and "FROM user_login_events" in statement:
+                selects.append(statement)
+
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", before_execute)
+        try:
+            assert has_suspicious_login_pattern(db_session, test_user.id, "198.51.100.1")
+            assert not has_suspicious_login_pattern(db_session, test_user.id, "203.0.113.7")
+        finally:
+            event.remove(engine, "before_cursor_execute", before_execute)
+        assert selects == []
@@ -3,11 +3,18 @@ Testes TDD para conexão Redis.
 """
 import pytest
 from unittest.mock import Mock, patch, MagicMock
+import config.redis_config
 from config.redis_config import (
     get_redis_client,
     is_redis_available,
     get_redis_connection_string,
-    reset_redis_connection
+    reset_redis_connection,
+    probe_redis,
+    get_redis_metrics,
+    CircuitBreaker,
+    BREAKER_CLOSED,
+    BREAKER_OPEN,
+    BREAKER_HALF_OPEN,
 )
 
 
@@ -74,10 +81,6 @@ class TestRedisConnection:
     @patch('config.redis_config.get_redis_client')
     def test_is_redis_available_true(self, mock_get_client):
         """Testa verificação de disponibilidade quando Redis está disponível."""
-        # Forçar _redis_available para True
-        import config.redis_config
-        config.redis_config._redis_available = True
-        
         mock_client = MagicMock()
         mock_client.ping.return_value = True
         mock_get_client.return_value = mock_client
@@ -85,7 +88,8 @@ class TestRedisConnection:
         result = is_redis_available()
         
         assert result is True
-        mock_client.ping.assert_called_once()
+        # Disponibilidade não faz PING por chamada (health check em segundo plano)
+        mock_client.ping.assert_not_called()
     
     @patch('config.redis_config.get_redis_client')
     def test_is_redis_available_false(self, mock_get_client):
@@ -94,15 +98,72 @@ class TestRedisConnection:
         
         assert is_redis_available() is False
     
-    @patch('config.redis_config.get_redis_client')
-    def test_is_redis_available_ping_fails(self, mock_get_client):
-        """Testa verificação quando ping falha."""
+    @patch('config.redis_config.redis.Redis')
+    def test_is_redis_available_ping_fails(self, mock_redis_class):
+        """Testa que falhas no health check abrem o circuito."""
+        reset_redis_connection()
         mock_client = MagicMock()
-        mock_client.ping.side_effect = Exception("Ping failed")
-        mock_get_client.return_value = mock_client
-        
+        mock_redis_class.return_value = mock_client
+        assert is_redis_available() is True
+
+        from redis.exceptions import ConnectionError
+        mock_client.ping.side_effect = ConnectionError("Ping failed")
+        for _ in range(config.redis_config.REDIS_BREAKER_FAILURE_THRESHOLD):
+            probe_redis()
+
         assert is_redis_available() is False
+        assert get_redis_metrics()["breaker_state"] == BREAKER_OPEN
+        reset_redis_connection()
+
+    @patch('config.redis_config.redis.Redis')
+    def test_cached_client_returned_without_ping(self, mock_redis_class):
+        """Testa que o cliente em cache é reutilizado sem PING adicional."""
+        reset_redis_connection()
+        mock_client = MagicMock()
+        mock_redis_class.return_value = mock_client
+
+        for _ in range(5):
+            assert get_redis_client() is mock_client
+        mock_client.ping.assert_called_once()
+        reset_redis_connection()
+
+    @patch('config.redis_config.redis.Redis')
+    def test_open_circuit_short_circuits(self, mock_redis_class):
+        """Testa que com o circuito aberto não há novas tentativas de conexão."""
+        reset_redis_connection()
+        from redis.exceptions import ConnectionError
+        mock_redis_class.side_effect = ConnectionError("Connection refused")
+
+        for _ in range(config.redis_config.REDIS_BREAKER_FAILURE_THRESHOLD):
+            assert get_redis_client() is None
+        attempts = mock_redis_class.call_count
+        for _ in range(10):
+            assert get_redis_client() is None
+        assert mock_redis_class.call_count == attempts
+        assert get_redis_metrics()["short_circuits"] == 10
+        reset_redis_connection()
     
+    @patch('config.redis_config.redis.Redis')
+    def test_background_probe_owns_half_open(self, mock_redis_class, monkeypatch):
+        """Com o loop de probe ativo, só ele tenta reconectar (half_open)."""
+        reset_redis_connection()
+        monkeypatch.setattr(config.redis_config._breaker, "reset_seconds", 0)
+        for _ in range(config.redis_config.REDIS_BREAKER_FAILURE_THRESHOLD):
+            config.redis_config.record_redis_failure()
+        config.redis_config.set_background_probe(True)
+        try:
+            mock_client = MagicMock()
+            mock_client.ping.return_value = True
+            mock_redis_class.return_value = mock_client
+            assert get_redis_client() is None
+            mock_redis_class.assert_not_called()
+
+            assert probe_redis() is True
+            assert get_redis_client() is mock_client
+        finally:
+            config.redis_config.set_background_probe(False)
+            reset_redis_connection()
+
     def test_reset_redis_connection(self):
         """Testa reset da conexão Redis."""
         reset_redis_connection()
@@ -115,5 +176,36 @@ class TestRedisConnection:
             pass  # Esperado se Redis não estiver rodando
 
 
+class TestCircuitBreaker:
+    """Testes das transições do circuit breaker."""
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+        breaker.record_failure()
+        assert breaker.state == BREAKER_CLOSED
+        breaker.record_failure()
+        assert breaker.state == BREAKER_OPEN
+        assert breaker.allow_attempt() is False
+
+    def test_half_open_after_reset(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+        breaker.record_failure()
+        assert breaker.allow_attempt() is True
+        assert breaker.state == BREAKER_HALF_OPEN
+        # Apenas uma tentativa enquanto meio aberto
+        assert breaker.allow_attempt() is False
+
+    def test_half_open_failure_reopens_and_success_closes(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+        breaker.record_failure()
+        breaker.allow_attempt()
+        breaker.record_failure()
+        assert breaker.state == BREAKER_OPEN
+        breaker.allow_attempt()
+        breaker.record_success()
+        assert breaker.state == BREAKER_CLOSED
+        assert breaker.failures == 0
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
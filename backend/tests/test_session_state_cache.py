@@ -0,0 +1,152 @@
+"""
+Testes do cache write-through do estado das sessões de dispositivo.
+"""
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import models
+import schemas
+import services.session_state_cache as session_state_cache
+import session_service
+from services.session_state_cache import NO_ACTIVE_SESSION, clear_session_state_cache, get_cached_session_state
+from session_service import (
+    get_session_state,
+    is_device_blocked,
+    mark_session_blocked,
+    mark_session_trusted,
+    revoke_sessions,
+    upsert_session,
+)
+
+
+@pytest.fixture
+def cache_enabled(monkeypatch):
+    monkeypatch.setattr(session_state_cache, "SESSION_STATE_CACHE_ENABLED", True)
+    monkeypatch.setattr(session_state_cache, "is_redis_available", lambda: False)
+    clear_session_state_cache()
+    yield
+    clear_session_state_cache()
+
+
+class FakeRedis:
+    """Redis mínimo (get/set NX/setex/delete) com TTL."""
+
+    def __init__(self):
+        self.values = {}
+
+    def _alive(self, key):
+        item = self.values.get(key)
+        if item is not None and item[1] <= time.monotonic():
+            del self.values[key]
+            item = None
+        return item
+
+    def get(self, key):
+        item = self._alive(key)
+        return item[0] if item else None
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and self._alive(key):
+            return None
+        self.values[key] = (value, time.monotonic() + ex)
+        return True
+
+    def setex(self, key, ttl, value):
+        self.values[key] = (value, time.monotonic() + ttl)
+        return True
+
+    def delete(self, key):
+        return 1 if self.values.pop(key, None) else 0
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = FakeRedis()
+    monkeypatch.setattr(session_state_cache, "is_redis_available", lambda: True)
+    monkeypatch.setattr(session_state_cache, "get_redis_client", lambda: client)
+    return client
+
+
+def _race_revoke_during_read(monkeypatch, db_session, user, session):
+    """Revogação commitada (e gravada no cache) enquanto a leitura do banco está em andamento."""
+    stale = SimpleNamespace(id=session.id, revoked_at=None, blocked=False, trusted=False, trust_expires_at=None)
+
+    def racing_read(db, user_id, device_id):
+        revoke_sessions(db_session, user_id, device_id=device_id)
+        return stale
+
+    monkeypatch.setattr(session_service, "_active_session", racing_read)
+
+
+def _device(device_id="device-1"):
+    return schemas.DeviceInfo(device_id=device_id, device_name="Celular")
+
+
+class TestSessionStateCache:
+    """Testes do estado de sessão em cache"""
+
+    def test_upsert_writes_state_and_check_skips_database(self, cache_enabled, test_user, db_session, statements):
+        session, is_new = upsert_session(db_session, test_user.id, _device(), "127.0.0.1", "pytest")
+        assert is_new
+        user_id, session_id = test_user.id, session.id
+        statements.clear()
+        state = get_session_state(db_session, user_id, "device-1")
+        assert state.session_id == session_id
+        assert state.is_valid
+        assert not is_device_blocked(db_session, user_id, "device-1")
+        assert statements == []
+
+    def test_block_and_trust_are_written_through(self, cache_enabled, test_user, db_session, statements):
+        session, _ = upsert_session(db_session, test_user.id, _device(), None, None)
+        mark_session_trusted(db_session, test_user.id, session.id, None, True)
+        mark_session_blocked(db_session, test_user.id, None, "device-1", True)
+        user_id = test_user.id
+        statements.clear()
+        state = get_session_state(db_session, user_id, "device-1")
+        assert state.blocked and not state.is_valid
+        assert state.is_trusted
+        assert is_device_blocked(db_session, user_id, "device-1")
+        assert statements == []
+
+    def test_revoke_caches_missing_session_and_upsert_skips_lookup(self, cache_enabled, test_user, db_session):
+        first, _ = upsert_session(db_session, test_user.id, _device(), None, None)
+        assert revoke_sessions(db_session, test_user.id, device_id="device-1") == 1
+        assert get_cached_session_state(test_user.id, "device-1") == NO_ACTIVE_SESSION
+
+        second, is_new = upsert_session(db_session, test_user.id, _device(), None, None)
+        assert is_new and second.id != first.id
+        assert get_session_state(db_session, test_user.id, "device-1").session_id == second.id
+
+    def test_marking_revoked_row_does_not_hide_active_session(self, cache_enabled, test_user, db_session):
+        first, _ = upsert_session(db_session, test_user.id, _device(), None, None)
+        revoke_sessions(db_session, test_user.id, device_id="device-1")
+        second, _ = upsert_session(db_session, test_user.id, _device(), None, None)
+        mark_session_trusted(db_session, test_user.id, first.id, None, True)
+        assert get_cached_session_state(test_user.id, "device-1") is None
+        assert get_session_state(db_session, test_user.id, "device-1").session_id == second.id
+
+    def test_unknown_device_is_not_valid(self, cache_enabled, test_user, db_session):
+        state = get_session_state(db_session, test_user.id, "desconhecido")
+        assert state == NO_ACTIVE_SESSION
+        assert not state.is_valid
+
+    def test_read_through_fill_does_not_overwrite_revoke(self, cache_enabled, test_user, db_session, monkeypatch):
+        session, _ = upsert_session(db_session, test_user.id, _device(), None, None)
+        clear_session_state_cache()
+        _race_revoke_during_read(monkeypatch, db_session, test_user, session)
+        assert get_session_state(db_session, test_user.id, "device-1").is_valid
+        assert get_cached_session_state(test_user.id, "device-1") == NO_ACTIVE_SESSION
+
+    def test_read_through_fill_is_set_nx_in_redis(self, cache_enabled, redis, test_user, db_session, monkeypatch):
+        session, _ = upsert_session(db_session, test_user.id, _device(), None, None)
+        clear_session_state_cache()
+        redis.values.clear()
+        _race_revoke_during_read(monkeypatch, db_session, test_user, session)
+        skipped = session_state_cache.get_session_state_cache_stats()["fills_skipped"]
+        get_session_state(db_session, test_user.id, "device-1")
+        # Outro worker (sem nível local) vê a revogação, não o estado lido antes dela
+        clear_session_state_cache()
+        assert get_cached_session_state(test_user.id, "device-1") == NO_ACTIVE_SESSION
+        assert session_state_cache.get_session_state_cache_stats()["fills_skipped"] == skipped + 1
@@ -4,6 +4,7 @@ Testes TDD para blacklist de tokens JWT.
 import pytest
 from unittest.mock import Mock, patch, MagicMock
 from datetime import datetime, timezone, timedelta
+import services.token_blacklist as token_blacklist
 from services.token_blacklist import (
     add_to_blacklist,
     is_blacklisted,
@@ -49,11 +50,28 @@ class TestTokenBlacklist:
         result = add_to_blacklist(sample_token, 1800)  # 30 minutos
         
         assert result is True
-        mock_redis_client.setex.assert_called_once()
-        call_args = mock_redis_client.setex.call_args
+        mock_redis_client.pipeline.assert_called_once_with(transaction=True)
+        pipe = mock_redis_client.pipeline.return_value
+        pipe.setex.assert_called_once()
+        call_args = pipe.setex.call_args
         assert "blacklist:token:" in call_args[0][0]  # Chave contém prefixo
         assert call_args[0][1] == 1800  # TTL correto
         assert call_args[0][2] == "1"  # Valor
+        pipe.zadd.assert_called_once()
+        pipe.incr.assert_called_once()
+        pipe.execute.assert_called_once()
+
+    @patch('services.token_blacklist.get_redis_client')
+    @patch('services.token_blacklist.is_redis_available', return_value=True)
+    def test_add_to_blacklist_failed_transaction_skips_mirror(self, mock_available, mock_get_client,
+                                                              mock_redis_client, sample_token):
+        """Falha na transação não marca o token no espelho local."""
+        token_blacklist._mirror.reset()
+        mock_get_client.return_value = mock_redis_client
+        mock_redis_client.pipeline.return_value.execute.side_effect = ConnectionError("redis fora")
+
+        assert add_to_blacklist(sample_token, 1800) is False
+        assert not token_blacklist._mirror.contains(_hash_token(sample_token))
     
     @patch('services.token_blacklist.is_redis_available', return_value=False)
     def test_add_to_blacklist_redis_unavailable(self, mock_available, sample_token):
@@ -98,29 +116,38 @@ class TestTokenBlacklist:
     def test_remove_from_blacklist(self, mock_available, mock_get_client, mock_redis_client, sample_token):
         """Testa remoção de token da blacklist."""
         mock_get_client.return_value = mock_redis_client
+        pipe = mock_redis_client.pipeline.return_value
+        pipe.execute.return_value = [1, 1, 2]
         
         result = remove_from_blacklist(sample_token)
         
         assert result is True
-        mock_redis_client.delete.assert_called_once()
+        mock_redis_client.pipeline.assert_called_once_with(transaction=True)
+        pipe.delete.assert_called_once_with(f"blacklist:token:{_hash_token(sample_token)}")
+        pipe.zrem.assert_called_once()
+        pipe.incr.assert_called_once()
+        mock_redis_client.delete.assert_not_called()
     
     @patch('services.token_blacklist.get_redis_client')
     @patch('services.token_blacklist.is_redis_available', return_value=True)
     def test_clear_all_blacklist(self, mock_available, mock_get_client, mock_redis_client):
         """Testa limpeza de toda a blacklist."""
         mock_get_client.return_value = mock_redis_client
-        mock_redis_client.keys.return_value = [
+        mock_redis_client.scan_iter.return_value = iter([
             "blacklist:token:hash1",
             "blacklist:token:hash2",
             "blacklist:token:hash3"
-        ]
+        ])
         mock_redis_client.delete.return_value = 3
         
         result = clear_all_blacklist()
         
         assert result == 3
-        mock_redis_client.keys.assert_called_once()
-        mock_redis_client.delete.assert_called_once()
+        mock_redis_client.scan_iter.assert_called_once()
+        mock_redis_client.keys.assert_not_called()
+        mock_redis_client.delete.assert_called_once_with(
+            "blacklist:token:hash1", "blacklist:token:hash2", "blacklist:token:hash3"
+        )
     
     def test_hash_token_consistency(self, sample_token):
         """Testa que hash de token é consistente."""
@@ -141,6 +168,65 @@ class TestTokenBlacklist:
         assert hash1 != hash2
 
 
+class TestBlacklistMirror:
+    """Testes do espelho local da blacklist."""
+
+    @pytest.fixture(autouse=True)
+    def mirror(self, monkeypatch):
+        import services.token_blacklist as token_blacklist
+        monkeypatch.setattr(token_blacklist, "BLACKLIST_MIRROR_ENABLED", True)
+        token_blacklist.reset_blacklist_mirror()
+        yield token_blacklist
+        token_blacklist.reset_blacklist_mirror()
+
+    @pytest.fixture
+    def synced_client(self):
+        """Cliente com versão publicada e um hash revogado no índice."""
+        mock_client = MagicMock()
+        mock_client.get.return_value = b"3"
+        revoked = _hash_token("revogado")
+        expires_at = (datetime.now(timezone.utc) + timedelta(minutes=30)).timestamp()
+        mock_client.zrangebyscore.return_value = [(revoked.encode(), expires_at)]
+        mock_client.exists.return_value = True
+        return mock_client
+
+    @patch('services.token_blacklist.get_redis_client')
+    @patch('services.token_blacklist.is_redis_available', return_value=True)
+    def test_miss_answered_in_memory(self, mock_available, mock_get_client, synced_client):
+        """Token fora do espelho não consulta EXISTS."""
+        mock_get_client.return_value = synced_client
+        assert is_blacklisted("token-ativo") is False
+        assert is_blacklisted("token-ativo") is False
+        synced_client.exists.assert_not_called()
+        # Versão lida uma única vez dentro do intervalo de sincronização
+        synced_client.get.assert_called_once()
+
+    @patch('services.token_blacklist.get_redis_client')
+    @patch('services.token_blacklist.is_redis_available', return_value=True)
+    def test_hit_confirmed_in_redis(self, mock_available, mock_get_client, synced_client):
+        """Hash presente no espelho é confirmado no Redis."""
+        mock_get_client.return_value = synced_client
+        assert is_blacklisted("revogado") is True
+        synced_client.exists.assert_called_once()
+
+    @patch('services.token_blacklist.get_redis_client')
+    @patch('services.token_blacklist.is_redis_available', return_value=True)
+    def test_local_add_visible_immediately(self, mock_available, mock_get_client, synced_client):
+        """Revogação feita neste processo entra no espelho sem esperar sincronização."""
+        mock_get_client.return_value = synced_client
+        assert is_blacklisted("token-ativo") is False
+        add_to_blacklist("token-ativo", 1800)
+        synced_client.zadd.assert_not_called()
+        synced_client.pipeline.return_value.zadd.assert_called_once()
+        assert is_blacklisted("token-ativo") is True
+
+    @patch('services.token_blacklist.is_redis_available', return_value=False)
+    def test_stale_mirror_falls_back(self, mock_available, mirror):
+        """Sem sincronização o espelho não é usado."""
+        assert mirror.get_blacklist_mirror_stats()["fresh"] is False
+        assert is_blacklisted("token-ativo") is False
+
+
 class TestTokenBlacklistIntegration:
     """Testes de integração para blacklist com autenticação."""
     
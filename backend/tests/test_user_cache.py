@@ -0,0 +1,85 @@
+"""
+Testes do cache da projeção de usuário usado na autenticação.
+"""
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import auth
+from auth import create_access_token, get_user_from_token
+from models import User
+from services.user_cache import clear_user_cache, get_cached_user, invalidate_user_cache
+
+
+@pytest.fixture
+def cache_enabled(monkeypatch):
+    monkeypatch.setattr(auth, "USER_CACHE_ENABLED", True)
+    clear_user_cache()
+    yield
+    clear_user_cache()
+
+
+def _select_count(session_factory, fn):
+    statements = []
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    db = session_factory()
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", before_execute)
+    try:
+        result = fn(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_execute)
+        db.close()
+    return result, len(statements)
+
+
+class TestUserCache:
+    """Testes do cache em dois níveis"""
+
+    def test_second_lookup_skips_database(self, cache_enabled, test_user, db_session):
+        token = create_access_token({"sub": str(test_user.id)})
+        factory = lambda: Session(bind=db_session.get_bind())
+        _, first = _select_count(factory, lambda db: get_user_from_token(db, token).id)
+        user_id, second = _select_count(factory, lambda db: get_user_from_token(db, token).id)
+        assert first == 1
+        assert second == 0
+        assert user_id == test_user.id
+
+    def test_cached_user_loads_other_fields_and_persists_changes(self, cache_enabled, test_user, db_session):
+        token = create_access_token({"sub": str(test_user.id)})
+        get_user_from_token(db_session, token)
+        db = Session(bind=db_session.get_bind())
+        try:
+            cached = get_user_from_token(db, token)
+            assert cached.email == "test@example.com"
+            cached.family_id = 42
+            db.commit()
+        finally:
+            db.close()
+        db_session.expire_all()
+        assert db_session.get(User, test_user.id).family_id == 42
+
+    def test_invalidation_applies_new_state(self, cache_enabled, test_user, db_session):
+        token = create_access_token({"sub": str(test_user.id)})
+        get_user_from_token(db_session, token)
+        test_user.is_active = False
+        db_session.commit()
+        invalidate_user_cache(test_user.id)
+        assert get_cached_user(test_user.id) is None
+        with pytest.raises(HTTPException) as exc:
+            get_user_from_token(db_session, token)
+        assert exc.value.status_code == 401
+
+    def test_unverified_email_rejected_from_cache(self, cache_enabled, test_user, db_session, monkeypatch):
+        monkeypatch.setattr(auth, "REQUIRE_EMAIL_VERIFICATION", True)
+        test_user.email_verified = False
+        db_session.commit()
+        token = create_access_token({"sub": str(test_user.id)})
+        for _ in range(2):
+            with pytest.raises(HTTPException) as exc:
+                get_user_from_token(db_session, token)
+            assert exc.value.status_code == 403
@@ -20,6 +20,10 @@ MAX_PAYLOAD_SIZE_KB = 1024  # 1MB (compatibilidade com testes)
 MAX_TEXT_FIELD_LENGTH = 1000
 MAX_URL_LENGTH = 2048
 
+# Padrões usados por sanitize_input (compilados uma vez; chamada por string do payload)
+_CONTROL_CHARS_RE = re.compile(r"[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]")
+_REPEATED_SPACES_RE = re.compile(r"[ ]{2,}")
+
 
 def sanitize_string(value: str, max_length: Optional[int] = None) -> str:
     """
@@ -211,10 +215,11 @@ def sanitize_input(value: Any, max_length: Optional[int] = None) -> Any:
     text = value if isinstance(value, str) else str(value)
 
     # Remover caracteres de controle (exceto \n, \r, \t)
-    text = re.sub(r"[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]", "", text)
+    text = _CONTROL_CHARS_RE.sub("", text)
 
     # Normalizar espaços (sem colapsar newlines/tabs)
-    text = re.sub(r"[ ]{2,}", " ", text)
+    if "  " in text:
+        text = _REPEATED_SPACES_RE.sub(" ", text)
 
     # Remover espaços nas extremidades (inclui quebras e tabs nas extremidades)
     text = text.strip()